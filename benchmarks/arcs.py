@@ -0,0 +1,100 @@
+""" Solving fillet heavy sketches with analytic and autograd derivatives of
+arc constraints.
+
+The sketch is a row of rectangles with all corners filleted (radius and
+tangency to both neighbouring sides), each placed by fixing one point.
+Points start randomly perturbed. Reports time of a jacobian evaluation and of
+the whole solve, with constructive placement disabled so that the solve
+evaluates the arc constraints. """
+
+import argparse
+import os
+import sys
+import time
+
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parametric import *  # noqa: E402
+
+arc_classes = [ArcLength, ArcRadius, ArcTangent, PointOnArc]
+
+
+def rounded_rectangle(solver, rng, x0, width, height, radius):
+    corners = numpy.array([(0, 0), (width, 0), (width, height), (0, height)])
+    corners = corners + [x0, 0]
+    directions = numpy.array([(1, 0), (0, 1), (-1, 0), (0, -1)])
+    arcs = []
+    for corner, incoming, outgoing in zip(
+        corners, numpy.roll(directions, 1, axis=0), directions
+    ):
+        a, b = corner + radius * numpy.array([-incoming, outgoing])
+        a = a + rng.normal(scale=0.1, size=2)
+        b = b + rng.normal(scale=0.1, size=2)
+        arcs.append(Arc(Point(*a), Point(*b), Variable(0.3 * radius)))
+
+    for i, arc in enumerate(arcs):
+        following = arcs[(i + 1) % len(arcs)]
+        line = LineSegment(arc.b, following.a)
+        solver.add_constraint(ArcRadius(arc, radius))
+        solver.add_constraint(ArcTangent(arc, line))
+        solver.add_constraint(ArcTangent(following, line))
+        if i % 2:
+            solver.add_constraint(Vertical(line.a, line.b))
+        else:
+            solver.add_constraint(Horizontal(line.a, line.b))
+        if i < 2:
+            solver.add_constraint(Length(line, [width, height][i] - 2 * radius))
+
+    solver.add_constraint(VariableFixed(arcs[0].a.x, x0))
+    solver.add_constraint(VariableFixed(arcs[0].a.y, radius))
+
+
+def build(rectangles):
+    rng = numpy.random.RandomState(0)
+    solver = Solver()
+    solver.auto_solve = False
+    solver.constructive = False
+    for i in range(rectangles):
+        rounded_rectangle(solver, rng, 20 * i, 10, 6, 1 + 0.5 * (i % 3))
+    return solver
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rectangles", type=int, default=20)
+    args = parser.parse_args()
+
+    analytic = {cls: cls.jacobian for cls in arc_classes}
+    for name in ["autograd", "analytic"]:
+        for cls in arc_classes:
+            cls.jacobian = analytic[cls] if name == "analytic" else None
+
+        solver = build(args.rectangles)
+        x = numpy.array([float(v) for v in solver._variables])
+        start = time.perf_counter()
+        solver._evaluate_constraint_jacobians(x)
+        jacobian_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        solver.solve()
+        solve_time = time.perf_counter() - start
+
+        x = numpy.array([float(v) for v in solver._variables])
+        error = numpy.max(numpy.abs(solver._evaluate_constraints(x)))
+        print(
+            "{:8}  constraints {:5}  jacobian {:7.2f} ms  solve {:8.1f} ms  "
+            "iterations {:4}  max error {:.1e}".format(
+                name,
+                solver._constraint_count,
+                jacobian_time * 1000,
+                solve_time * 1000,
+                solver.statistics["iterations"],
+                error,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+""" Adding a large sketch constraint by constraint versus in bulk.
+
+The sketch is a chain of segments with a length constraint on each of them.
+Run with `python -O` to skip the consistency checks after every addition,
+which otherwise dominate the time. """
+
+import argparse
+import os
+import sys
+import time
+
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parametric import *  # noqa: E402
+
+
+def points(count):
+    return [Point(i, i % 2) for i in range(count + 1)]
+
+
+def one_by_one(solver, points):
+    for a, b in zip(points[:-1], points[1:]):
+        solver.add_constraint(Length(LineSegment(a, b), 1))
+
+
+def bulk(solver, points):
+    indices = solver.add_variables([v for p in points for v in p]).reshape(-1, 2)
+    solver.add_constraints(
+        Length,
+        ax=indices[:-1, 0],
+        ay=indices[:-1, 1],
+        bx=indices[1:, 0],
+        by=indices[1:, 1],
+        length=numpy.ones(len(points) - 1),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--constraints", type=int, default=200000)
+    args = parser.parse_args()
+
+    if __debug__:
+        print("Warning: running without -O, consistency checks are enabled")
+
+    for name, method in [("add_constraint", one_by_one), ("add_constraints", bulk)]:
+        solver = Solver()
+        solver.auto_solve = False
+        p = points(args.constraints)
+
+        start = time.perf_counter()
+        method(solver, p)
+        elapsed = time.perf_counter() - start
+
+        print(
+            "{:16} {:8.1f} ms  ({:.2f} us per constraint)".format(
+                name, elapsed * 1000, elapsed / args.constraints * 1e6
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+""" Share of variables placed by the constructive stage and its effect on
+solve time.
+
+Each part of the sketch is a fixed corner, a dimensioned outline (angle and
+length of the first side, perpendicular sides with lengths after it) and
+a triangular bracket attached to the outline by lengths only, which has to be
+solved numerically. Vertices start randomly perturbed. """
+
+import argparse
+import os
+import sys
+import time
+
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parametric import *  # noqa: E402
+
+
+def build(parts, sides, constructive):
+    rng = numpy.random.RandomState(0)
+
+    def perturbed(x, y):
+        return Point(x + rng.uniform(-0.5, 0.5), y + rng.uniform(-0.5, 0.5))
+
+    solver = Solver()
+    solver.auto_solve = False
+    solver.constructive = constructive
+
+    for part in range(parts):
+        origin = 30 * part
+        # Staircase outline
+        points = [perturbed(origin, 0)]
+        for i in range(sides):
+            x, y = float(points[-1].x), float(points[-1].y)
+            points.append(perturbed(x + 2 * (i % 2 == 0), y + 2 * (i % 2 == 1)))
+        lines = [LineSegment(a, b) for a, b in zip(points[:-1], points[1:])]
+
+        solver.add_constraint(VariableFixed(points[0].x, origin))
+        solver.add_constraint(VariableFixed(points[0].y, 0))
+        solver.add_constraint(AbsoluteAngle(lines[0], 0))
+        for i, line in enumerate(lines):
+            solver.add_constraint(Length(line, 2))
+            if i > 0:
+                solver.add_constraint(Perpendicular(lines[i - 1], line))
+
+        # Bracket hanging from the last two outline points
+        tip = perturbed(float(points[-1].x) + 1, float(points[-1].y) + 2)
+        solver.add_constraint(Length(LineSegment(points[-1], tip), 2))
+        solver.add_constraint(Length(LineSegment(points[-2], tip), 3))
+    return solver
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--parts", type=int, default=10)
+    parser.add_argument("--sides", type=int, default=8)
+    args = parser.parse_args()
+
+    for constructive in [False, True]:
+        solver = build(args.parts, args.sides, constructive)
+        start = time.perf_counter()
+        solver.solve()
+        elapsed = time.perf_counter() - start
+
+        x = numpy.array([float(v) for v in solver._variables])
+        error = numpy.max(numpy.abs(solver._evaluate_constraints(x)))
+        print(
+            "constructive={!s:5}  variables {:4}  placed {:4} ({:5.1f} %)  "
+            "optimized {:4}  iterations {:3}  time {:8.1f} ms  max error {:.1e}".format(
+                constructive,
+                len(solver._variables),
+                solver.statistics["constructive_variables"],
+                100 * solver.statistics["constructive_variables"] / len(solver._variables),
+                solver.statistics["optimized_variables"],
+                solver.statistics["iterations"],
+                elapsed * 1000,
+                error,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+""" Large dimension edits solved directly versus by continuation.
+
+The sketch is a row of rectangles given by lengths of two sides,
+a perpendicular corner and horizontal and vertical edges, chained by lengths
+between neighbours, with the first corner fixed. Each edit multiplies or
+divides sides of one rectangle by a large factor. Reports total time of
+the solves, optimizer iterations, Newton iterations of the continuation,
+the largest remaining constraint error relative to
+the sketch size and the number of rectangles that ended up mirrored.
+Constructive placement is disabled, so that both modes solve the whole
+sketch. """
+
+import argparse
+import os
+import sys
+import time
+
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parametric import *  # noqa: E402
+
+
+def build(rectangles):
+    solver = Solver()
+    solver.auto_solve = False
+    solver.constructive = False
+    previous = None
+    sides = []
+    corners = []
+    for i in range(rectangles):
+        points = [
+            Point(10 * i, 0),
+            Point(10 * i + 4, 0),
+            Point(10 * i + 4, 3),
+            Point(10 * i, 3),
+        ]
+        lines = [LineSegment(points[j], points[(j + 1) % 4]) for j in range(4)]
+        rectangle_sides = [Length(lines[0], 4), Length(lines[1], 3)]
+        for constraint in rectangle_sides + [
+            Perpendicular(lines[0], lines[1]),
+            Horizontal(points[2], points[3]),
+            Vertical(points[3], points[0]),
+        ]:
+            solver.add_constraint(constraint)
+        if previous is None:
+            solver.add_constraint(VariableFixed(points[0].x, 0))
+            solver.add_constraint(VariableFixed(points[0].y, 0))
+        else:
+            solver.add_constraint(Length(LineSegment(previous[1], points[0]), 6))
+            solver.add_constraint(Horizontal(previous[1], points[0]))
+        previous = points
+        sides.append(rectangle_sides)
+        corners.append(points[:3])
+    solver.solve()
+    return solver, sides, corners
+
+
+def orientations(corners):
+    """ Sign of the turn at the second corner of each rectangle """
+    ret = []
+    for a, b, c in corners:
+        ret.append(
+            numpy.sign(
+                (float(b.x) - float(a.x)) * (float(c.y) - float(b.y))
+                - (float(b.y) - float(a.y)) * (float(c.x) - float(b.x))
+            )
+        )
+    return numpy.array(ret)
+
+
+def edits(rectangles, count, factor, seed):
+    rng = numpy.random.RandomState(seed)
+    ret = []
+    for _ in range(count):
+        rectangle = int(rng.randint(rectangles))
+        scale = factor if rng.uniform() < 0.5 else 1 / factor
+        ret.append((rectangle, scale))
+    return ret
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rectangles", type=int, default=20)
+    parser.add_argument("--edits", type=int, default=10)
+    parser.add_argument("--factor", type=float, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(
+        "{:13} {:>10} {:>11} {:>7} {:>10} {:>9}".format(
+            "mode", "time", "iterations", "newton", "max error", "mirrored"
+        )
+    )
+    for continuation in [False, True]:
+        solver, sides, corners = build(args.rectangles)
+        solver.continuation = continuation
+        expected = orientations(corners)
+        iterations = solver.statistics["iterations"]
+        newton = solver.statistics["continuation_iterations"]
+        elapsed = 0
+        error = 0
+        for rectangle, scale in edits(
+            args.rectangles, args.edits, args.factor, args.seed
+        ):
+            for side in sides[rectangle]:
+                solver.set_parameter(side, "length", side.length * scale)
+            start = time.perf_counter()
+            solver.solve()
+            elapsed += time.perf_counter() - start
+            x = numpy.array([float(v) for v in solver._variables])
+            error = max(
+                error,
+                numpy.max(numpy.abs(solver._evaluate_constraints(x)))
+                / solver._length_scale(x),
+            )
+        mirrored = numpy.count_nonzero(orientations(corners) != expected)
+        print(
+            "{:13} {:7.1f} ms {:11} {:7} {:10.1e} {:9}".format(
+                "continuation" if continuation else "direct",
+                elapsed * 1000,
+                solver.statistics["iterations"] - iterations,
+                solver.statistics["continuation_iterations"] - newton,
+                error,
+                mirrored,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+""" Measure how long `import parametric` takes in a fresh interpreter.
+
+Exits with non-zero status if the median import time exceeds the budget. """
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+measure = """
+import time
+start = time.perf_counter()
+import {module}
+end = time.perf_counter()
+print(end - start)
+"""
+
+
+def import_time(module):
+    output = subprocess.check_output(
+        [sys.executable, "-c", measure.format(module=module)],
+        cwd=repository,
+        universal_newlines=True,
+    )
+    return float(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument(
+        "--budget", type=float, default=0.2, help="Maximal median import time [s]"
+    )
+    args = parser.parse_args()
+
+    baseline = statistics.median(import_time("numpy") for _ in range(args.repeat))
+    times = [import_time("parametric") for _ in range(args.repeat)]
+    median = statistics.median(times)
+
+    print("numpy:      {:.1f} ms".format(baseline * 1000))
+    print(
+        "parametric: {:.1f} ms (min {:.1f} ms, max {:.1f} ms), budget {:.1f} ms".format(
+            median * 1000, min(times) * 1000, max(times) * 1000, args.budget * 1000
+        )
+    )
+
+    if median > args.budget:
+        print("Over budget!")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
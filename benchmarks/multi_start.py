@@ -0,0 +1,121 @@
+""" Multi-start solving compared to a single solve and to sequential restarts.
+
+Every sample is a quadrilateral with constraints that allow mirrored solutions
+and random initial positions. For each method prints the total time, number
+of failed solves and the mean squared distance of the solution from
+the initial positions (lower is better).
+
+Constructive placement is disabled, it would place three of the four points
+before the candidates are generated. """
+
+import argparse
+import os
+import sys
+import time
+import warnings
+
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parametric import *  # noqa: E402
+
+
+def random_quadrilateral(rng):
+    points = [Point(*rng.uniform(0, 10, 2)) for _ in range(4)]
+    lines = [LineSegment(points[i], points[(i + 1) % 4]) for i in range(4)]
+
+    solver = Solver()
+    solver.auto_solve = False
+    solver.constructive = False
+    for c in [
+        VariableFixed(points[0].x),
+        VariableFixed(points[0].y),
+        AbsoluteAngle(lines[0], 0),
+        Length(lines[0], 10),
+        Length(lines[1], 4),
+        Perpendicular(lines[0], lines[1]),
+        Length(lines[2], 10),
+        Perpendicular(lines[2], lines[3]),
+    ]:
+        solver.add_constraint(c)
+    return solver
+
+
+def values(solver):
+    return numpy.array([float(v) for v in solver._variables])
+
+
+def single(solver, k):
+    solver.solve()
+    return values(solver)
+
+
+def multi_start(solver, k):
+    solver.multi_start = k - 1
+    solver.multi_start_seed = 0
+    solver.solve()
+    return values(solver)
+
+
+def sequential(solver, k):
+    """ Restart SLSQP from k perturbed starting points, keep the best """
+    initial = values(solver)
+    rng = numpy.random.RandomState(0)
+    spread = solver.multi_start_spread * solver._length_scale(initial)
+    best = None
+    for i in range(k):
+        x0 = initial if i == 0 else initial + rng.normal(scale=spread, size=len(initial))
+        x = solver._minimize(initial, x0, solver._active_row_mask()).x
+        if numpy.max(numpy.abs(solver._evaluate_constraints(x))) > 1e-6:
+            continue
+        if best is None or numpy.sum((x - initial) ** 2) < numpy.sum(
+            (best - initial) ** 2
+        ):
+            best = x
+    return initial if best is None else best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--samples", type=int, default=50)
+    parser.add_argument("-k", type=int, default=8, help="Number of starting points")
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore")
+
+    for name, method in [
+        ("single", single),
+        ("multi-start", multi_start),
+        ("sequential", sequential),
+    ]:
+        rng = numpy.random.RandomState(1)
+        elapsed = 0
+        failures = 0
+        distances = []
+        for _ in range(args.samples):
+            solver = random_quadrilateral(rng)
+            initial = values(solver)
+
+            start = time.perf_counter()
+            x = method(solver, args.k)
+            elapsed += time.perf_counter() - start
+
+            if numpy.max(numpy.abs(solver._evaluate_constraints(x))) > 1e-6:
+                failures += 1
+            else:
+                distances.append(numpy.sum((x - initial) ** 2))
+
+        print(
+            "{:12} {:8.1f} ms  failed {:3}/{}  mean distance {:.2f}".format(
+                name,
+                elapsed * 1000,
+                failures,
+                args.samples,
+                numpy.mean(distances),
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
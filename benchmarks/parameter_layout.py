@@ -0,0 +1,80 @@
+""" Record (array of structs) versus columnar (struct of arrays) layout
+of constraint parameters.
+
+Fills a block of Perpendicular constraints between random segments and
+measures gathering of variable values through all index fields, and a full
+evaluation of the block, for both layouts. """
+
+import argparse
+import os
+import sys
+import timeit
+
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parametric import constraints, util  # noqa: E402
+
+
+def fill(array, rows, variable_count, rng):
+    fields = array.dtype.names
+    for _ in range(rows):
+        array.append(tuple(rng.randint(variable_count, size=len(fields))))
+
+
+def gather(x, parameters, fields):
+    return [x[parameters[field]] for field in fields]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    variable_count = 2 * args.rows
+    rng = numpy.random.RandomState(0)
+    x = rng.uniform(-100, 100, variable_count)
+
+    dtype = [
+        (name, numpy.uint32)
+        for name in ["ax1", "bx1", "ay1", "by1", "ax2", "bx2", "ay2", "by2"]
+    ]
+    fields = [name for name, _ in dtype]
+
+    layouts = [
+        ("records", util.DynamicArray(dtype=dtype)),
+        ("columns", util.ColumnarArray(dtype=dtype)),
+    ]
+
+    for name, array in layouts:
+        fill(array, args.rows, variable_count, numpy.random.RandomState(1))
+        parameters = array.array()
+
+        gather_time = min(
+            timeit.repeat(
+                lambda: gather(x, parameters, fields), number=1, repeat=args.repeat
+            )
+        )
+        evaluate_time = min(
+            timeit.repeat(
+                lambda: constraints.Perpendicular.evaluate(x, parameters),
+                number=1,
+                repeat=args.repeat,
+            )
+        )
+        print(
+            "{:8} gather {:7.2f} ms ({:6.1f} M rows/s)  "
+            "evaluate {:7.2f} ms ({:6.1f} M rows/s)".format(
+                name,
+                gather_time * 1000,
+                args.rows / gather_time / 1e6,
+                evaluate_time * 1000,
+                args.rows / evaluate_time / 1e6,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
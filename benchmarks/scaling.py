@@ -0,0 +1,83 @@
+""" Optimizer iteration counts for the same sketch drawn in different units.
+
+The sketch is a chain of segments with lengths, angles and perpendicularity
+constraints, starting from a perturbed position. It is scaled to micrometres,
+millimetres and metres (relative to a nominal size of 100 mm) and solved with
+and without automatic scaling. Reports iterations, function evaluations, time
+and the largest constraint error relative to the sketch size.
+
+Constructive placement is disabled, it would place the whole chain and
+every unit would report 0 iterations. With scaling the iteration counts should
+stay about the same for all units. """
+
+import argparse
+import os
+import sys
+import time
+import warnings
+
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parametric import *  # noqa: E402
+
+units = [("nm", 1e6), ("um", 1e3), ("mm", 1), ("m", 1e-3), ("km", 1e-6)]
+
+
+def build(segments, factor, scaling):
+    rng = numpy.random.RandomState(0)
+    points = [
+        Point(
+            factor * (10 * i + rng.uniform(-2, 2)), factor * (5 * (i % 2) + rng.uniform(-2, 2))
+        )
+        for i in range(segments + 1)
+    ]
+    lines = [LineSegment(a, b) for a, b in zip(points[:-1], points[1:])]
+
+    solver = Solver()
+    solver.auto_solve = False
+    solver.scaling = scaling
+    solver.constructive = False
+    solver.add_constraint(VariableFixed(points[0].x, 0))
+    solver.add_constraint(VariableFixed(points[0].y, 0))
+    solver.add_constraint(AbsoluteAngle(lines[0], 30))
+    for i, line in enumerate(lines):
+        solver.add_constraint(Length(line, factor * 10))
+        if i > 0:
+            solver.add_constraint(Perpendicular(lines[i - 1], line))
+    return solver
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--segments", type=int, default=10)
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore")
+    build(args.segments, 1, True).solve()  # Warm up lazy imports
+
+    print("units  scaling  iterations  evaluations     time  relative error")
+    for scaling in [False, True]:
+        for unit, factor in units:
+            solver = build(args.segments, factor, scaling)
+            start = time.perf_counter()
+            solver.solve()
+            elapsed = time.perf_counter() - start
+
+            x = numpy.array([float(v) for v in solver._variables])
+            error = numpy.max(numpy.abs(solver._evaluate_constraints(x)))
+            print(
+                "{:5}  {:7}  {:10}  {:11}  {:5.0f} ms  {:.1e}".format(
+                    unit,
+                    str(scaling),
+                    solver.statistics["iterations"],
+                    solver.statistics["function_evaluations"],
+                    elapsed * 1000,
+                    error / (factor * 10 * args.segments),
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
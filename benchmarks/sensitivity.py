@@ -0,0 +1,104 @@
+""" Predicting the effect of dimension edits versus solving.
+
+The sketch is a row of rectangles, each given by lengths of two sides,
+perpendicular sides and horizontal and vertical edges, chained by lengths
+between neighbours. The first corner is fixed. Length of the first side is
+scrubbed through a range of values. Reports time of the first prediction
+(including the factorization), of the following ones, of solves of the same
+edits and iterations of solves with and without the prediction as a warm
+start. """
+
+import argparse
+import os
+import sys
+import time
+
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parametric import *  # noqa: E402
+
+
+def build(rectangles):
+    solver = Solver()
+    solver.auto_solve = False
+    solver.constructive = False
+    solver.rigid_clusters = False
+    previous = None
+    first = None
+    for i in range(rectangles):
+        points = [
+            Point(10 * i, 0),
+            Point(10 * i + 4, 0),
+            Point(10 * i + 4, 3),
+            Point(10 * i, 3),
+        ]
+        lines = [LineSegment(points[j], points[(j + 1) % 4]) for j in range(4)]
+        side = Length(lines[0], 4)
+        first = first or side
+        for constraint in [
+            side,
+            Length(lines[1], 3),
+            Perpendicular(lines[0], lines[1]),
+            Horizontal(points[2], points[3]),
+            Vertical(points[3], points[0]),
+        ]:
+            solver.add_constraint(constraint)
+        if previous is None:
+            solver.add_constraint(VariableFixed(points[0].x, 0))
+            solver.add_constraint(VariableFixed(points[0].y, 0))
+            solver.add_constraint(AbsoluteAngle(lines[0], 0))
+        else:
+            solver.add_constraint(Length(LineSegment(previous[1], points[0]), 6))
+            solver.add_constraint(Horizontal(previous[1], points[0]))
+        previous = points
+    solver.solve()
+    return solver, first
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rectangles", type=int, default=100)
+    parser.add_argument("--steps", type=int, default=10)
+    args = parser.parse_args()
+
+    values = numpy.linspace(4.05, 4.5, args.steps)
+
+    solver, side = build(args.rectangles)
+    times = []
+    for value in values:
+        start = time.perf_counter()
+        solver.predict_parameter(side, "length", value)
+        times.append(time.perf_counter() - start)
+    print(
+        "variables {}  constraints {}".format(
+            len(solver._variables), solver._constraint_count
+        )
+    )
+    print("{:27} {:8.2f} ms".format("first prediction", times[0] * 1000))
+    print(
+        "{:27} {:8.2f} ms".format("following predictions", numpy.mean(times[1:]) * 1000)
+    )
+
+    for warm_start in [False, True]:
+        solver, side = build(args.rectangles)
+        iterations = solver.statistics["iterations"]
+        start = time.perf_counter()
+        for value in values:
+            if warm_start:
+                solver.predict_parameter(side, "length", value)
+            solver.set_parameter(side, "length", value)
+            solver.solve()
+        elapsed = time.perf_counter() - start
+        print(
+            "{:27} {:8.2f} ms per edit, {:5.1f} iterations".format(
+                "edit and solve" + (" (predicted)" if warm_start else ""),
+                elapsed / len(values) * 1000,
+                (solver.statistics["iterations"] - iterations) / len(values),
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+""" Latency and throughput of the solver server.
+
+Builds a chain of line segments in a session and then measures round trip
+times of drag requests (one request at a time) and throughput of pipelined
+requests. Starts its own server in a background thread unless an address
+of a running server is given. """
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parametric.server import Client, SolverServer  # noqa: E402
+
+
+def build_chain(client, session, segments):
+    client.request(session, "open", reset=True)
+    client.send(session, "point", name="p0", x=0, y=0)
+    client.send(session, "add", name="fix_x", type="VariableFixed", args=["p0.x", 0])
+    client.send(session, "add", name="fix_y", type="VariableFixed", args=["p0.y", 0])
+    for i in range(1, segments + 1):
+        client.send(session, "point", name="p{}".format(i), x=i, y=(i % 2))
+        client.send(
+            session, "line", name="l{}".format(i), a="p{}".format(i - 1), b="p{}".format(i)
+        )
+        client.send(
+            session, "add", name="len{}".format(i), type="Length", args=["l{}".format(i), 1]
+        )
+    for _ in range(3 + 3 * segments):
+        client.receive()
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--unix", help="Connect to a running server on this socket")
+    parser.add_argument("--segments", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    server = None
+    if args.unix is None:
+        server = SolverServer(os.path.join(tempfile.mkdtemp(), "socket"))
+        server.start()
+        address = server.address
+    else:
+        address = args.unix
+
+    with Client(address) as client:
+        start = time.perf_counter()
+        build_chain(client, "bench", args.segments)
+        print(
+            "build ({} segments, auto solve): {:.1f} ms".format(
+                args.segments, (time.perf_counter() - start) * 1000
+            )
+        )
+
+        latencies = []
+        for i in range(args.requests):
+            target = [args.segments + (i % 5) * 0.1, 1.0]
+            start = time.perf_counter()
+            client.request("bench", "drag", values={"p{}".format(args.segments): target})
+            latencies.append(time.perf_counter() - start)
+        print(
+            "drag latency: mean {:.2f} ms, p50 {:.2f} ms, p95 {:.2f} ms".format(
+                statistics.mean(latencies) * 1000,
+                percentile(latencies, 0.5) * 1000,
+                percentile(latencies, 0.95) * 1000,
+            )
+        )
+
+        start = time.perf_counter()
+        for i in range(args.requests):
+            client.send("bench", "get", names=["p{}".format(i % args.segments)])
+        for _ in range(args.requests):
+            client.receive()
+        elapsed = time.perf_counter() - start
+        print("pipelined get throughput: {:.0f} requests/s".format(args.requests / elapsed))
+
+        start = time.perf_counter()
+        for i in range(args.requests):
+            client.send(
+                "bench",
+                "drag",
+                values={"p{}".format(args.segments): [args.segments, (i % 5) * 0.1]},
+            )
+        for _ in range(args.requests):
+            client.receive()
+        elapsed = time.perf_counter() - start
+        print("pipelined drag throughput: {:.0f} requests/s".format(args.requests / elapsed))
+
+    if server is not None:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
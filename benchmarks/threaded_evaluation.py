@@ -0,0 +1,58 @@
+""" Serial versus thread pool evaluation of a large constraint block.
+
+Fills the solver with Perpendicular constraints between random segments
+and times evaluation of all constraint errors with different thread counts.
+Speedup depends on the number of available cores. """
+
+import argparse
+import os
+import sys
+import timeit
+
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parametric import *  # noqa: E402
+
+
+def build(rows, rng):
+    solver = Solver()
+    solver.auto_solve = False
+    variable_count = 2 * rows
+    indices = solver.add_variables(
+        [Variable(v) for v in rng.uniform(-100, 100, variable_count)]
+    )
+    columns = {
+        name: indices[rng.randint(variable_count, size=rows)]
+        for name in Perpendicular.variable_parameters
+    }
+    solver.add_constraints(Perpendicular, **columns)
+    return solver, rng.uniform(-100, 100, variable_count)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=2000000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--threads", type=int, nargs="+", default=[0, 2, 4, 8])
+    args = parser.parse_args()
+
+    print("{} cores available".format(os.cpu_count()))
+    solver, x = build(args.rows, numpy.random.RandomState(0))
+    for threads in args.threads:
+        solver.evaluation_threads = threads or None
+        elapsed = min(
+            timeit.repeat(
+                lambda: solver._evaluate_constraints(x), number=1, repeat=args.repeat
+            )
+        )
+        print(
+            "threads {:2}  {:8.1f} ms  ({:6.1f} M rows/s)".format(
+                threads, elapsed * 1000, args.rows / elapsed / 1e6
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
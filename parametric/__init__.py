@@ -1,3 +1,4 @@
 from .objects import *
 from .constraints import *
 from .solver import Solver
+from .spatial_index import SpatialIndex
@@ -1,32 +1,74 @@
 import math
 
-import autograd
-import autograd.numpy as numpy  # Wrapper to allow differentiating numpy functions
+from . import util
 
-# Work around missing arctan2 vjp in autograd version 1.2
-# The impormentation is mostly copied from unreleased autograd commit 47019791
-# Autograd, why U no release!?
-autograd.extend.defvjp(
-    numpy.arctan2,
-    lambda ans, x, y: lambda g: g * y / (x ** 2 + y ** 2),
-    lambda ans, x, y: lambda g: g * -x / (x ** 2 + y ** 2),
-)
+
+def _patch_autograd(module):
+    """ Work around missing arctan2 vjp in autograd version 1.2
+    The impormentation is mostly copied from unreleased autograd commit 47019791
+    Autograd, why U no release!? """
+    import autograd.extend
+
+    autograd.extend.defvjp(
+        module.arctan2,
+        lambda ans, x, y: lambda g: g * y / (x ** 2 + y ** 2),
+        lambda ans, x, y: lambda g: g * -x / (x ** 2 + y ** 2),
+    )
+
+
+# Wrapper to allow differentiating numpy functions.
+# Imported on first use to keep `import parametric` fast.
+numpy = util.LazyModule("autograd.numpy", _patch_autograd)
 
 
 class _Constraint:
+    # Unit of the error terms returned by `evaluate()`, either "distance" or "angle"
+    # (radians). Used by the solver to scale the problem.
+    error_unit = "distance"
+
+    # Names of parameters that are variables and of numerical parameters, in
+    # the order returned by `get_parameters()` (variables first).
+    # The solver uses these as a cached schema of the parameter array and
+    # they are required for `Solver.add_constraints()`. If left as None,
+    # the schema is inferred from the first added instance.
+    variable_parameters = None
+    numeric_parameters = ()
+
+    # Pairs of variable parameters that are x and y coordinates of a point.
+    point_parameters = ()
+    # True if the errors don't change when all points of the constraint are
+    # moved by the same rotation and translation. Such constraints may only use
+    # point variables. The solver uses them to find rigid clusters of points
+    # (see `Solver.rigid_clusters`).
+    rigid_invariant = False
+
+    # Optional static method `jacobian(variable_values, parameters)` returning
+    # derivatives of the errors by each of `variable_parameters`, as an array of
+    # shape (..., rows, len(variable_parameters)). When it is defined the solver
+    # uses it instead of differentiating `evaluate()` with autograd.
+    jacobian = None
+
     @staticmethod
     def evaluate(variable_values, parameters, output):
         """ Calculate error terms for each of the constraints in parameters.
-        Error term should either be either in distance units or radians.
+        Error term should either be either in distance units or radians,
+        as declared by `error_unit`.
         This is not strictly necessary, but will probably speed up the solver a bit.
 
         variable_values is a numpy array, parameters is a numpy record array with
         dtype matching `get_parameters()` return value. Variable instances in
         parameter arrays have integral type and are valid indices into variable_values,
         numerical parameters have floating point type.
+        variable_values may also be stacked into shape (k, n) to evaluate
+        k states at once, variables must then be accessed as
+        `variable_values[..., parameters["name"]]` and the result has shape (k, m).
 
         Output should be directly written into the output array (either like
-        `numpy.someop(somearg, out=output)`, or `output[:] = something`)"""
+        `numpy.someop(somearg, out=output)`, or `output[:] = something`)
+
+        Constraints are evaluated in blocks grouped by the class that defines
+        this method, so subclasses that inherit it (with the parameter layout)
+        share a block with their base class."""
         raise NotImplementedError()
 
     def get_parametrers(self):
@@ -42,9 +84,12 @@ class VariableFixed(_Constraint):
     This constraint is special in that it is auto generated for every variable and
     used as a soft constraint. """
 
+    variable_parameters = ("variable",)
+    numeric_parameters = ("value",)
+
     @staticmethod
     def evaluate(variable_values, parameters):
-        return variable_values[parameters["variable"]] - parameters["value"]
+        return variable_values[..., parameters["variable"]] - parameters["value"]
 
     def __init__(self, variable, value=None):
         self.variable = variable
@@ -60,13 +105,18 @@ class VariableFixed(_Constraint):
 class AbsoluteAngle(_Constraint):
     """ Line absolute angle """
 
+    error_unit = "angle"
+    variable_parameters = ("ax", "ay", "bx", "by")
+    numeric_parameters = ("angle",)
+    point_parameters = (("ax", "ay"), ("bx", "by"))
+
     @staticmethod
     def evaluate(variable_values, parameters):
-        ax = variable_values[parameters["ax"]]
-        bx = variable_values[parameters["bx"]]
+        ax = variable_values[..., parameters["ax"]]
+        bx = variable_values[..., parameters["bx"]]
         dx = bx - ax
-        ay = variable_values[parameters["ay"]]
-        by = variable_values[parameters["by"]]
+        ay = variable_values[..., parameters["ay"]]
+        by = variable_values[..., parameters["by"]]
         dy = by - ay
 
         angle = numpy.arctan2(dy, dx)
@@ -92,21 +142,25 @@ class AbsoluteAngle(_Constraint):
 
 
 class Perpendicular(_Constraint):
+    variable_parameters = ("ax1", "ay1", "bx1", "by1", "ax2", "ay2", "bx2", "by2")
+    point_parameters = (("ax1", "ay1"), ("bx1", "by1"), ("ax2", "ay2"), ("bx2", "by2"))
+    rigid_invariant = True
+
     @staticmethod
     def evaluate(variable_values, parameters):
-        ax1 = variable_values[parameters["ax1"]]
-        bx1 = variable_values[parameters["bx1"]]
+        ax1 = variable_values[..., parameters["ax1"]]
+        bx1 = variable_values[..., parameters["bx1"]]
         dx1 = bx1 - ax1
-        ay1 = variable_values[parameters["ay1"]]
-        by1 = variable_values[parameters["by1"]]
+        ay1 = variable_values[..., parameters["ay1"]]
+        by1 = variable_values[..., parameters["by1"]]
         dy1 = by1 - ay1
         len1_2 = dx1 * dx1 + dy1 * dy1
 
-        ax2 = variable_values[parameters["ax2"]]
-        bx2 = variable_values[parameters["bx2"]]
+        ax2 = variable_values[..., parameters["ax2"]]
+        bx2 = variable_values[..., parameters["bx2"]]
         dx2 = bx2 - ax2
-        ay2 = variable_values[parameters["ay2"]]
-        by2 = variable_values[parameters["by2"]]
+        ay2 = variable_values[..., parameters["ay2"]]
+        by2 = variable_values[..., parameters["by2"]]
         dy2 = by2 - ay2
         len2_2 = dx2 * dx2 + dy2 * dy2
 
@@ -133,14 +187,19 @@ class Perpendicular(_Constraint):
 
 
 class Length(_Constraint):
+    variable_parameters = ("ax", "ay", "bx", "by")
+    numeric_parameters = ("length",)
+    point_parameters = (("ax", "ay"), ("bx", "by"))
+    rigid_invariant = True
+
     @staticmethod
     def evaluate(variable_values, parameters):
         # TODO: Reuse arrays more
-        ax = variable_values[parameters["ax"]]
-        bx = variable_values[parameters["bx"]]
+        ax = variable_values[..., parameters["ax"]]
+        bx = variable_values[..., parameters["bx"]]
         dx = bx - ax
-        ay = variable_values[parameters["ay"]]
-        by = variable_values[parameters["by"]]
+        ay = variable_values[..., parameters["ay"]]
+        by = variable_values[..., parameters["by"]]
         dy = by - ay
         length = numpy.sqrt(dx * dx + dy * dy)
 
@@ -161,11 +220,16 @@ class Length(_Constraint):
 
 
 class VariablesEqual(_Constraint):
+    variable_parameters = ("v1", "v2")
+
     # TODO: When two variables are equal one of them should be removed from the
     # solver and replaced by the other in all uses
     @staticmethod
     def evaluate(variable_values, parameters):
-        return variable_values[parameters["v1"]] - variable_values[parameters["v2"]]
+        return (
+            variable_values[..., parameters["v1"]]
+            - variable_values[..., parameters["v2"]]
+        )
 
     def __init__(self, variable1, variable2):
         self.variable1 = variable1
@@ -189,7 +253,65 @@ class Horizontal(VariablesEqual):
         self.point2 = point2
 
 
+def _arc_chord(variable_values, parameters):
+    """ Return chord vector (dx, dy) and height h of arcs in parameters """
+    ax = variable_values[..., parameters["ax"]]
+    bx = variable_values[..., parameters["bx"]]
+    ay = variable_values[..., parameters["ay"]]
+    by = variable_values[..., parameters["by"]]
+    h = variable_values[..., parameters["h"]]
+    return bx - ax, by - ay, h
+
+
+# Below this value of 2h / c, arc length is calculated from a Taylor series
+_small_arc = 1e-3
+
+
+def _arc_length_factor(u):
+    """ Return (g(u), g'(u)) where g(u) = (1 + u^2) * atan(u) / u,
+    arc length is c * g(2h / c). Uses Taylor series for small u, where
+    the direct formula loses precision (and is undefined at u = 0). """
+    u2 = u * u
+    small = numpy.abs(u) < _small_arc
+    safe = numpy.where(small, 1.0, u)
+    ratio = numpy.arctan(safe) / safe
+
+    g = numpy.where(small, 1 + u2 * (2 / 3 - u2 * 2 / 15), (1 + u2) * ratio)
+    derivative = numpy.where(
+        small,
+        u * (4 / 3 - u2 * 8 / 15),
+        2 * safe * ratio + (1 - (1 + u2) * ratio) / safe,
+    )
+    return g, derivative
+
+
 class ArcLength(_Constraint):
+    """ Length of the arc (not the chord).
+    Arc height must be a Variable and the arc must not start flat (see `Arc`). """
+
+    variable_parameters = ("ax", "ay", "bx", "by", "h")
+    numeric_parameters = ("length",)
+    point_parameters = (("ax", "ay"), ("bx", "by"))
+
+    @staticmethod
+    def evaluate(variable_values, parameters):
+        dx, dy, h = _arc_chord(variable_values, parameters)
+        c = numpy.sqrt(dx * dx + dy * dy)
+        g, _ = _arc_length_factor(2 * h / c)
+        return c * g - parameters["length"]
+
+    @staticmethod
+    def jacobian(variable_values, parameters):
+        dx, dy, h = _arc_chord(variable_values, parameters)
+        c = numpy.sqrt(dx * dx + dy * dy)
+        u = 2 * h / c
+        g, derivative = _arc_length_factor(u)
+
+        by_c = (g - u * derivative) / c
+        return numpy.stack(
+            [-by_c * dx, -by_c * dy, by_c * dx, by_c * dy, 2 * derivative], axis=-1
+        )
+
     def __init__(self, arc, length):
         self.arc = arc
         self.length = length
@@ -197,56 +319,234 @@ class ArcLength(_Constraint):
     def get_parameters(self):
         return [
             ("ax", self.arc.a.x),
-            ("ay", self.arc.a.x),
+            ("ay", self.arc.a.y),
             ("bx", self.arc.b.x),
             ("by", self.arc.b.y),
-            ("h", self.arc.r),
-            ("length", self.length)
+            ("h", self.arc.h),
+            ("length", self.length),
         ]
 
+
+class ArcRadius(_Constraint):
+    """ Radius of the arc.
+    Arc height must be a Variable and the arc must not start flat (see `Arc`).
+
+    The error is (c^2 / 4 + h^2) / (2 * radius) - |h|, which is zero exactly
+    when the arc has the given radius and, unlike the difference of radii,
+    stays finite as the arc gets flat. """
+
+    variable_parameters = ("ax", "ay", "bx", "by", "h")
+    numeric_parameters = ("radius",)
+    point_parameters = (("ax", "ay"), ("bx", "by"))
+
     @staticmethod
     def evaluate(variable_values, parameters):
-        ax = variable_values[parameters["ax"]]
-        bx = variable_values[parameters["bx"]]
-        ay = variable_values[parameters["ay"]]
-        by = variable_values[parameters["by"]]
+        dx, dy, h = _arc_chord(variable_values, parameters)
+        return (dx * dx + dy * dy) / (8 * parameters["radius"]) + (
+            h * h / (2 * parameters["radius"]) - numpy.abs(h)
+        )
 
-        h = variable_values[parameters["h"]]
-        c = numpy.hypot(bx - ax, by - ay)
+    @staticmethod
+    def jacobian(variable_values, parameters):
+        dx, dy, h = _arc_chord(variable_values, parameters)
+        radius = parameters["radius"]
+        by_d = 1 / (4 * radius)
+        return numpy.stack(
+            [
+                -by_d * dx,
+                -by_d * dy,
+                by_d * dx,
+                by_d * dy,
+                h / radius - numpy.sign(h),
+            ],
+            axis=-1,
+        )
+
+    def __init__(self, arc, radius):
+        self.arc = arc
+        self.radius = radius
 
-        h2 = 2 * h
+    def get_parameters(self):
+        return [
+            ("ax", self.arc.a.x),
+            ("ay", self.arc.a.y),
+            ("bx", self.arc.b.x),
+            ("by", self.arc.b.y),
+            ("h", self.arc.h),
+            ("radius", self.radius),
+        ]
 
-        length_h0 = c + h2 * h2 / c
-        length = numpy.atan2(h2, c) * (c * c / h2 + h2)
-        length = numpy.where(h < 1e-6, length_h0, length)
 
-        return length - variable_values[parameters["length"]]
+class ArcTangent(_Constraint):
+    """ Line is parallel to the tangent of an arc at one of its end points.
+    The end point is b if the line shares a point with it, a otherwise;
+    this constraint doesn't make the line touch the arc, that needs a shared
+    point (as in fillets) or another constraint.
+    Arc height must be a Variable.
 
+    The error is sine of the angle between the line and the tangent.
+    The tangent is the chord rotated by 2 * atan(2h / c), its direction is
+    calculated without trigonometric functions as
+    (c^2 - 4h^2) * d +- 4hc * n, where d is the chord and n its right normal. """
 
-class ArcRadius(_Constraint):
-    def __init__(self, arc, length):
+    error_unit = "angle"
+    variable_parameters = ("ax", "ay", "bx", "by", "h", "lax", "lay", "lbx", "lby")
+    numeric_parameters = ("end",)
+    point_parameters = (("ax", "ay"), ("bx", "by"), ("lax", "lay"), ("lbx", "lby"))
+
+    @staticmethod
+    def _tangent(variable_values, parameters):
+        dx, dy, h = _arc_chord(variable_values, parameters)
+        c2 = dx * dx + dy * dy
+        c = numpy.sqrt(c2)
+        s = c2 - 4 * h * h
+        k = 4 * parameters["end"] * h
+        tx = s * dx + k * c * dy
+        ty = s * dy - k * c * dx
+        lx = (
+            variable_values[..., parameters["lbx"]]
+            - variable_values[..., parameters["lax"]]
+        )
+        ly = (
+            variable_values[..., parameters["lby"]]
+            - variable_values[..., parameters["lay"]]
+        )
+        return dx, dy, h, c, s, k, tx, ty, lx, ly
+
+    @staticmethod
+    def evaluate(variable_values, parameters):
+        dx, dy, h, c, s, k, tx, ty, lx, ly = ArcTangent._tangent(
+            variable_values, parameters
+        )
+        # |t| = c * (c^2 + 4h^2)
+        tangent_length = c * (c * c + 4 * h * h)
+        return (lx * ty - ly * tx) / (numpy.sqrt(lx * lx + ly * ly) * tangent_length)
+
+    @staticmethod
+    def jacobian(variable_values, parameters):
+        dx, dy, h, c, s, k, tx, ty, lx, ly = ArcTangent._tangent(
+            variable_values, parameters
+        )
+        line_length2 = lx * lx + ly * ly
+        tangent_length2 = tx * tx + ty * ty
+        norm = 1 / numpy.sqrt(line_length2 * tangent_length2)
+        error = (lx * ty - ly * tx) * norm
+
+        # Gradients by the line direction and by the tangent vector
+        line_x = ty * norm - error * lx / line_length2
+        line_y = -tx * norm - error * ly / line_length2
+        tangent_x = -ly * norm - error * tx / tangent_length2
+        tangent_y = lx * norm - error * ty / tangent_length2
+
+        # Derivatives of the tangent vector by chord components and height
+        by_dx = tangent_x * (2 * dx * dx + s + k * dx * dy / c) + tangent_y * (
+            2 * dx * dy - k * dx * dx / c - k * c
+        )
+        by_dy = tangent_x * (2 * dx * dy + k * dy * dy / c + k * c) + tangent_y * (
+            2 * dy * dy + s - k * dx * dy / c
+        )
+        end = 4 * parameters["end"] * c
+        by_h = tangent_x * (end * dy - 8 * h * dx) - tangent_y * (end * dx + 8 * h * dy)
+
+        return numpy.stack(
+            [-by_dx, -by_dy, by_dx, by_dy, by_h, -line_x, -line_y, line_x, line_y],
+            axis=-1,
+        )
+
+    def __init__(self, arc, line):
         self.arc = arc
-        self.radius = radius
+        self.line = line
 
     def get_parameters(self):
+        at_b = self.arc.b is self.line.a or self.arc.b is self.line.b
         return [
             ("ax", self.arc.a.x),
-            ("ay", self.arc.a.x),
+            ("ay", self.arc.a.y),
             ("bx", self.arc.b.x),
             ("by", self.arc.b.y),
-            ("h", self.arc.r),
-            ("radius", self.radius)
+            ("h", self.arc.h),
+            ("lax", self.line.a.x),
+            ("lay", self.line.a.y),
+            ("lbx", self.line.b.x),
+            ("lby", self.line.b.y),
+            ("end", -1.0 if at_b else 1.0),
         ]
 
+
+class PointOnArc(_Constraint):
+    """ Point lies on the circle of an arc.
+    Arc height must be a Variable.
+
+    With q the point relative to the chord midpoint and t its distance from
+    the chord (positive on the side of positive heights), the point is on
+    the circle when h * (|q|^2 - 2th + h^2) / (c^2 / 4 + h^2) + t - h is zero.
+    This is approximately the distance from the circle and has no singularity
+    for flat arcs, where it becomes the distance from the chord line. """
+
+    variable_parameters = ("ax", "ay", "bx", "by", "h", "px", "py")
+    point_parameters = (("ax", "ay"), ("bx", "by"), ("px", "py"))
+
+    @staticmethod
+    def _terms(variable_values, parameters):
+        ax = variable_values[..., parameters["ax"]]
+        ay = variable_values[..., parameters["ay"]]
+        bx = variable_values[..., parameters["bx"]]
+        by = variable_values[..., parameters["by"]]
+        h = variable_values[..., parameters["h"]]
+        dx = bx - ax
+        dy = by - ay
+        qx = variable_values[..., parameters["px"]] - (ax + bx) / 2
+        qy = variable_values[..., parameters["py"]] - (ay + by) / 2
+
+        c2 = dx * dx + dy * dy
+        c = numpy.sqrt(c2)
+        t = (qx * dy - qy * dx) / c
+        d = c2 / 4 + h * h
+        p = qx * qx + qy * qy - 2 * t * h + h * h
+        return dx, dy, h, qx, qy, c, t, d, p
+
     @staticmethod
     def evaluate(variable_values, parameters):
-        ax = variable_values[parameters["ax"]]
-        bx = variable_values[parameters["bx"]]
-        ay = variable_values[parameters["ay"]]
-        by = variable_values[parameters["by"]]
+        dx, dy, h, qx, qy, c, t, d, p = PointOnArc._terms(variable_values, parameters)
+        return h * p / d + t - h
 
-        h = variable_values[parameters["h"]]
-        c = numpy.hypot(bx - ax, by - ay)
+    @staticmethod
+    def jacobian(variable_values, parameters):
+        dx, dy, h, qx, qy, c, t, d, p = PointOnArc._terms(variable_values, parameters)
+        by_t = 1 - 2 * h * h / d
+        by_q2 = h / d
+        by_d = -h * p / (d * d)
+        by_h = (p + 2 * h * (h - t)) / d + 2 * h * by_d - 1
+
+        by_qx = by_t * dy / c + 2 * by_q2 * qx
+        by_qy = -by_t * dx / c + 2 * by_q2 * qy
+        by_dx = by_t * (-qy / c - t * dx / (c * c)) + by_d * dx / 2
+        by_dy = by_t * (qx / c - t * dy / (c * c)) + by_d * dy / 2
+
+        return numpy.stack(
+            [
+                -by_qx / 2 - by_dx,
+                -by_qy / 2 - by_dy,
+                -by_qx / 2 + by_dx,
+                -by_qy / 2 + by_dy,
+                by_h,
+                by_qx,
+                by_qy,
+            ],
+            axis=-1,
+        )
+
+    def __init__(self, arc, point):
+        self.arc = arc
+        self.point = point
 
-        radius = c * c / (8 * h) + h
-        return radius - variable_values[parameters["radius"]]
+    def get_parameters(self):
+        return [
+            ("ax", self.arc.a.x),
+            ("ay", self.arc.a.y),
+            ("bx", self.arc.b.x),
+            ("by", self.arc.b.y),
+            ("h", self.arc.h),
+            ("px", self.point.x),
+            ("py", self.point.y),
+        ]
@@ -0,0 +1,216 @@
+""" Constructive placement of variables that are determined by a sequence of
+constraints, before the numerical solver runs.
+
+Rules:
+    - VariableFixed sets its variable.
+    - VariablesEqual copies a known variable to the other one.
+    - AbsoluteAngle with Length of the same segment places an unknown end point
+      relative to a known one.
+    - Perpendicular with Length of a segment places its unknown end point
+      relative to a known one, if the other segment is known. Of the two mirrored
+      solutions the one closer to the current position is used. """
+
+import numpy
+
+from . import constraints
+
+
+def propagate(parameters, x, known=None, blocked=None):
+    """ Find variables that can be placed constructively.
+
+    parameters is a dict mapping responsible class to its parameter array
+    (records or dict of columns), x are the current variable values.
+    known optionally marks variables that are already placed (at their values
+    in x), to continue an earlier propagation, variables marked by blocked are
+    never placed.
+    Returns a tuple (known, values), where known is a boolean mask of placed
+    variables and values are x with the placed variables updated.
+    Rules are applied in rounds until no more variables can be placed.
+    Consistency with other constraints is not checked. """
+    if known is None:
+        known = numpy.zeros(len(x), dtype=bool)
+    else:
+        known = known.copy()
+    if blocked is None:
+        blocked = numpy.zeros(len(x), dtype=bool)
+    values = numpy.array(x, dtype=numpy.float64)
+
+    fixed = parameters.get(constraints.VariableFixed)
+    if fixed is not None:
+        variables = numpy.asarray(fixed["variable"], dtype=numpy.intp)
+        apply = ~known[variables] & ~blocked[variables]
+        values[variables[apply]] = numpy.asarray(fixed["value"])[apply]
+        known[variables[apply]] = True
+
+    copies = _copies(parameters.get(constraints.VariablesEqual))
+    placements = _placements(parameters)
+    perpendiculars = _perpendiculars(parameters)
+
+    while True:
+        changed = False
+
+        sources, targets = copies
+        apply = known[sources] & ~(known | blocked)[targets]
+        if numpy.any(apply):
+            values[targets[apply]] = values[sources[apply]]
+            known[targets[apply]] = True
+            changed = True
+
+        origins, points, offsets = placements
+        apply = numpy.all(known[origins], axis=1) & ~numpy.any(
+            (known | blocked)[points], axis=1
+        )
+        if numpy.any(apply):
+            values[points[apply]] = values[origins[apply]] + offsets[apply]
+            known[points[apply]] = True
+            changed = True
+
+        lines, origins, points, lengths = perpendiculars
+        apply = (
+            numpy.all(known[lines], axis=1)
+            & numpy.all(known[origins], axis=1)
+            & ~numpy.any((known | blocked)[points], axis=1)
+        )
+        if numpy.any(apply):
+            line_values = values[lines[apply]]
+            directions = line_values[:, 2:] - line_values[:, :2]
+            norms = numpy.hypot(directions[:, 0], directions[:, 1])
+            valid = norms > 0
+            apply[apply] = valid
+            normals = (
+                numpy.stack([-directions[valid, 1], directions[valid, 0]], axis=1)
+                * (lengths[apply] / norms[valid])[:, numpy.newaxis]
+            )
+
+            origin_values = values[origins[apply]]
+            current = x[points[apply]]
+            positive = origin_values + normals
+            negative = origin_values - normals
+            closer = numpy.sum((positive - current) ** 2, axis=1) <= numpy.sum(
+                (negative - current) ** 2, axis=1
+            )
+            values[points[apply]] = numpy.where(
+                closer[:, numpy.newaxis], positive, negative
+            )
+            known[points[apply]] = True
+            changed = changed or numpy.any(apply)
+
+        if not changed:
+            break
+
+    return known, values
+
+
+def _copies(parameters):
+    """ Return (sources, targets) arrays for VariablesEqual in both directions """
+    if parameters is None:
+        empty = numpy.empty(0, dtype=numpy.intp)
+        return empty, empty
+    v1 = numpy.asarray(parameters["v1"], dtype=numpy.intp)
+    v2 = numpy.asarray(parameters["v2"], dtype=numpy.intp)
+    return numpy.concatenate([v1, v2]), numpy.concatenate([v2, v1])
+
+
+def _points(parameters, pair):
+    x, y = pair
+    return numpy.stack([parameters[x], parameters[y]], axis=1).astype(numpy.intp)
+
+
+def _segment_lengths(parameters):
+    """ Return function mapping segments (arrays of start and end points) to
+    the lengths given by Length constraints (nan if there is none). """
+    lengths = parameters.get(constraints.Length)
+    if lengths is None or not len(lengths["length"]):
+        return lambda a, b: numpy.full(len(a), numpy.nan)
+
+    known_keys = _segment_keys(
+        _points(lengths, ("ax", "ay")), _points(lengths, ("bx", "by"))
+    )
+
+    def lookup(a, b):
+        keys = _segment_keys(a, b)
+        unique, inverse = numpy.unique(
+            numpy.concatenate([known_keys, keys]), axis=0, return_inverse=True
+        )
+        inverse = inverse.reshape(-1)
+        by_key = numpy.full(len(unique), numpy.nan)
+        by_key[inverse[: len(known_keys)]] = lengths["length"]
+        return by_key[inverse[len(known_keys) :]]
+
+    return lookup
+
+
+def _segment_keys(a, b):
+    """ Direction independent key of each segment, shape (k, 4) """
+    swap = (a[:, 0] > b[:, 0]) | ((a[:, 0] == b[:, 0]) & (a[:, 1] > b[:, 1]))
+    swap = swap[:, numpy.newaxis]
+    return numpy.hstack([numpy.where(swap, b, a), numpy.where(swap, a, b)])
+
+
+def _placements(parameters):
+    """ Return (origins, points, offsets), each of shape (k, 2), placing
+    point = origin + offset, from AbsoluteAngle constraints with a matching
+    Length. """
+    angles = parameters.get(constraints.AbsoluteAngle)
+    if angles is None:
+        empty = numpy.empty((0, 2), dtype=numpy.intp)
+        return empty, empty, numpy.empty((0, 2))
+
+    a = _points(angles, ("ax", "ay"))
+    b = _points(angles, ("bx", "by"))
+    lengths = _segment_lengths(parameters)(a, b)
+    has_length = ~numpy.isnan(lengths)
+    a = a[has_length]
+    b = b[has_length]
+    angle = numpy.asarray(angles["angle"])[has_length]
+    offsets = lengths[has_length, numpy.newaxis] * numpy.stack(
+        [numpy.cos(angle), numpy.sin(angle)], axis=1
+    )
+
+    return (
+        numpy.concatenate([a, b]),
+        numpy.concatenate([b, a]),
+        numpy.concatenate([offsets, -offsets]),
+    )
+
+
+def _perpendiculars(parameters):
+    """ Return (lines, origins, points, lengths): known line (k, 4) and
+    origin and point (k, 2) of a line perpendicular to it with a given length,
+    from Perpendicular constraints with matching Length. """
+    perpendicular = parameters.get(constraints.Perpendicular)
+    if perpendicular is None:
+        empty = numpy.empty((0, 2), dtype=numpy.intp)
+        return numpy.empty((0, 4), dtype=numpy.intp), empty, empty, numpy.empty(0)
+
+    lookup = _segment_lengths(parameters)
+    line_points = [
+        (
+            _points(perpendicular, ("ax" + i, "ay" + i)),
+            _points(perpendicular, ("bx" + i, "by" + i)),
+        )
+        for i in ("1", "2")
+    ]
+
+    lines = []
+    origins = []
+    points = []
+    lengths = []
+    for known_index, other_index in [(0, 1), (1, 0)]:
+        known_a, known_b = line_points[known_index]
+        a, b = line_points[other_index]
+        other_lengths = lookup(a, b)
+        has_length = ~numpy.isnan(other_lengths)
+        known_line = numpy.hstack([known_a, known_b])[has_length]
+        for origin, point in [(a, b), (b, a)]:
+            lines.append(known_line)
+            origins.append(origin[has_length])
+            points.append(point[has_length])
+            lengths.append(other_lengths[has_length])
+
+    return (
+        numpy.concatenate(lines),
+        numpy.concatenate(origins),
+        numpy.concatenate(points),
+        numpy.concatenate(lengths),
+    )
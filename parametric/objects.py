@@ -34,7 +34,12 @@ class Arc:
     def __init__(self, a, b, h):
         """ Create an arc with endpoints a and b and height h.
         Height is a distance between (midpoint of a and b) and midpoint of the arc.
-        Positive height puts the arc midpoint on the right side of line ab (arc curves counterclockwise), negative on the left. """
+        Positive height puts the arc midpoint on the right side of line ab (arc curves counterclockwise), negative on the left.
+
+        Height should not start at exactly zero when the arc is constrained by
+        ArcLength or ArcRadius: their errors are symmetric in h, so a flat arc
+        has zero derivative with respect to h and the solver can't choose the
+        side to bend to. Start with a small height of the desired sign instead. """
         self.a = a
         self.b = b
         self.h = h
@@ -0,0 +1,450 @@
+""" Recording of solver workloads and their deterministic replay.
+
+A recording is a gzipped file with one JSON object per line. The first line is
+a header with solver options, every following line is one operation:
+
+- {"op": "variable", "id": id, "value": value, "name": name}: First use
+  of a variable.
+- {"op": "value", "id": id, "value": value}: Variable value changed outside
+  of the solver.
+- {"op": "add_constraint", "id": id, "type": class name, "parameters":
+  [[name, {"variable": id} or number], ...], "time": seconds}
+- {"op": "add_constraints", "ids": [id, ...], "type": class name, "columns":
+  {name: [variable id or number, ...]}, "time": seconds}
+- {"op": "add_variables", "variables": [variable id, ...], "time": seconds}
+- {"op": "remove_constraint", "id": id, "time": seconds}
+- {"op": "remove_constraints", "ids": [id, ...], "time": seconds}
+- {"op": "set_parameter", "id": id, "name": name, "value": value,
+  "parameters": {name: number, ...}, "time": seconds}: parameters are
+  the numeric parameters of the constraint after the change.
+- {"op": "set_parameters", "ids": [id, ...], "name": name, "values": [number,
+  ...], "time": seconds}
+- {"op": "suspend_constraints" or "resume_constraints", "ids": [id, ...],
+  "time": seconds}
+- {"op": "add_to_group", "name": name, "ids": [id, ...], "time": seconds}
+- {"op": "remove_group", "suspend_group" or "resume_group", "name": name,
+  "time": seconds}
+- {"op": "set_values", "values": [[variable id, value], ...], "time": seconds}
+- {"op": "solve", "time": seconds}
+
+Constraints are replayed through their class' evaluation kernel with
+the recorded parameters, so a recording can be replayed against any version
+of the library that has the same constraint classes.
+
+Use `python -m parametric.recording LOG` to replay a recording and compare
+timings. """
+
+import argparse
+import collections
+import functools
+import gzip
+import json
+import time
+
+import numpy
+
+from . import constraints
+from . import objects
+
+_format_version = 1
+
+# Solver options stored in the header and restored on replay
+_options = [
+    "auto_solve",
+    "scaling",
+    "multi_start",
+    "multi_start_spread",
+    "multi_start_seed",
+    "continuation",
+    "continuation_step",
+    "continuation_iterations",
+    "continuation_min_step",
+    "rigid_clusters",
+    "constructive",
+    "evaluation_threads",
+    "parallel_threshold",
+]
+
+
+class Recorder:
+    """ Writes operations performed on a solver into a file.
+    Use `Solver.start_recording()` to create one. """
+
+    def __init__(self, solver, path):
+        self._solver = solver
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+        self._variable_ids = {}  # variable -> id
+        self._variable_values = {}  # variable -> last value known to the recording
+        self._depth = 0
+
+        self._write(
+            {
+                "op": "header",
+                "version": _format_version,
+                "options": {
+                    option: getattr(solver, option)
+                    for option in _options
+                    if hasattr(solver, option)
+                },
+            }
+        )
+        solver.add_listener(self._on_change)
+
+    def close(self):
+        self._solver.remove_listener(self._on_change)
+        self._file.close()
+
+    def record(self, method, solver, args, kwargs):
+        """ Call method(solver, *args, **kwargs) and record it, unless it was
+        called from within another recorded operation. """
+        if self._depth > 0:
+            return method(solver, *args, **kwargs)
+
+        entry = getattr(self, "_encode_" + method.__name__)(*args, **kwargs)
+
+        self._depth += 1
+        try:
+            start = time.perf_counter()
+            ret = method(solver, *args, **kwargs)
+            entry["time"] = round(time.perf_counter() - start, 7)
+        finally:
+            self._depth -= 1
+
+        result = getattr(self, "_result_" + method.__name__, None)
+        if result is not None:
+            result(entry, ret)
+
+        self._write(entry)
+        return ret
+
+    def _write(self, entry):
+        self._file.write(json.dumps(entry, separators=(",", ":")))
+        self._file.write("\n")
+
+    def _on_change(self, variables):
+        for variable in variables:
+            if variable in self._variable_values:
+                self._variable_values[variable] = float(variable)
+
+    def _encode_variable(self, variable):
+        """ Return JSON representation of a variable reference, write its
+        definition or value change if necessary. """
+        value = float(variable)
+        try:
+            variable_id = self._variable_ids[variable]
+        except KeyError:
+            variable_id = len(self._variable_ids)
+            self._variable_ids[variable] = variable_id
+            self._write(
+                {"op": "variable", "id": variable_id, "value": value, "name": variable.name}
+            )
+        else:
+            if self._variable_values[variable] != value:
+                self._write({"op": "value", "id": variable_id, "value": value})
+        self._variable_values[variable] = value
+        return variable_id
+
+    def _encode_add_constraint(self, constraint):
+        parameters = []
+        for name, value in constraint.get_parameters():
+            if isinstance(value, objects.Variable):
+                value = {"variable": self._encode_variable(value)}
+            parameters.append([name, value])
+
+        return {
+            "op": "add_constraint",
+            "type": type(constraint).__name__,
+            "parameters": parameters,
+        }
+
+    def _result_add_constraint(self, entry, constraint_id):
+        entry["id"] = constraint_id
+
+    def _encode_add_variables(self, variables):
+        return {
+            "op": "add_variables",
+            "variables": [self._encode_variable(variable) for variable in variables],
+        }
+
+    def _encode_add_constraints(self, cls, **columns):
+        encoded = {}
+        for name, column in columns.items():
+            if name in cls.variable_parameters:
+                encoded[name] = [
+                    self._encode_variable(self._solver._variables.key(int(index)))
+                    for index in column
+                ]
+            else:
+                encoded[name] = [float(value) for value in column]
+        return {"op": "add_constraints", "type": cls.__name__, "columns": encoded}
+
+    def _result_add_constraints(self, entry, ids):
+        entry["ids"] = [int(constraint_id) for constraint_id in ids]
+
+    def _encode_remove_constraint(self, constraint):
+        return {
+            "op": "remove_constraint",
+            "id": self._solver._constraint_ids.get(constraint),
+        }
+
+    def _encode_remove_constraints(self, ids):
+        return {
+            "op": "remove_constraints",
+            "ids": [int(constraint_id) for constraint_id in ids],
+        }
+
+    def _encode_set_parameter(self, constraint, name, value):
+        return {
+            "op": "set_parameter",
+            "id": self._solver._constraint_ids.get(constraint),
+            "name": name,
+            "value": value,
+        }
+
+    def _result_set_parameter(self, entry, _):
+        constraint = self._solver._constraint_objects[entry["id"]]
+        entry["parameters"] = {
+            name: value
+            for name, value in constraint.get_parameters()
+            if not isinstance(value, objects.Variable)
+        }
+
+    def _encode_set_parameters(self, ids, name, values):
+        ids = [int(constraint_id) for constraint_id in ids]
+        values = [float(value) for value in numpy.broadcast_to(values, len(ids))]
+        return {"op": "set_parameters", "ids": ids, "name": name, "values": values}
+
+    def _encode_suspend_constraints(self, ids):
+        return {"op": "suspend_constraints", "ids": _encode_ids(ids)}
+
+    def _encode_resume_constraints(self, ids):
+        return {"op": "resume_constraints", "ids": _encode_ids(ids)}
+
+    def _encode_add_to_group(self, name, ids):
+        return {"op": "add_to_group", "name": name, "ids": _encode_ids(ids)}
+
+    def _encode_remove_group(self, name):
+        return {"op": "remove_group", "name": name}
+
+    def _encode_suspend_group(self, name):
+        return {"op": "suspend_group", "name": name}
+
+    def _encode_resume_group(self, name):
+        return {"op": "resume_group", "name": name}
+
+    def _encode_set_values(self, values):
+        return {
+            "op": "set_values",
+            "values": [
+                [self._encode_variable(variable), float(value)]
+                for variable, value in values.items()
+            ],
+        }
+
+    def _encode_solve(self):
+        for variable in self._solver._variables:
+            self._encode_variable(variable)
+        return {"op": "solve"}
+
+
+def _encode_ids(ids):
+    return [int(constraint_id) for constraint_id in numpy.ravel(ids)]
+
+
+def read(path):
+    """ Return header and list of entries of a recording """
+    with gzip.open(path, "rt", encoding="utf-8") as fp:
+        entries = [json.loads(line) for line in fp]
+    if not entries or entries[0]["op"] != "header":
+        raise ValueError("Not a solver recording")
+    header = entries.pop(0)
+    if header["version"] > _format_version:
+        raise ValueError("Unsupported recording version {}".format(header["version"]))
+    return header, entries
+
+
+def replay(path, solver=None):
+    """ Re-execute a recording against a solver (a new one by default).
+    Returns a list of tuples (entry, replay time) for all timed operations. """
+    header, entries = read(path)
+
+    if solver is None:
+        from .solver import Solver
+
+        solver = Solver()
+    for option, value in header["options"].items():
+        if hasattr(solver, option):
+            setattr(solver, option, value)
+
+    variables = {}
+    constraints_by_id = {}  # recorded id -> constraint object
+    ids = {}  # recorded id -> id in the replaying solver
+    ret = []
+
+    for entry in entries:
+        op = entry["op"]
+        if op == "variable":
+            variables[entry["id"]] = objects.Variable(entry["value"], entry["name"])
+            continue
+        elif op == "value":
+            variables[entry["id"]]._value = entry["value"]
+            continue
+        elif op == "add_constraint":
+            constraint = _make_constraint(entry, variables)
+            constraints_by_id[entry["id"]] = constraint
+            call = functools.partial(solver.add_constraint, constraint)
+        elif op == "add_variables":
+            call = functools.partial(
+                solver.add_variables, [variables[i] for i in entry["variables"]]
+            )
+        elif op == "add_constraints":
+            call = functools.partial(_add_constraints, solver, entry, variables)
+        elif op == "remove_constraint":
+            call = functools.partial(
+                solver.remove_constraint, constraints_by_id.pop(entry["id"])
+            )
+        elif op == "remove_constraints":
+            call = functools.partial(
+                solver.remove_constraints, [ids.pop(i) for i in entry["ids"]]
+            )
+        elif op == "set_parameter":
+            call = functools.partial(
+                _set_parameter, solver, constraints_by_id[entry["id"]], entry
+            )
+        elif op == "set_parameters":
+            call = functools.partial(
+                solver.set_parameters,
+                [ids[i] for i in entry["ids"]],
+                entry["name"],
+                entry["values"],
+            )
+        elif op in ("suspend_constraints", "resume_constraints"):
+            call = functools.partial(
+                getattr(solver, op), [ids[i] for i in entry["ids"]]
+            )
+        elif op == "add_to_group":
+            call = functools.partial(
+                solver.add_to_group, entry["name"], [ids[i] for i in entry["ids"]]
+            )
+        elif op in ("remove_group", "suspend_group", "resume_group"):
+            call = functools.partial(getattr(solver, op), entry["name"])
+        elif op == "set_values":
+            values = {variables[i]: value for i, value in entry["values"]}
+            call = functools.partial(_set_values, solver, values)
+        elif op == "solve":
+            call = solver.solve
+        else:
+            raise ValueError("Unknown operation {!r}".format(op))
+
+        start = time.perf_counter()
+        result = call()
+        ret.append((entry, time.perf_counter() - start))
+
+        if op == "add_constraint":
+            ids[entry["id"]] = result
+        elif op == "add_constraints":
+            ids.update(zip(entry["ids"], result))
+
+    return ret
+
+
+def _add_constraints(solver, entry, variables):
+    cls = getattr(constraints, entry["type"])
+    columns = {}
+    for name, column in entry["columns"].items():
+        if name in cls.variable_parameters:
+            columns[name] = solver.variable_indices([variables[i] for i in column])
+        else:
+            columns[name] = column
+    return solver.add_constraints(cls, **columns)
+
+
+def _make_constraint(entry, variables):
+    """ Create a constraint of the recorded class, returning the recorded
+    parameters. """
+    cls = getattr(constraints, entry["type"])
+    parameters = [
+        (name, variables[value["variable"]] if isinstance(value, dict) else value)
+        for name, value in entry["parameters"]
+    ]
+    constraint = cls.__new__(cls)
+    constraint.get_parameters = lambda: parameters
+    return constraint
+
+
+def _set_parameter(solver, constraint, entry):
+    """ Replay a parameter change of a constraint created by `_make_constraint()`.
+    Its attributes are not known, so the recorded parameters are used. """
+    setattr(constraint, entry["name"], entry["value"])
+    parameters = constraint.get_parameters()
+    parameters[:] = [
+        (name, entry["parameters"].get(name, value)) for name, value in parameters
+    ]
+    solver.set_parameter(constraint, entry["name"], entry["value"])
+
+
+def _set_values(solver, values):
+    try:
+        set_values = solver.set_values
+    except AttributeError:
+        # Older solvers can only be moved by changing the variables directly
+        for variable, value in values.items():
+            variable._value = value
+        solver._auto_solve()
+    else:
+        set_values(values)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay a solver recording and compare timings"
+    )
+    parser.add_argument("recording")
+    parser.add_argument(
+        "--all", action="store_true", help="Print every operation, not just the summary"
+    )
+    args = parser.parse_args()
+
+    results = replay(args.recording)
+
+    totals = collections.OrderedDict()
+    if args.all:
+        print("{:>6}  {:20} {:>11} {:>11} {:>8}".format("#", "op", "recorded", "replay", "diff"))
+    for i, (entry, replay_time) in enumerate(results):
+        recorded_time = entry["time"]
+        total = totals.setdefault(entry["op"], [0, 0.0, 0.0])
+        total[0] += 1
+        total[1] += recorded_time
+        total[2] += replay_time
+        if args.all:
+            print(
+                "{:6}  {:20} {:8.3f} ms {:8.3f} ms {:+7.1f}%".format(
+                    i,
+                    entry["op"],
+                    recorded_time * 1000,
+                    replay_time * 1000,
+                    _relative_diff(recorded_time, replay_time),
+                )
+            )
+
+    print("{:20} {:>6} {:>11} {:>11} {:>8}".format("op", "count", "recorded", "replay", "diff"))
+    for op, (count, recorded_time, replay_time) in totals.items():
+        print(
+            "{:20} {:6} {:8.1f} ms {:8.1f} ms {:+7.1f}%".format(
+                op,
+                count,
+                recorded_time * 1000,
+                replay_time * 1000,
+                _relative_diff(recorded_time, replay_time),
+            )
+        )
+
+
+def _relative_diff(recorded_time, replay_time):
+    if recorded_time == 0:
+        return 0.0
+    return 100 * (replay_time - recorded_time) / recorded_time
+
+
+if __name__ == "__main__":
+    main()
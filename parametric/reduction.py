@@ -0,0 +1,248 @@
+import numpy
+
+
+class Reduction:
+    """ Parametrization of the solver variables by a smaller vector.
+
+    Constant variables are not optimized at all, variables that are not part
+    of any cluster are optimized directly, each rigid cluster of points is moved
+    as a whole by a translation and a rotation, which keeps all constraints
+    internal to the cluster satisfied.
+
+    The reduced vector is laid out as values of the free variables followed
+    by (tx, ty, angle) of each cluster. """
+
+    def __init__(self, variable_count, clusters=(), rows=slice(None), constants=None):
+        """ clusters is a sequence of pairs (indices, shape), both of shape (k, 2):
+        indices of variables with x and y coordinates of the cluster points
+        and coordinates of the points relative to the cluster origin
+        (centered, so that their mean is zero).
+        rows selects constraint errors that stay in the reduced problem.
+        constants is a pair (indices, values) of variables that are not
+        optimized at all. """
+        self.variable_count = variable_count
+        self.cluster_count = len(clusters)
+        self.rows = rows
+
+        sizes = numpy.array([len(indices) for indices, _ in clusters], dtype=numpy.intp)
+        # Points of all clusters, one after another
+        self._starts = numpy.cumsum(sizes) - sizes
+        self._sizes = sizes
+        self._point_clusters = numpy.repeat(numpy.arange(len(clusters)), sizes)
+        if clusters:
+            self._indices = numpy.concatenate([indices for indices, _ in clusters])
+            self._shape = numpy.concatenate(
+                [numpy.asarray(shape, dtype=numpy.float64) for _, shape in clusters]
+            )
+        else:
+            self._indices = numpy.empty((0, 2), dtype=numpy.intp)
+            self._shape = numpy.empty((0, 2))
+
+        if constants is None:
+            constants = (numpy.empty(0, dtype=numpy.intp), numpy.empty(0))
+        self._constant_indices, self._constant_values = constants
+
+        fixed = numpy.zeros(variable_count, dtype=bool)
+        fixed[self._indices] = True
+        fixed[self._constant_indices] = True
+        self.free = numpy.flatnonzero(~fixed)
+
+        self.size = len(self.free) + 3 * self.cluster_count
+
+    def is_identity(self):
+        return self.cluster_count == 0 and len(self._constant_indices) == 0
+
+    def reduce(self, x):
+        """ Return reduced vector whose expansion best matches x.
+        Cluster transforms are least squares fits of the cluster shape to
+        the points in x. """
+        y = numpy.empty(self.size)
+        y[: len(self.free)] = x[self.free]
+        if self.cluster_count == 0:
+            return y
+
+        points = x[self._indices]
+        centers = self._sum(points, axis=0) / self._sizes[:, numpy.newaxis]
+        offsets = points - centers[self._point_clusters]
+        transforms = y[len(self.free) :].reshape(-1, 3)
+        transforms[:, :2] = centers
+        transforms[:, 2] = numpy.arctan2(
+            self._sum(
+                self._shape[:, 0] * offsets[:, 1] - self._shape[:, 1] * offsets[:, 0]
+            ),
+            self._sum(numpy.sum(self._shape * offsets, axis=1)),
+        )
+        return y
+
+    def expand(self, y):
+        """ Return full variable vector for a reduced vector y """
+        x = numpy.empty(self.variable_count)
+        x[self.free] = y[: len(self.free)]
+        x[self._constant_indices] = self._constant_values
+        if self.cluster_count == 0:
+            return x
+
+        transforms = y[len(self.free) :].reshape(-1, 3)[self._point_clusters]
+        c = numpy.cos(transforms[:, 2])
+        s = numpy.sin(transforms[:, 2])
+        x[self._indices[:, 0]] = (
+            transforms[:, 0] + c * self._shape[:, 0] - s * self._shape[:, 1]
+        )
+        x[self._indices[:, 1]] = (
+            transforms[:, 1] + s * self._shape[:, 0] + c * self._shape[:, 1]
+        )
+        return x
+
+    def chain(self, jacobian, y):
+        """ Convert derivatives by the full variables (last axis of jacobian)
+        to derivatives by the reduced vector at y. """
+        if self.is_identity():
+            return jacobian
+
+        free_count = len(self.free)
+        ret = numpy.empty(jacobian.shape[:-1] + (self.size,))
+        ret[..., :free_count] = jacobian[..., self.free]
+        if self.cluster_count == 0:
+            return ret
+
+        angles = y[free_count + 2 :: 3][self._point_clusters]
+        c = numpy.cos(angles)
+        s = numpy.sin(angles)
+
+        jacobian_x = jacobian[..., self._indices[:, 0]]
+        jacobian_y = jacobian[..., self._indices[:, 1]]
+
+        ret[..., free_count::3] = self._sum(jacobian_x)
+        ret[..., free_count + 1 :: 3] = self._sum(jacobian_y)
+        ret[..., free_count + 2 :: 3] = self._sum(
+            jacobian_x * (-s * self._shape[:, 0] - c * self._shape[:, 1])
+            + jacobian_y * (c * self._shape[:, 0] - s * self._shape[:, 1])
+        )
+        return ret
+
+    def scales(self, length_scale):
+        """ Return characteristic size of each reduced variable, angles are
+        dimensionless. """
+        ret = numpy.full(self.size, length_scale, dtype=numpy.float64)
+        ret[len(self.free) + 2 :: 3] = 1
+        return ret
+
+    def _sum(self, values, axis=-1):
+        """ Sum values of points of each cluster along an axis """
+        return numpy.add.reduceat(values, self._starts, axis=axis)
+
+
+def fit_pose(shape, points, known):
+    """ Place points of a rigid cluster with the given shape (see
+    `RigidCluster.shape()`) by a translation and rotation that matches points
+    where known (both of shape (k, 2)).
+    The pose is a least squares fit to the points with both coordinates known,
+    returns the placed points, or None if there aren't two distinct such points
+    and the pose is not determined. Other known coordinates are not checked. """
+    full = numpy.all(known, axis=1)
+    if numpy.count_nonzero(full) < 2:
+        return None
+    shape_offsets = shape[full] - numpy.mean(shape[full], axis=0)
+    point_center = numpy.mean(points[full], axis=0)
+    point_offsets = points[full] - point_center
+    if not numpy.any(shape_offsets):
+        return None
+
+    angle = numpy.arctan2(
+        numpy.sum(
+            shape_offsets[:, 0] * point_offsets[:, 1]
+            - shape_offsets[:, 1] * point_offsets[:, 0]
+        ),
+        numpy.sum(shape_offsets * point_offsets),
+    )
+    c = numpy.cos(angle)
+    s = numpy.sin(angle)
+    offsets = shape - numpy.mean(shape[full], axis=0)
+    return point_center + numpy.stack(
+        [c * offsets[:, 0] - s * offsets[:, 1], s * offsets[:, 0] + c * offsets[:, 1]],
+        axis=1,
+    )
+
+
+class RigidCluster:
+    """ Group of points with rigid invariant constraints between them.
+
+    `indices` has shape (k, 2) with variable indices of point coordinates,
+    `parts` is a list of (responsible class, parameters) with the internal
+    constraints, their variable parameters are indices into the flattened
+    `indices`. `rows` is a list of (block, rows) locating the same constraints
+    in the solver.
+
+    The solver first creates a cluster for each connected group of points,
+    which doesn't have to be rigid, and then extracts rigid parts of it
+    using `subcluster()`. """
+
+    def __init__(self, indices, parts, rows):
+        self.indices = indices
+        self.parts = parts
+        self.rows = rows
+
+    def key(self):
+        """ Hashable description of the cluster structure """
+        return (self.indices.tobytes(),) + tuple(
+            (cls, parameters.tobytes()) for cls, parameters in self.parts
+        )
+
+    def evaluate(self, x):
+        """ Evaluate internal constraints for values of the cluster variables
+        (in the order of flattened `indices`). """
+        return numpy.concatenate([cls.evaluate(x, p) for cls, p in self.parts])
+
+    def error_scales(self, length_scale):
+        """ Scale of each internal constraint error, as in Solver._error_scales """
+        unit_scales = {"distance": length_scale, "angle": 1.0}
+        return numpy.concatenate(
+            [numpy.full(len(p), unit_scales[cls.error_unit]) for cls, p in self.parts]
+        )
+
+    def constraint_points(self):
+        """ Return list with a set of cluster point indices used by each internal
+        constraint, in the order of `evaluate()` output. """
+        ret = []
+        for cls, parameters in self.parts:
+            points = self._point_ids(cls, parameters)
+            ret.extend(set(row) for row in points.tolist())
+        return ret
+
+    def subcluster(self, points):
+        """ Return cluster made of the given points (indices into `indices`)
+        and constraints between them. """
+        mapping = numpy.full(len(self), -1, dtype=numpy.intp)
+        mapping[points] = numpy.arange(len(points))
+
+        parts = []
+        rows = []
+        for (cls, parameters), (block, block_rows) in zip(self.parts, self.rows):
+            inside = numpy.all(mapping[self._point_ids(cls, parameters)] >= 0, axis=1)
+            if not numpy.any(inside):
+                continue
+            sub_parameters = parameters[inside]
+            for pair in cls.point_parameters:
+                for name in pair:
+                    local = sub_parameters[name]
+                    sub_parameters[name] = 2 * mapping[local // 2] + local % 2
+            parts.append((cls, sub_parameters))
+            rows.append((block, block_rows[inside]))
+
+        return RigidCluster(self.indices[points], parts, rows)
+
+    def shape(self, values):
+        """ Return point coordinates relative to their mean for values of
+        the cluster variables """
+        points = numpy.reshape(values, (-1, 2))
+        return points - numpy.mean(points, axis=0)
+
+    @staticmethod
+    def _point_ids(cls, parameters):
+        """ Cluster point index of each point of each constraint, shape (rows, points) """
+        return numpy.stack(
+            [parameters[x] // 2 for x, _ in cls.point_parameters], axis=1
+        ).astype(numpy.intp)
+
+    def __len__(self):
+        return len(self.indices)
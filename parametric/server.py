@@ -0,0 +1,371 @@
+""" Long running solver server.
+
+Hosts named solver sessions and accepts commands over a local stream socket
+(Unix domain socket or TCP on localhost). The protocol is line based: every
+request is a single line with a JSON object, the server answers every request
+with a single JSON line, in order. Clients may send several requests before
+reading the responses.
+
+Request: {"session": name, "command": command, ...command arguments}
+Response: {"ok": true, "changed": {variable name: value}, ...command results}
+or {"ok": false, "error": message}.
+
+"changed" contains values of all variables of the session that were changed
+since the previous response in the session.
+
+Commands:
+- open: Create the session (or reset it if `reset` is true).
+- close: Delete the session.
+- variable {name, value}: Create a named variable.
+- point {name, x, y}: Create a point; its variables are named "<name>.x"
+  and "<name>.y".
+- line {name, a, b}: Create a line segment between two named points.
+- arc {name, a, b, h}: Create an arc between two named points, with height given by
+  a named variable.
+- add {name, type, args}: Create a constraint of the given class from
+  parametric.constraints and add it to the solver. String arguments are names
+  of session objects.
+- remove {name}: Remove a named constraint.
+- set {name, parameter, value}: Change a numeric parameter of a named
+  constraint (for example "length") and re-solve.
+- drag {values}: Move objects to new positions ({point name: [x, y]} or
+  {variable name: value}) and re-solve.
+- solve: Run the solver.
+- get {names}: Return current values of named points and variables.
+"""
+
+import argparse
+import json
+import os
+import socket
+import socketserver
+import threading
+
+from . import constraints
+from . import objects
+from .solver import Solver
+
+
+class SolverServer:
+    """ Serve solver sessions on a Unix socket (if address is a string) or TCP
+    (if address is a (host, port) tuple). """
+
+    def __init__(self, address):
+        self._sessions = {}
+        self._sessions_lock = threading.Lock()
+
+        if isinstance(address, str):
+            server_class = _ThreadingUnixServer
+        else:
+            server_class = _ThreadingTCPServer
+        self._server = server_class(address, _RequestHandler)
+        self._server.solver_server = self
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def start(self):
+        """ Start serving in a background thread. Returns the thread. """
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def shutdown(self):
+        """ Stop serving (serve_forever must be running) and close the socket """
+        self._server.shutdown()
+        self.close()
+
+    def close(self):
+        """ Close the listening socket and all sessions """
+        self._server.server_close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+        with self._sessions_lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+
+    def handle(self, request):
+        """ Process a single request (decoded JSON), return the response dict """
+        try:
+            command = request["command"]
+            name = request["session"]
+
+            if command == "open":
+                replaced = None
+                with self._sessions_lock:
+                    if request.get("reset") or name not in self._sessions:
+                        replaced = self._sessions.get(name)
+                        self._sessions[name] = _Session()
+                    session = self._sessions[name]
+                if replaced is not None:
+                    replaced.close()
+            elif command == "close":
+                with self._sessions_lock:
+                    session = self._sessions.pop(name)
+                session.close()
+                return {"ok": True}
+            else:
+                with self._sessions_lock:
+                    session = self._sessions[name]
+
+            with session.lock:
+                result = session.handle(command, request)
+                result["ok"] = True
+                result["changed"] = session.pop_changes()
+                return result
+        except Exception as e:
+            return {"ok": False, "error": "{}: {}".format(type(e).__name__, e)}
+
+
+class Client:
+    """ Blocking client for SolverServer. """
+
+    def __init__(self, address):
+        if isinstance(address, str):
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._socket.connect(address)
+        self._reader = self._socket.makefile("r", encoding="utf-8")
+        self._writer = self._socket.makefile("w", encoding="utf-8")
+
+    def send(self, session, command, **kwargs):
+        """ Send a request without waiting for the response. """
+        kwargs["session"] = session
+        kwargs["command"] = command
+        self._writer.write(json.dumps(kwargs))
+        self._writer.write("\n")
+
+    def receive(self):
+        """ Wait for the next response. Raises RuntimeError if the request failed. """
+        self._writer.flush()
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("Server closed the connection")
+        response = json.loads(line)
+        if not response.pop("ok"):
+            raise RuntimeError(response["error"])
+        return response
+
+    def request(self, session, command, **kwargs):
+        """ Send a request and wait for its response. """
+        self.send(session, command, **kwargs)
+        return self.receive()
+
+    def close(self):
+        self._reader.close()
+        self._writer.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _Session:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.solver = Solver()
+        self.objects = {}  # name -> variable, point, line, arc or constraint
+        self._changed = {}  # variable -> None, used as an ordered set
+        self.solver.add_listener(self._on_change)
+
+    def close(self):
+        """ Release resources of the solver, waits for a running command """
+        with self.lock:
+            self.solver.close()
+
+    def handle(self, command, request):
+        try:
+            method = getattr(self, "_command_" + command)
+        except AttributeError:
+            raise ValueError("Unknown command {!r}".format(command))
+        return method(request) or {}
+
+    def pop_changes(self):
+        ret = {
+            variable.name: float(variable)
+            for variable in self._changed
+            if variable.name is not None
+        }
+        self._changed.clear()
+        return ret
+
+    def _on_change(self, variables):
+        for variable in variables:
+            self._changed[variable] = None
+
+    def _check_unused(self, *names):
+        for name in names:
+            if name in self.objects:
+                raise ValueError("Name {!r} already used".format(name))
+
+    def _define(self, name, obj):
+        self._check_unused(name)
+        self.objects[name] = obj
+
+    def _get(self, name, cls):
+        obj = self.objects[name]
+        if not isinstance(obj, cls):
+            raise TypeError("{!r} is not a {}".format(name, cls.__name__))
+        return obj
+
+    def _command_open(self, request):
+        pass
+
+    def _command_variable(self, request):
+        name = request["name"]
+        self._define(name, objects.Variable(float(request["value"]), name))
+
+    def _command_point(self, request):
+        name = request["name"]
+        point = objects.Point(float(request["x"]), float(request["y"]), name)
+        # Check all names first to never leave a partially defined point
+        self._check_unused(name, point.x.name, point.y.name)
+        self.objects[name] = point
+        self.objects[point.x.name] = point.x
+        self.objects[point.y.name] = point.y
+
+    def _command_line(self, request):
+        self._define(
+            request["name"],
+            objects.LineSegment(
+                self._get(request["a"], objects.Point),
+                self._get(request["b"], objects.Point),
+            ),
+        )
+
+    def _command_arc(self, request):
+        self._define(
+            request["name"],
+            objects.Arc(
+                self._get(request["a"], objects.Point),
+                self._get(request["b"], objects.Point),
+                self._get(request["h"], objects.Variable),
+            ),
+        )
+
+    def _command_add(self, request):
+        name = request["name"]
+        self._check_unused(name)
+
+        cls = getattr(constraints, request["type"], None)
+        if (
+            not isinstance(cls, type)
+            or not issubclass(cls, constraints._Constraint)
+            or cls.__name__.startswith("_")
+        ):
+            raise ValueError("Unknown constraint type {!r}".format(request["type"]))
+        args = [
+            self.objects[arg] if isinstance(arg, str) else arg
+            for arg in request.get("args", [])
+        ]
+        constraint = cls(*args)
+
+        # Solve separately, so that the constraint can be removed again if
+        # the solve fails, the client couldn't address it without a name
+        self.solver.auto_solve = False
+        try:
+            self.solver.add_constraint(constraint)
+            try:
+                self.solver.solve()
+            except Exception:
+                self.solver.remove_constraint(constraint)
+                raise
+        finally:
+            self.solver.auto_solve = True
+        self.objects[name] = constraint
+
+    def _command_remove(self, request):
+        name = request["name"]
+        self.solver.remove_constraint(self._get(name, constraints._Constraint))
+        del self.objects[name]
+
+    def _command_set(self, request):
+        self.solver.set_parameter(
+            self._get(request["name"], constraints._Constraint),
+            request["parameter"],
+            request["value"],
+        )
+
+    def _command_drag(self, request):
+        values = {}
+        for name, value in request["values"].items():
+            obj = self.objects[name]
+            if isinstance(obj, objects.Point):
+                values[obj.x], values[obj.y] = value
+            else:
+                values[self._get(name, objects.Variable)] = value
+        self.solver.set_values(values)
+
+    def _command_solve(self, request):
+        self.solver.solve()
+
+    def _command_get(self, request):
+        values = {}
+        for name in request["names"]:
+            obj = self.objects[name]
+            if isinstance(obj, objects.Point):
+                values[name] = [float(obj.x), float(obj.y)]
+            else:
+                values[name] = float(self._get(name, objects.Variable))
+        return {"values": values}
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        solver_server = self.server.solver_server
+        for line in self.rfile:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line.decode("utf-8"))
+            except ValueError as e:
+                response = {"ok": False, "error": "Invalid request: {}".format(e)}
+            else:
+                response = solver_server.handle(request)
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+
+class _ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parametric solver server")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--unix", help="Path of the Unix socket to listen on")
+    group.add_argument("--port", type=int, help="TCP port to listen on (localhost)")
+    args = parser.parse_args()
+
+    if args.unix is not None:
+        address = args.unix
+    else:
+        address = ("127.0.0.1", args.port)
+
+    server = SolverServer(address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,190 +1,1952 @@
-import collections_extended
 import numpy
-import scipy.optimize
-import autograd
 
 import collections
+import concurrent.futures
+import functools
 import itertools
 
 from . import util
+from . import constructive
 from . import objects
+from . import reduction
 
-from pprint import pprint
+# Heavy dependencies are only imported when the solver needs them
+optimize = util.LazyModule("scipy.optimize")
+sparse = util.LazyModule("scipy.sparse")
+csgraph = util.LazyModule("scipy.sparse.csgraph")
+splinalg = util.LazyModule("scipy.sparse.linalg")
+autograd = util.LazyModule("autograd")
+
+
+def _recorded(method):
+    """ Decorator for Solver methods that are logged when recording is enabled """
+
+    @functools.wraps(method)
+    def wrapped(self, *args, **kwargs):
+        if self._recorder is None:
+            return method(self, *args, **kwargs)
+        return self._recorder.record(method, self, args, kwargs)
+
+    return wrapped
 
 
 class Solver:
     _variable_index_dtype = numpy.uint32
+    _constraint_id_dtype = numpy.uint32
     _number_dtype = numpy.float64
+    # Block index in locations of unused constraint ids
+    _free_block = numpy.iinfo(numpy.uint32).max
+
+    # Maximal absolute constraint error of a solution accepted by multi-start
+    # (after scaling, if enabled)
+    _feasibility_tolerance = 1e-6
+    # Scaled error below which a rigid cluster is considered already solved
+    _cluster_tolerance = 1e-10
+    # Smaller clusters don't save enough variables to be worth it
+    _minimum_cluster_size = 3
+    _newton_iterations = 30
+    # Stopping tolerance of SLSQP for the squared distance from the initial
+    # values in absolute units (the scipy default)
+    _ftol = 1e-6
+    # Scaled tolerances below this are beyond the floating point precision of
+    # the objective and only make SLSQP run out of iterations
+    _min_ftol = 1e-14
+    # Relative regularization of the normal equations of `predict_parameter()`,
+    # keeps them solvable with redundant constraints
+    _sensitivity_damping = 1e-10
+    # Predicted changes smaller than this (relative to the sketch size) are
+    # not reported
+    _prediction_tolerance = 1e-9
+    # Constraint error (relative like _feasibility_tolerance) accepted after
+    # a continuation step, the final solve polishes the result
+    _continuation_tolerance = 1e-4
 
     def __init__(self):
-        self._variables = util.IndexedDict()  # variable -> bag of constraints
+        self._variables = util.IndexedDict()  # variable -> None, defines indices
+        # variable index -> constraint ids, one entry per use of the variable.
+        # Payload is index of the parameter field into block.variable_fields, so
+        # each entry points to a single (block, row, field) location.
+        self._incidence = util.Incidence(
+            dtype=self._constraint_id_dtype, payload_dtype=numpy.uint8
+        )
         self._objects = {}  # object -> count
+        # Variables registered by `add_variables()` since the last removal of
+        # constraints, removed then if they aren't used
+        self._added_variables = set()
+
         self._constraints = {}  # responsible class -> _ConstraintBlock
+        self._blocks = []  # block index -> _ConstraintBlock
+
+        self._constraint_ids = {}  # constraint -> constraint id
+        # constraint id -> constraint (None if free or added without an object)
+        self._constraint_objects = []
+        self._free_constraint_ids = []
+        self._constraint_locations = util.DynamicArray(
+            dtype=[("block", numpy.uint32), ("row", numpy.uint32)]
+        )  # constraint id -> position in a block
         self._constraint_count = 0
 
+        # constraint id -> True if the constraint is suspended (see
+        # `suspend_constraints()`), always False for free ids
+        self._suspended = util.DynamicArray(dtype=bool)
+        self._suspended_count = 0
+        self._groups = {}  # group name -> set of constraint ids
+
+        # constraint id -> error of the constraint from its last evaluation by
+        # `solve()` (see `residuals()`), nan for free ids and constraints that
+        # weren't evaluated yet
+        self._residuals = util.DynamicArray(dtype=self._number_dtype)
+        # (residuals, suspended mask, length scale) at the end of the last and
+        # the previous solve, for reporting changes of constraint status
+        self._solved_residuals = self._previous_residuals = (
+            numpy.empty(0, dtype=self._number_dtype),
+            numpy.empty(0, dtype=bool),
+            1.0,
+        )
+
+        # Incremented whenever constraints are added, removed or their
+        # parameters change
+        self._structure_version = 0
+        self._cluster_version = None
+        self._clusters = []  # Rigid clusters found at _cluster_version
+        # RigidCluster.key() of a connected group -> point indices of its rigid parts
+        self._cluster_cache = {}
+
+        # Changes since the last solve, used to skip solves that wouldn't
+        # move anything: ids of added constraints and variables moved by
+        # set_values. Valid only while _satisfied is True, that is if
+        # the last solve ended with all constraints satisfied.
+        self._dirty_constraint_ids = set()
+        self._dirty_variables = set()
+        # Numeric parameters changed since the last solve, for continuation:
+        # constraint id -> {field name: value before the first change}
+        self._parameter_changes = {}
+        self._satisfied = False
+        self._satisfied_length_scale = 1.0
+
+        # Factorization used by parameter change predictions:
+        # (structure version, variable values, active row mask, jacobian, solve)
+        self._sensitivity = None
+        # Last prediction, used as a starting point of the next solve if
+        # nothing else changed: (ids, field name, predicted parameter values,
+        # values before the change, predicted values)
+        self._prediction = None
+
+        self._listeners = []
+        self._recorder = None
+
+        self.statistics = collections.Counter()
+
         self.auto_solve = True
 
+        # Rescale variables and constraint errors by a characteristic length of
+        # the sketch before passing them to the optimizer, so that convergence
+        # doesn't depend on the units.
+        self.scaling = True
+
+        # Number of additional randomly perturbed starting points tried by `solve()`,
+        # 0 disables multi-start solving.
+        self.multi_start = 0
+        # Standard deviation of the perturbation, relative to the sketch size
+        self.multi_start_spread = 0.25
+        self.multi_start_seed = None
+
+        # Solve changes of numeric parameters (see `set_parameter()`) by moving
+        # the parameters from their old values to the new ones in steps, each
+        # corrected by Newton iterations starting from the result of the previous
+        # one, before the optimizer runs. This keeps large edits from flipping
+        # the geometry or failing to converge.
+        # continuation_step is the change of parameters in the first step,
+        # relative to the sketch size (distances) or in radians (angles), edits
+        # smaller than that are solved directly. Steps that converge within
+        # continuation_iterations get twice as long, steps that don't converge
+        # within twice as many are retried with half the length, down to
+        # continuation_min_step (a fraction of the whole edit).
+        self.continuation = False
+        self.continuation_step = 0.5
+        self.continuation_iterations = 3
+        self.continuation_min_step = 1e-6
+
+        # Storage of constraint parameter arrays (see util.DynamicArray),
+        # "shared" lets worker processes attach to the arrays of new blocks
+        # (see `shared_parameter_arrays()`). Shared memory is released by
+        # `close()`.
+        self.parameter_storage = None
+        # Layout of constraint parameters of new blocks: "records" keeps them in
+        # a structured array, "columns" in a contiguous array per field.
+        self.parameter_layout = "records"
+
+        # Move groups of points that are held rigid by their internal constraints
+        # (Length, Perpendicular) as a whole, by a translation and a rotation,
+        # instead of optimizing each of their coordinates.
+        self.rigid_clusters = True
+
+        # Place variables that are determined by a sequence of simple constraints
+        # (fixed values, equalities, angle and length of a segment, ...) directly,
+        # before the optimizer runs (see `constructive`).
+        self.constructive = True
+
+        # Number of threads that evaluate constraints and their jacobians,
+        # None evaluates everything in the calling thread. Blocks with at least
+        # parallel_threshold rows are split into a chunk per thread, numpy
+        # releases the GIL while working on them.
+        self.evaluation_threads = None
+        self.parallel_threshold = 10000
+        self._executor = None
+        self._executor_threads = None
+
+    @_recorded
     def add_constraint(self, constraint):
-        responsible_class = self._get_responsible_class(constraint)
+        """ Add a constraint object, return its constraint id. """
+        if constraint in self._constraint_ids:
+            raise ValueError("Constraint already registered")
+
+        parameters = constraint.get_parameters()
+        schema = _get_schema(type(constraint), parameters)
+        block = self._get_block(self._get_responsible_class(type(constraint)), schema)
+        parameter_values = self._constraint_parameters(schema, parameters)
+        constraint_id = self._allocate_constraint_id(constraint)
+        self._constraint_locations[constraint_id] = (block.index, len(block))
+        block.ids.append(constraint_id)
+        block.parameter_array.append(parameter_values)
+
+        for field_index, field in enumerate(block.variable_fields):
+            self._incidence.append(
+                block.parameter_array[field][-1], constraint_id, field_index
+            )
+
+        self._constraint_count += 1
+        self._structure_version += 1
+        self._dirty_constraint_ids.add(constraint_id)
+
+        assert self._assert_internal_state()
+        self._auto_solve()
+        return constraint_id
+
+    @_recorded
+    def add_constraints(self, cls, **columns):
+        """ Add many constraints of class cls at once, without creating
+        constraint objects.
+        Columns are arrays with one item per constraint for every parameter
+        declared by the class (`variable_parameters` and `numeric_parameters`),
+        variable parameters are given as variable indices (see `add_variables()`).
+        Returns array of ids of the new constraints, these can be used with
+        `remove_constraints()`. """
+        if cls.variable_parameters is None:
+            raise ValueError("{} doesn't declare its parameters".format(cls.__name__))
+        schema = _get_schema(cls)
+        if set(columns) != set(schema.names):
+            raise ValueError(
+                "Expected columns {}, got {}".format(
+                    ", ".join(schema.names), ", ".join(sorted(columns))
+                )
+            )
+
+        count = None
+        records = None
+        for name, is_variable in zip(schema.names, schema.is_variable):
+            column = numpy.asarray(columns[name])
+            if column.ndim != 1 or (count is not None and len(column) != count):
+                raise ValueError("All columns must be 1D arrays of the same length")
+            if count is None:
+                count = len(column)
+                records = numpy.empty(count, dtype=schema.dtype)
+            if is_variable and count and (
+                column.min() < 0 or column.max() >= len(self._variables)
+            ):
+                raise IndexError("Variable index out of range in {!r}".format(name))
+            records[name] = column
+
+        if not count:
+            return self._allocate_constraint_ids(0)
+
+        # Fails for mismatched subclass parameters, must happen before allocating
+        block = self._get_block(self._get_responsible_class(cls), schema)
+        ids = self._allocate_constraint_ids(count)
+        start = len(block)
+        block.ids.extend(ids)
+        block.parameter_array.extend(records)
+        locations = self._constraint_locations.array()
+        locations["block"][ids] = block.index
+        locations["row"][ids] = numpy.arange(start, start + count)
+
+        for field_index, field in enumerate(block.variable_fields):
+            self._incidence.extend(records[field], ids, field_index)
+
+        self._constraint_count += count
+        self._structure_version += 1
+        self._dirty_constraint_ids.update(ids.tolist())
+
+        assert self._assert_internal_state()
+        self._auto_solve()
+        return ids
+
+    @_recorded
+    def add_variables(self, variables):
+        """ Register a sequence of variables for use with `add_constraints()`,
+        return an array of their indices.
+        Variables that don't get used by any constraint stay in the solver until
+        the next removal of a constraint. """
+        indices = numpy.empty(len(variables), dtype=self._variable_index_dtype)
+        new_count = 0
+        for i, variable in enumerate(variables):
+            try:
+                indices[i] = self._variables.index(variable)
+            except KeyError:
+                indices[i] = len(self._variables)
+                self._variables[variable] = None
+                self._added_variables.add(variable)
+                new_count += 1
+        if new_count:
+            self._incidence.add_rows(new_count)
+        return indices
+
+    def variable_indices(self, variables):
+        """ Return an array of indices of a sequence of registered variables.
+        Indices change when constraints get removed. """
+        return numpy.fromiter(
+            (self._variables.index(variable) for variable in variables),
+            dtype=self._variable_index_dtype,
+        )
+
+    @_recorded
+    def remove_constraint(self, constraint):
         try:
-            block = self._constraints[responsible_class]
+            constraint_id = self._constraint_ids.pop(constraint)
         except KeyError:
-            block = None
-        else:
-            if constraint in block.constraints:
-                raise ValueError("Constraint already registered")
+            raise ValueError("Constraint not registered")
+
+        self._remove_variables(self._remove_constraint_id(constraint_id))
+
+        assert self._assert_internal_state()
+        self._auto_solve()
+
+    @_recorded
+    def remove_constraints(self, ids):
+        """ Remove constraints by their ids (as returned from `add_constraint()`
+        or `add_constraints()`). """
+        ids = [int(constraint_id) for constraint_id in ids]
+        if len(set(ids)) != len(ids):
+            raise ValueError("Duplicate constraint ids")
+        for constraint_id in ids:
+            if not self._constraint_id_used(constraint_id):
+                raise ValueError("Constraint id {} not registered".format(constraint_id))
+
+        variable_indices = set()
+        for constraint_id in ids:
+            constraint = self._constraint_objects[constraint_id]
+            if constraint is not None:
+                del self._constraint_ids[constraint]
+            variable_indices.update(self._remove_constraint_id(constraint_id))
+        self._remove_variables(variable_indices)
+
+        assert self._assert_internal_state()
+        self._auto_solve()
+
+    @_recorded
+    def suspend_constraints(self, ids):
+        """ Disable constraints by their ids, without removing them from
+        the solver. Suspended constraints are ignored when solving until they
+        are resumed, toggling them is much cheaper than removing and adding
+        them again. Suspending a suspended constraint does nothing. """
+        ids = self._used_ids(ids)
+        suspended = self._suspended.array()
+        self._suspended_count += len(ids) - numpy.count_nonzero(suspended[ids])
+        suspended[ids] = True
+        # Removing constraints from the problem can't violate the others
+        self._dirty_constraint_ids.difference_update(ids.tolist())
+        self._structure_version += 1
+
+        assert self._assert_internal_state()
+        self._auto_solve()
+
+    @_recorded
+    def resume_constraints(self, ids):
+        """ Enable constraints suspended by `suspend_constraints()` again """
+        ids = self._used_ids(ids)
+        suspended = self._suspended.array()
+        resumed = ids[suspended[ids]]
+        self._suspended_count -= len(resumed)
+        suspended[ids] = False
+        self._dirty_constraint_ids.update(resumed.tolist())
+        self._structure_version += 1
+
+        assert self._assert_internal_state()
+        self._auto_solve()
+
+    def suspended_ids(self):
+        """ Return sorted array of ids of the suspended constraints """
+        return numpy.flatnonzero(self._suspended.array())
+
+    @_recorded
+    def add_to_group(self, name, ids):
+        """ Add constraints (by ids) to a named group, creating it if necessary.
+        A constraint can be in any number of groups, it leaves them when it is
+        removed from the solver. """
+        ids = self._used_ids(ids)
+        self._groups.setdefault(name, set()).update(ids.tolist())
+
+    @_recorded
+    def remove_group(self, name):
+        """ Forget a group, its constraints stay in the solver """
+        del self._groups[name]
+
+    def group(self, name):
+        """ Return sorted array of ids of constraints in a group """
+        members = self._groups[name]
+        ret = numpy.fromiter(members, dtype=self._constraint_id_dtype, count=len(members))
+        ret.sort()
+        return ret
+
+    @_recorded
+    def suspend_group(self, name):
+        """ Suspend all constraints of a group (see `suspend_constraints()`) """
+        self.suspend_constraints(self.group(name))
+
+    @_recorded
+    def resume_group(self, name):
+        """ Resume all constraints of a group, including those that were
+        suspended individually. """
+        self.resume_constraints(self.group(name))
 
-        constraint_parameters = constraint.get_parameters()
-        for var in self._constraint_variables(constraint_parameters):
-            variable_constraints = self._variables.setdefault(
-                var, collections_extended.bag()
+    def _used_ids(self, ids):
+        """ Return ids as an index array, raise ValueError if any of them is not
+        a registered constraint. """
+        ids = numpy.asarray(ids, dtype=numpy.intp).reshape(-1)
+        if len(ids) and (
+            ids.min() < 0
+            or ids.max() >= len(self._constraint_locations)
+            or numpy.any(
+                self._constraint_locations["block"][ids] == self._free_block
             )
-            variable_constraints.add(constraint)
+        ):
+            raise ValueError("Constraint ids not registered")
+        return ids
 
-        dtype, parameter_values = self._constraint_parameters(constraint_parameters)
-        if block is None:
-            block = _ConstraintBlock(dtype)
-            self._constraints[responsible_class] = block
+    def _active_rows(self, block):
+        """ Return indices of block rows with constraints that are not
+        suspended, or None if all of them are active. """
+        if not self._suspended_count:
+            return None
+        active = ~self._suspended.array()[block.ids.array()]
+        if numpy.all(active):
+            return None
+        return numpy.flatnonzero(active)
 
-        assert block.parameter_array.dtype == dtype
-        block.constraints.append(constraint)
-        block.parameter_array.append(parameter_values)
-        self._constraint_count += 1
+    def _active_parameters(self, block):
+        """ Return (rows, parameters, count): active rows of a block (as from
+        `_active_rows()`), their parameters (a copy if some rows are suspended)
+        and their count. """
+        rows = self._active_rows(block)
+        if rows is None:
+            return None, block.parameter_array.array(), len(block)
+        return rows, self._block_parameters(block, rows), len(rows)
+
+    def _active_row_mask(self):
+        """ Return boolean mask of constraint errors (in the order of
+        `_evaluate_constraints()`) of constraints that are not suspended """
+        if not self._suspended_count:
+            return numpy.ones(self._constraint_count, dtype=bool)
+        return ~self._suspended.array()[self._row_ids()]
+
+    def _row_ids(self):
+        """ Return constraint id of each error in the order of
+        `_evaluate_constraints()` """
+        return numpy.concatenate(
+            [block.ids.array() for block in self._nonempty_blocks()]
+            + [numpy.empty(0, dtype=self._constraint_id_dtype)]
+        )
+
+    @_recorded
+    def set_parameter(self, constraint, name, value):
+        """ Change a numeric parameter of a registered constraint object in place,
+        for example `length` of a Length constraint, and re-solve.
+
+        Sets attribute `name` of the constraint to value and updates the stored
+        parameters from `get_parameters()`, so the value is in the units
+        of the constraint object (AbsoluteAngle takes degrees). This is much
+        cheaper than removing and adding the constraint again. """
+        try:
+            constraint_id = self._constraint_ids[constraint]
+        except KeyError:
+            raise ValueError("Constraint not registered")
+        block_index, row = self._constraint_locations[constraint_id]
+        block = self._blocks[block_index]
+        if name not in block.numeric_fields or not hasattr(constraint, name):
+            raise ValueError(
+                "{} has no numeric parameter {!r}".format(
+                    type(constraint).__name__, name
+                )
+            )
+
+        # Convert all parameters before storing any of them, so that an invalid
+        # value leaves both the constraint and the solver unchanged
+        old_attribute = getattr(constraint, name)
+        setattr(constraint, name, value)
+        try:
+            parameters = dict(constraint.get_parameters())
+            new_values = {}
+            for field in block.numeric_fields:
+                new_values[field] = numpy.asarray(
+                    parameters[field], dtype=block.parameter_array.dtype[field]
+                )
+                if new_values[field].ndim or not numpy.isfinite(new_values[field]):
+                    raise ValueError(
+                        "Parameter {!r} must be a finite number".format(field)
+                    )
+        except Exception:
+            setattr(constraint, name, old_attribute)
+            raise
+
+        for field, new_value in new_values.items():
+            old_value = float(block.parameter_array[field][row])
+            if new_value != old_value:
+                self._parameter_changes.setdefault(constraint_id, {}).setdefault(
+                    field, old_value
+                )
+            block.parameter_array[field][row] = new_value
 
+        self._parameters_changed([constraint_id])
         assert self._assert_internal_state()
         self._auto_solve()
 
-    def remove_constraint(self, constraint):
-        responsible_class = self._get_responsible_class(constraint)
+    @_recorded
+    def set_parameters(self, ids, name, values):
+        """ Change numeric parameter `name` of many constraints added by
+        `add_constraints()` at once and re-solve.
+        Values are given like the columns of `add_constraints()` (AbsoluteAngle
+        takes radians), either one per id or a single value for all of them. """
+        ids = numpy.asarray(ids, dtype=numpy.intp)
+        if ids.ndim != 1:
+            raise ValueError("Ids must be a 1D array")
+        values = numpy.broadcast_to(
+            numpy.asarray(values, dtype=self._number_dtype), ids.shape
+        )
+        if len(numpy.unique(ids)) != len(ids):
+            raise ValueError("Duplicate constraint ids")
+        for constraint_id in ids.tolist():
+            if not self._constraint_id_used(constraint_id):
+                raise ValueError("Constraint id {} not registered".format(constraint_id))
+            if self._constraint_objects[constraint_id] is not None:
+                raise ValueError(
+                    "Constraint id {} has an object, use set_parameter()".format(
+                        constraint_id
+                    )
+                )
+
+        locations = self._constraint_locations.array()[ids]
+        block_indices = numpy.unique(locations["block"])
+        for block_index in block_indices:
+            block = self._blocks[block_index]
+            if name not in block.numeric_fields:
+                raise ValueError(
+                    "{} has no numeric parameter {!r}".format(
+                        block.responsible_class.__name__, name
+                    )
+                )
+
+        for block_index in block_indices:
+            in_block = locations["block"] == block_index
+            block = self._blocks[block_index]
+            rows = locations["row"][in_block]
+            old_values = block.parameter_array[name][rows]
+            for constraint_id, old_value in zip(
+                ids[in_block].tolist(), old_values.tolist()
+            ):
+                self._parameter_changes.setdefault(constraint_id, {}).setdefault(
+                    name, old_value
+                )
+            block.parameter_array[name][rows] = values[in_block]
+
+        self._parameters_changed(ids.tolist())
+        assert self._assert_internal_state()
+        self._auto_solve()
+
+    def _parameters_changed(self, ids):
+        # Cached clusters have shapes given by the old parameters
+        self._structure_version += 1
+        self._dirty_constraint_ids.update(ids)
+
+    def predict_parameter(self, constraint, name, value):
+        """ Predict values of variables after changing a numeric parameter of
+        a constraint object, without solving or changing anything.
+        Arguments are the same as for `set_parameter()`.
+
+        Returns a dict variable -> predicted value of the variables that move.
+        The prediction is the first order (minimum norm) change that keeps
+        the constraints satisfied, so it is only accurate for small changes and
+        assumes that the current values satisfy the constraints.
+        Factorization of the constraint jacobian is reused by following
+        predictions until the variables or constraints change, and if
+        the same change is then applied by `set_parameter()`, the next solve
+        starts from the predicted values. """
         try:
-            block = self._constraints[responsible_class]
+            constraint_id = self._constraint_ids[constraint]
         except KeyError:
-            block = None
-        if block is None or constraint not in block.constraints:
             raise ValueError("Constraint not registered")
+        block_index, row = self._constraint_locations[constraint_id]
+        block = self._blocks[block_index]
+        if name not in block.numeric_fields or not hasattr(constraint, name):
+            raise ValueError(
+                "{} has no numeric parameter {!r}".format(
+                    type(constraint).__name__, name
+                )
+            )
+
+        # Convert the value to the stored units through the constraint object
+        old_value = getattr(constraint, name)
+        setattr(constraint, name, value)
+        try:
+            parameter = dict(constraint.get_parameters())[name]
+        finally:
+            setattr(constraint, name, old_value)
 
-        constraints_to_fix = set()
+        return self._predict(
+            numpy.array([constraint_id]), name, numpy.array([parameter], dtype=float)
+        )
 
-        for var in self._constraint_variables(constraint.get_parameters()):
-            variable_constraints = self._variables[var]
-            variable_constraints.remove(constraint)
-            if len(variable_constraints) == 0:
-                _, new_index, moved_var, moved_var_constraints = self._variables.fast_pop(
-                    var
+    def predict_parameters(self, ids, name, values):
+        """ Predict values of variables after changing numeric parameter
+        `name` of many constraints, with the same arguments as `set_parameters()`.
+        See `predict_parameter()`. """
+        ids = self._used_ids(ids)
+        values = numpy.broadcast_to(
+            numpy.asarray(values, dtype=self._number_dtype), ids.shape
+        )
+        locations = self._constraint_locations.array()[ids]
+        for block_index in numpy.unique(locations["block"]):
+            block = self._blocks[block_index]
+            if name not in block.numeric_fields:
+                raise ValueError(
+                    "{} has no numeric parameter {!r}".format(
+                        block.responsible_class.__name__, name
+                    )
                 )
-                constraints_to_fix.update(moved_var_constraints)
-        assert constraint not in constraints_to_fix
+        return self._predict(ids, name, values)
+
+    def _predict(self, ids, name, values):
+        """ Return dict variable -> predicted value after setting parameter
+        `name` of constraints ids to values (in stored units).
+
+        With J the jacobian of the active constraints and b the change of their
+        errors caused by the parameter change (to first order), the predicted
+        change of variables is the minimum norm solution of J dx = -b,
+        dx = -J^T (J J^T + damping)^-1 b. """
+        initial = numpy.fromiter(
+            (float(var) for var in self._variables),
+            dtype=self._number_dtype,
+            count=len(self._variables),
+        )
+        jacobian, solve, active = self._sensitivity_factorization(initial)
+
+        offsets = self._block_offsets()
+        locations = self._constraint_locations.array()[ids]
+        # Position of each active constraint error in the rows of the jacobian
+        active_rows = numpy.cumsum(active) - 1
+        rhs = numpy.zeros(jacobian.shape[0])
+        for block_index in numpy.unique(locations["block"]):
+            block = self._blocks[block_index]
+            in_block = locations["block"] == block_index
+            rows = locations["row"][in_block].astype(numpy.intp)
+            parameters = self._block_parameters(block, rows)
+            derivatives = _parameter_derivatives(
+                block.responsible_class, initial, parameters, name
+            )
+            error_rows = offsets[block_index] + rows
+            use = active[error_rows]
+            rhs[active_rows[error_rows[use]]] = (
+                derivatives * (values[in_block] - parameters[name])
+            )[use]
+
+        predicted = initial - jacobian.T.dot(solve(rhs))
+        self.statistics["predictions"] += 1
+        self._prediction = (ids, name, values, initial, predicted)
+
+        # Leave out noise caused by the damping
+        threshold = self._prediction_tolerance * self._length_scale(initial)
+        return {
+            self._variables.key(int(i)): float(predicted[i])
+            for i in numpy.flatnonzero(numpy.abs(predicted - initial) > threshold)
+        }
+
+    def _sensitivity_factorization(self, values):
+        """ Return (jacobian, solve, active): sparse jacobian of the active
+        constraints at values, function solving (J J^T + damping) y = b
+        and the mask of active constraint errors. Cached while the structure and
+        the values don't change. """
+        if self._sensitivity is not None:
+            version, cached_values, active, jacobian, solve = self._sensitivity
+            if version == self._structure_version and numpy.array_equal(
+                cached_values, values
+            ):
+                return jacobian, solve, active
 
-        if len(block.constraints) == 0:
-            # last constraint of this responsible class
-            del self._constraints[responsible_class]
+        active = self._active_row_mask()
+        jacobian = self._sparse_constraint_jacobians(values)[active]
+        normal = jacobian.dot(jacobian.T).tocsc()
+        damping = self._sensitivity_damping * max(
+            numpy.max(normal.diagonal(), initial=0), 1e-300
+        )
+        normal = normal + damping * sparse.identity(normal.shape[0], format="csc")
+        if normal.shape[0]:
+            solve = splinalg.factorized(normal)
         else:
-            block.fast_pop(constraint)
+            solve = lambda b: b  # noqa: E731
+        self.statistics["sensitivity_factorizations"] += 1
 
-        for c in constraints_to_fix:
-            responsible_class = self._get_responsible_class(constraint)
-            block = self._constraints[responsible_class]
+        self._sensitivity = (self._structure_version, values, active, jacobian, solve)
+        return jacobian, solve, active
 
-            dtype, parameter_values = self._constraint_parameters(c.get_parameters())
-            assert block.parameter_array.dtype == dtype
-            index = block.constraints.index(c)
-            block.parameter_array[index] = parameter_values
-        self._constraint_count -= 1
+    def _warm_start(self, initial):
+        """ Return starting point for a solve from initial: the last prediction
+        if its parameter change was applied and nothing else changed,
+        initial otherwise. """
+        if self._prediction is None:
+            return initial
+        ids, name, values, base, predicted = self._prediction
+        self._prediction = None
+        if not numpy.array_equal(base, initial) or not all(
+            self._constraint_id_used(i) for i in ids.tolist()
+        ):
+            return initial
+
+        locations = self._constraint_locations.array()[ids]
+        for block_index in numpy.unique(locations["block"]):
+            block = self._blocks[block_index]
+            if name not in block.numeric_fields:
+                return initial
+            in_block = locations["block"] == block_index
+            current = block.parameter_array[name][locations["row"][in_block]]
+            if not numpy.array_equal(current, values[in_block]):
+                return initial
+
+        self.statistics["warm_starts"] += 1
+        return predicted
+
+    @_recorded
+    def set_values(self, values):
+        """ Move variables to new values (mapping variable -> value), for example
+        when dragging a point, and re-solve.
+        The new values become the initial positions for the solver, so
+        the constraints get satisfied as close to them as possible. """
+        changed = []
+        for variable, value in values.items():
+            variable._value = value
+            changed.append(variable)
+        self._dirty_variables.update(changed)
+        self._notify_listeners(changed)
 
-        assert self._assert_internal_state()
         self._auto_solve()
 
+    def start_recording(self, path):
+        """ Record all following operations on this solver with their timings
+        into a file, for replaying with `parametric.recording`. """
+        if self._recorder is not None:
+            raise RuntimeError("Already recording")
+        from . import recording
+
+        self._recorder = recording.Recorder(self, path)
+
+    def stop_recording(self):
+        if self._recorder is not None:
+            self._recorder.close()
+            self._recorder = None
+
+    def shared_parameter_arrays(self):
+        """ Describe constraint parameter arrays in shared storage (see
+        `parameter_storage`) for worker processes, which attach to them using
+        `util.DynamicArray.attach()`.
+
+        Returns an ordered dict mapping responsible class to a list of
+        (name, dtype, length) of its arrays: a single structured array with
+        the "records" layout, an array per field (in the order of the fields
+        of the block) with "columns". Arrays get new names when they grow,
+        so the description is only valid until constraints are added.
+        Blocks with other storages are left out. """
+        ret = collections.OrderedDict()
+        for block in self._blocks:
+            arrays = block.storage_arrays()
+            if arrays[0].storage != "shared":
+                continue
+            ret[block.responsible_class] = [
+                (array.name, array.dtype, len(array)) for array in arrays
+            ]
+        return ret
+
+    def close(self):
+        """ Release shared memory of the constraint parameters, stop recording
+        and evaluation threads. The solver must not be used afterwards. """
+        self.stop_recording()
+        for block in self._blocks:
+            block.close()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add_listener(self, listener):
+        """ Register a callable that is called with a list of variables whose
+        values were changed, after each solve or `set_values()`. """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    @_recorded
     def solve(self):
+        """ Move variables to satisfy all constraints, as close to their current
+        values as possible.
+
+        If the previous solve satisfied all constraints, only constraints affected
+        by changes since then (added constraints and constraints using variables
+        moved by `set_values()`) are evaluated, and if they are satisfied too,
+        the optimization is skipped. Values of variables must therefore only be
+        changed through `set_values()`.
+
+        With `continuation` enabled, large changes of numeric parameters since
+        the last solve are followed in steps before the optimizer runs. """
+        if len(self._variables) == 0:
+            return
+
+        if self._satisfied and self._changes_satisfied():
+            self.statistics["skipped_solves"] += 1
+            self._clear_changes()
+            self._store_residuals()
+            return
+
         initial = numpy.fromiter(
             (float(var) for var in self._variables),
             dtype=self._number_dtype,
             count=len(self._variables),
         )
 
-        def goal(x):
-            return numpy.sum((x - initial) ** 2)
+        active = self._active_row_mask()
+        # Values that the final solve stays close to
+        target = initial
+        if self.continuation and self._parameter_changes:
+            target = self._continuation(initial, active)
+
+        if self.multi_start:
+            self._prediction = None
+            x0 = self._multi_start(target, active)
+        elif target is initial:
+            x0 = self._warm_start(initial)
+        else:
+            self._prediction = None
+            x0 = target
+
+        result = self._minimize(target, x0, active)
+
+        changed = []
+        for v, old_v, variable in zip(result.x, initial, self._variables):
+            if v != old_v:
+                variable._value = v
+                changed.append(variable)
+
+        self._clear_changes()
+        length_scale = self._length_scale(result.x) if self.scaling else 1.0
+        errors = self._evaluate_constraints(result.x)
+        self._residuals.array()[self._row_ids()] = errors
+        errors = errors[active] / self._error_scales(length_scale)[active]
+        self._satisfied = bool(
+            numpy.max(numpy.abs(errors), initial=0) <= self._feasibility_tolerance
+        )
+        self._satisfied_length_scale = length_scale
+        self._store_residuals()
+
+        self._notify_listeners(changed)
+
+    def residuals(self):
+        """ Return constraint errors from the last solve, without evaluating
+        anything.
+
+        Returns an ordered dict mapping responsible class to a pair of arrays
+        (ids, residuals), aligned with rows of the constraint block of the class.
+        Residuals are in units of the constraint errors (distances or radians),
+        nan for constraints that weren't evaluated since they were added.
+        Skipped solves only evaluate constraints affected by the changes, the
+        others keep their residuals. Suspended constraints are included. """
+        residuals = self._residuals.array()
+        ret = collections.OrderedDict()
+        for block in self._nonempty_blocks():
+            ids = block.ids.array().copy()
+            ret[block.responsible_class] = (ids, residuals[ids])
+        return ret
+
+    def violated(self, tolerance=None):
+        """ Return sorted array of ids of constraints that are violated according
+        to their residuals from the last solve.
+
+        Errors are compared with the tolerance after the same scaling that the
+        solver uses (distances relative to the extent of the sketch, not its
+        distance from the origin, if `scaling` is enabled, angles in radians),
+        default is the tolerance of the solver.
+        Suspended and not evaluated constraints are never violated. """
+        status = self._residual_status(
+            self._residuals.array(),
+            self._suspended.array(),
+            self._satisfied_length_scale,
+            tolerance,
+        )
+        return numpy.flatnonzero(status == 1)
+
+    def changed_violations(self, tolerance=None):
+        """ Report constraints whose status changed between the previous and
+        the last solve, for incremental updates of a list of violated constraints.
+
+        Status of a constraint is violated, satisfied or not evaluated, as in
+        `violated()`. Suspending a violated constraint changes its status to
+        satisfied. Returns a pair of arrays (ids, violated): sorted ids of
+        registered constraints with a changed status and whether each of them
+        is violated now. """
+        old_status, status = (
+            self._residual_status(*self._padded_residuals(solved), tolerance)
+            for solved in (self._previous_residuals, self._solved_residuals)
+        )
+        used = self._constraint_locations["block"] != self._free_block
+        ids = numpy.flatnonzero(used & (status != old_status))
+        return ids, status[ids] == 1
+
+    def _store_residuals(self):
+        """ Remember residuals and suspended constraints at the end of a solve """
+        self._previous_residuals = self._solved_residuals
+        self._solved_residuals = (
+            self._residuals.array().copy(),
+            self._suspended.array().copy(),
+            self._satisfied_length_scale,
+        )
+
+    def _padded_residuals(self, solved):
+        """ Extend residuals and suspended mask stored by `_store_residuals()`
+        to the current number of constraint ids. """
+        residuals, suspended, length_scale = solved
+        count = len(self._residuals)
+        padded_residuals = numpy.full(count, numpy.nan)
+        padded_residuals[: len(residuals)] = residuals[:count]
+        padded_suspended = numpy.zeros(count, dtype=bool)
+        padded_suspended[: len(suspended)] = suspended[:count]
+        return padded_residuals, padded_suspended, length_scale
+
+    def _residual_status(self, residuals, suspended, length_scale, tolerance):
+        """ Return status of each constraint id for given residuals and
+        suspended mask (both indexed by constraint id): -1 not evaluated,
+        0 satisfied (or suspended), 1 violated. """
+        if tolerance is None:
+            tolerance = self._feasibility_tolerance
+        scales = numpy.ones(len(residuals))
+        if self._constraint_count:
+            scales[self._row_ids()] = self._error_scales(length_scale)
+        with numpy.errstate(invalid="ignore"):
+            ret = (numpy.abs(residuals) / scales > tolerance).astype(numpy.int8)
+        ret[numpy.isnan(residuals)] = -1
+        ret[suspended] = 0
+        return ret
+
+    def _clear_changes(self):
+        self._dirty_constraint_ids.clear()
+        self._dirty_variables.clear()
+        self._parameter_changes.clear()
+
+    def _changes_satisfied(self):
+        """ Return True if all constraints affected by changes since the last
+        solve are satisfied by the current values. """
+        ids = set(self._dirty_constraint_ids)
+        for variable in self._dirty_variables:
+            try:
+                variable_index = self._variables.index(variable)
+            except KeyError:
+                # Not used by any constraint anymore
+                continue
+            ids.update(self._incidence.row(variable_index).tolist())
+        ids = numpy.fromiter(ids, dtype=numpy.intp, count=len(ids))
+        ids = ids[~self._suspended.array()[ids]]
+        if not len(ids):
+            return True
+
+        errors = self._evaluate_constraint_ids(ids)
+        return numpy.max(numpy.abs(errors)) <= self._feasibility_tolerance
+
+    def _evaluate_constraint_ids(self, ids):
+        """ Evaluate errors of the given constraints at the current variable
+        values, scaled like in the last solve, and store them as their residuals.
+        Only reads values of the variables the constraints use. """
+        locations = self._constraint_locations.array()[ids]
+        parts = []
+        for block_index in numpy.unique(locations["block"]):
+            block = self._blocks[block_index]
+            rows = locations["row"][locations["block"] == block_index]
+            parts.append((block, rows, self._block_parameters(block, rows)))
+
+        used = numpy.unique(
+            numpy.concatenate(
+                [
+                    parameters[field]
+                    for block, _, parameters in parts
+                    for field in block.variable_fields
+                ]
+            )
+        )
+        values = numpy.fromiter(
+            (float(self._variables.key(int(i))) for i in used),
+            dtype=self._number_dtype,
+            count=len(used),
+        )
+
+        unit_scales = {"distance": self._satisfied_length_scale, "angle": 1.0}
+        residuals = self._residuals.array()
+        errors = []
+        for block, rows, parameters in parts:
+            for field in block.variable_fields:
+                parameters[field] = numpy.searchsorted(used, parameters[field])
+            cls = block.responsible_class
+            block_errors = cls.evaluate(values, parameters)
+            residuals[block.ids.array()[rows]] = block_errors
+            errors.append(block_errors / unit_scales[cls.error_unit])
+        return numpy.concatenate(errors)
+
+    def _continuation(self, initial, active):
+        """ Move parameters changed since the last solve from their old values
+        to the current ones in adaptive steps (see `continuation`), following
+        the solution from initial.
 
-        def goal_jac(x):
-            return 2 * (x - initial)
+        Each step starts from a linear extrapolation of the last two steps
+        (the result of the previous step for the first one) and is corrected by
+        `_correct()`. Returns values at the end of the path, which satisfy
+        the current parameters unless a step failed, or initial if the change is
+        small enough to be solved directly. The caller still solves from there,
+        parameters are always left at their current values. """
+        changes = self._changed_parameters()
+        length_scale = self._length_scale(initial) if self.scaling else 1.0
+        unit_scales = {"distance": length_scale, "angle": 1.0}
+        change = max(
+            numpy.max(numpy.abs(new - old), initial=0)
+            / unit_scales[block.responsible_class.error_unit]
+            for block, _, _, old, new in changes
+        )
+        if change <= self.continuation_step:
+            return initial
 
+        error_scales = self._error_scales(length_scale)[active]
+        step = self.continuation_step / change
+        t = 0.0
+        x = initial
+        previous = None  # (t, x) of the step before the last one
         try:
-            result = scipy.optimize.minimize(
+            while t < 1:
+                next_t = min(t + step, 1.0)
+                self._interpolate_parameters(changes, next_t)
+                if previous is None:
+                    predicted = x
+                else:
+                    previous_t, previous_x = previous
+                    predicted = x + (x - previous_x) * (
+                        (next_t - t) / (t - previous_t)
+                    )
+                corrected, iterations = self._correct(predicted, active, error_scales)
+                if corrected is None:
+                    step /= 2
+                    if step < self.continuation_min_step:
+                        break
+                    continue
+
+                previous = (t, x)
+                t = next_t
+                x = corrected
+                self.statistics["continuation_steps"] += 1
+                if iterations <= self.continuation_iterations:
+                    step *= 2
+        finally:
+            self._interpolate_parameters(changes, 1.0)
+        return x
+
+    def _correct(self, x, active, error_scales):
+        """ Newton iterations moving x onto the active constraints, each taking
+        the minimum norm step dx = -J^T (J J^T + damping)^-1 e.
+
+        Returns (values, iterations), or (None, iterations) if the errors
+        divided by error_scales don't get within _continuation_tolerance in
+        2 * continuation_iterations iterations. """
+        max_iterations = 2 * self.continuation_iterations
+        for iteration in range(max_iterations + 1):
+            errors = self._evaluate_constraints(x)[active]
+            if (
+                numpy.max(numpy.abs(errors) / error_scales, initial=0)
+                <= self._continuation_tolerance
+            ):
+                return x, iteration
+            if iteration == max_iterations or not numpy.all(numpy.isfinite(errors)):
+                break
+            jacobian, solve, _ = self._sensitivity_factorization(x)
+            x = x - jacobian.T.dot(solve(errors))
+            self.statistics["continuation_iterations"] += 1
+        return None, iteration
+
+    def _changed_parameters(self):
+        """ Return list of (block, field name, rows, old values, new values)
+        of the numeric parameters changed since the last solve """
+        by_field = collections.defaultdict(list)
+        for constraint_id, changes in self._parameter_changes.items():
+            block_index, row = self._constraint_locations[constraint_id]
+            for name, old_value in changes.items():
+                by_field[block_index, name].append((row, old_value))
+
+        ret = []
+        for (block_index, name), values in by_field.items():
+            block = self._blocks[block_index]
+            rows = numpy.array([row for row, _ in values], dtype=numpy.intp)
+            old = numpy.array([value for _, value in values])
+            new = numpy.array(block.parameter_array[name][rows], dtype=numpy.float64)
+            ret.append((block, name, rows, old, new))
+        return ret
+
+    def _interpolate_parameters(self, changes, t):
+        """ Set parameters from `_changed_parameters()` to
+        old + t * (new - old) """
+        for block, name, rows, old, new in changes:
+            block.parameter_array[name][rows] = new if t == 1 else old + t * (new - old)
+        # Cached clusters have shapes given by the old parameters
+        self._structure_version += 1
+
+    def _minimize(self, initial, x0, active):
+        """ Find values closest to initial that satisfy all constraints
+        selected by the boolean mask active, starting from x0.
+
+        The optimizer works with the reduced vector y (see `_reduce_problem()`).
+        If scaling is enabled, it sees z = (y - reduce(initial)) / L
+        and constraint errors divided by L (distances) or 1 (angles), where L is
+        a characteristic length of the sketch (angles in y are not scaled). """
+        reduced = self._reduce_problem(initial, active)
+        rows = reduced.rows
+
+        if self.scaling:
+            length_scale = self._length_scale(initial)
+            error_scales = self._error_scales(length_scale)[rows, numpy.newaxis]
+            variable_scales = reduced.scales(length_scale)
+            offset = reduced.reduce(initial)
+            # The objective is divided by L^2, tighten the tolerance so that
+            # the solve doesn't stop earlier than an unscaled one, as far as
+            # the precision allows
+            ftol = max(self._ftol / max(length_scale, 1) ** 2, self._min_ftol)
+        else:
+            length_scale = 1
+            error_scales = 1
+            variable_scales = 1
+            offset = 0
+            ftol = self._ftol
+
+        def unscale(z):
+            return offset + variable_scales * z
+
+        def goal(z):
+            return (
+                numpy.sum((reduced.expand(unscale(z)) - initial) ** 2)
+                / length_scale ** 2
+            )
+
+        def goal_jac(z):
+            y = unscale(z)
+            gradient = 2 * (reduced.expand(y) - initial) / length_scale ** 2
+            return reduced.chain(gradient, y) * variable_scales
+
+        def constraints(z):
+            errors = self._evaluate_constraints(reduced.expand(unscale(z)))[rows]
+            return errors / numpy.ravel(error_scales)
+
+        def constraint_jacobians(z):
+            y = unscale(z)
+            jacobians = self._evaluate_constraint_jacobians(reduced.expand(y))[rows]
+            return reduced.chain(jacobians, y) * variable_scales / error_scales
+
+        if len(numpy.arange(self._constraint_count)[rows]):
+            constraint_spec = {
+                "type": "eq",
+                "fun": constraints,
+                "jac": constraint_jacobians,
+            }
+        else:
+            # Everything is inside rigid clusters
+            constraint_spec = ()
+
+        if reduced.size == 0:
+            # Everything was placed constructively
+            result = optimize.OptimizeResult(
+                x=numpy.empty(0), nit=0, nfev=0, success=True
+            )
+        else:
+            result = optimize.minimize(
                 method="SLSQP",
-                x0=initial,
+                x0=(reduced.reduce(x0) - offset) / variable_scales,
+                options={"ftol": ftol},
                 # Objective function is to minimize distance to initial positions
                 fun=goal,
                 jac=goal_jac,
-                constraints={
-                    "type": "eq",
-                    "fun": self._evaluate_constraints,
-                    "jac": self._evaluate_constraint_jacobians,
-                },
+                constraints=constraint_spec,
             )
-        except KeyError as e:
-            raise
+        result.x = reduced.expand(unscale(result.x))
 
-        for v, variable in zip(result.x, self._variables):
-            variable._value = v
+        self.statistics["solves"] += 1
+        self.statistics["iterations"] += result.nit
+        self.statistics["function_evaluations"] += result.nfev
+        self.statistics["optimized_variables"] += reduced.size
 
-    def _evaluate_constraints(self, x):
-        """ Evaluate all constraint errors into an array """
-        return numpy.hstack(
-            responsible_class.evaluate(x, block.parameter_array.array())
-            for responsible_class, block in self._constraints.items()
+        return result
+
+    def _reduce_problem(self, initial, active):
+        """ Return reduction.Reduction of the problem with constraints selected
+        by the boolean mask active (see `_active_row_mask()`).
+
+        Points form rigid clusters, with shapes satisfying their internal
+        constraints as close to initial as possible. Variables placed by
+        the constructive stage become constants and constraints using only them
+        are left out. The remaining clusters are moved as a whole and their
+        internal constraints are left out too, because cluster transforms can't
+        violate them. """
+        row_mask = active.copy()
+        block_offsets = self._block_offsets()
+
+        shapes = []  # (cluster, shape)
+        if self.rigid_clusters:
+            if self._cluster_version != self._structure_version:
+                self._clusters = self._find_rigid_clusters(initial)
+                self._cluster_version = self._structure_version
+
+            for cluster in self._clusters:
+                cluster_values = self._solve_cluster(cluster, initial)
+                if cluster_values is None:
+                    # Inconsistent internal constraints, leave them to the optimizer
+                    continue
+                shapes.append((cluster, cluster.shape(cluster_values)))
+
+        if self.constructive:
+            known, values = self._propagate(initial, row_mask, shapes)
+        else:
+            known = numpy.zeros(len(initial), dtype=bool)
+            values = initial
+
+        clusters = []
+        for cluster, shape in shapes:
+            if numpy.any(known[cluster.indices]):
+                # Placed as a whole by the constructive stage
+                continue
+            clusters.append((cluster.indices, shape))
+            for block, rows in cluster.rows:
+                row_mask[block_offsets[block.index] + rows] = False
+        self.statistics["rigid_clusters"] += len(clusters)
+
+        constants = numpy.flatnonzero(known)
+        return reduction.Reduction(
+            len(initial),
+            clusters,
+            row_mask,
+            constants=(constants, values[constants]),
+        )
+
+    def _propagate(self, initial, row_mask, shapes=()):
+        """ Place variables constructively (see `constructive.propagate()`).
+        Returns mask of the placed variables and values with them updated, and
+        clears rows of constraints that only use placed variables in row_mask.
+        If the placed values violate any of these constraints, nothing is placed
+        and the whole problem is left to the optimizer.
+
+        shapes is a list of (rigid cluster, shape). Clusters are never placed
+        partially: a cluster with enough placed points is placed as a whole
+        and propagation continues from it, otherwise its variables are excluded
+        from propagation, so that the optimizer can move it as a whole. """
+        active = [
+            (block, self._active_parameters(block)) for block in self._nonempty_blocks()
+        ]
+        parameters = {
+            block.responsible_class: block_parameters
+            for block, (_, block_parameters, count) in active
+            if count
+        }
+        length_scale = self._length_scale(initial) if self.scaling else 1
+        unit_scales = {"distance": length_scale, "angle": 1.0}
+
+        blocked = numpy.zeros(len(initial), dtype=bool)
+        restart = True
+        while restart:
+            # Exclusion of a cluster invalidates everything placed from it
+            restart = False
+            known, values = constructive.propagate(parameters, initial, blocked=blocked)
+            placed = True
+            while placed and not restart:
+                placed = False
+                for cluster, shape in shapes:
+                    cluster_known = known[cluster.indices]
+                    if numpy.all(cluster_known) or not numpy.any(cluster_known):
+                        continue
+                    points = reduction.fit_pose(
+                        shape, values[cluster.indices], cluster_known
+                    )
+                    if points is None or numpy.max(
+                        numpy.abs(points - values[cluster.indices])[cluster_known]
+                    ) > self._feasibility_tolerance * length_scale:
+                        blocked[cluster.indices] = True
+                        restart = True
+                        break
+                    values[cluster.indices] = points
+                    known[cluster.indices] = True
+                    placed = True
+                if placed and not restart:
+                    known, values = constructive.propagate(
+                        parameters, values, known, blocked
+                    )
+
+        if not numpy.any(known):
+            return known, values
+        solved = []
+        for block, (active_rows, block_parameters, count) in active:
+            if not count:
+                continue
+            rows = numpy.flatnonzero(
+                numpy.all(
+                    [known[block_parameters[field]] for field in block.variable_fields],
+                    axis=0,
+                )
+            )
+            if not len(rows):
+                continue
+            if active_rows is not None:
+                rows = active_rows[rows]
+            cls = block.responsible_class
+            errors = cls.evaluate(values, self._block_parameters(block, rows))
+            if numpy.max(numpy.abs(errors)) / unit_scales[
+                cls.error_unit
+            ] > self._feasibility_tolerance:
+                return numpy.zeros_like(known), initial
+            solved.append((block, rows))
+
+        offsets = self._block_offsets()
+        for block, rows in solved:
+            row_mask[offsets[block.index] + rows] = False
+        self.statistics["constructive_variables"] += numpy.count_nonzero(known)
+        return known, values
+
+    def _block_offsets(self):
+        """ Return dict block index -> index of the first row of the block
+        in the output of `_evaluate_constraints` """
+        ret = {}
+        offset = 0
+        for block in self._nonempty_blocks():
+            ret[block.index] = offset
+            offset += len(block)
+        return ret
+
+    def _find_rigid_clusters(self, values):
+        """ Find groups of points connected by rigid invariant constraints that
+        fix their relative positions.
+
+        Points are pairs of variables in `point_parameters` of the constraints,
+        groups containing a variable that appears in more than one point are
+        skipped. Rigidity is checked by rank of the jacobian of the internal
+        constraints at values (it must be 2k - 3 for k points). Results of
+        the check are cached by the group structure, so that after a change only
+        the groups touched by it get checked again. """
+        pairs = []
+        invariant = []  # (block, offset of its pairs in pairs, active rows, count)
+        offset = 0
+        for block in self._nonempty_blocks():
+            cls = block.responsible_class
+            if not cls.point_parameters:
+                continue
+            active_rows, array, count = self._active_parameters(block)
+            block_pairs = numpy.stack(
+                [
+                    numpy.stack([array[x], array[y]], axis=-1)
+                    for x, y in cls.point_parameters
+                ],
+                axis=1,
+            )
+            pairs.append(block_pairs.reshape(-1, 2))
+            point_fields = {field for pair in cls.point_parameters for field in pair}
+            if cls.rigid_invariant and point_fields == set(block.variable_fields):
+                invariant.append((block, offset, active_rows, count))
+            offset += count * len(cls.point_parameters)
+
+        if not invariant:
+            return []
+
+        points, point_ids = numpy.unique(
+            numpy.concatenate(pairs), axis=0, return_inverse=True
         )
+        point_ids = point_ids.reshape(-1)
+        usage = numpy.bincount(points.ravel(), minlength=len(self._variables))
+        ambiguous = numpy.any(usage[points] > 1, axis=1)
+
+        # Connect consecutive points of each rigid invariant constraint
+        block_point_ids = []
+        sources = []
+        targets = []
+        for block, offset, _, count in invariant:
+            pair_count = len(block.responsible_class.point_parameters)
+            ids = point_ids[offset : offset + count * pair_count].reshape(
+                count, pair_count
+            )
+            block_point_ids.append(ids)
+            sources.append(ids[:, :-1].ravel())
+            targets.append(ids[:, 1:].ravel())
+        sources = numpy.concatenate(sources)
+        graph = sparse.coo_matrix(
+            (
+                numpy.ones(len(sources), dtype=bool),
+                (sources, numpy.concatenate(targets)),
+            ),
+            shape=(len(points), len(points)),
+        )
+        _, labels = csgraph.connected_components(graph, directed=False)
+
+        # Points used by the rigid invariant constraints, grouped by component
+        used = numpy.zeros(len(points), dtype=bool)
+        for ids in block_point_ids:
+            used[ids.ravel()] = True
+        component_ambiguous = numpy.zeros(labels.max() + 1, dtype=bool)
+        component_ambiguous[labels[ambiguous]] = True
+
+        rows = collections.defaultdict(list)  # label -> [(block, rows)]
+        for (block, _, active_rows, count), ids in zip(invariant, block_point_ids):
+            if not count:
+                continue
+            row_labels = labels[ids[:, 0]]
+            order = numpy.argsort(row_labels, kind="stable")
+            boundaries = numpy.flatnonzero(numpy.diff(row_labels[order])) + 1
+            for group in numpy.split(order, boundaries):
+                block_rows = group if active_rows is None else active_rows[group]
+                rows[int(row_labels[group[0]])].append((block, block_rows))
+
+        clusters = []
+        cache = {}
+        for label, block_rows in rows.items():
+            if component_ambiguous[label]:
+                continue
+            indices = points[used & (labels == label)].astype(numpy.intp)
+            if len(indices) < self._minimum_cluster_size:
+                continue
+            component = self._make_cluster(indices, block_rows)
+            key = component.key()
+            try:
+                subsets = self._cluster_cache[key]
+            except KeyError:
+                subsets = self._rigid_subsets(component, values[indices.ravel()])
+            cache[key] = subsets
+            clusters.extend(component.subcluster(subset) for subset in subsets)
+
+        self._cluster_cache = cache
+        return clusters
+
+    def _rigid_subsets(self, cluster, values):
+        """ Split points of a cluster into disjoint rigid groups.
+
+        Groups are grown greedily from a single point, adding one neighbouring
+        point at a time if the constraints inside the group keep it rigid,
+        that is if the rank of their jacobian is 2k - 3 for k points. Rank is
+        tracked incrementally using an orthonormal basis of the jacobian rows.
+        Groups that only become rigid by adding two points at once are not found.
+        Returns list of arrays of point indices. """
+        jacobian = numpy.nan_to_num(self._cluster_jacobian(cluster, values))
+        tolerance = 1e-8 * max(1, numpy.max(numpy.abs(jacobian), initial=0))
+        constraint_points = cluster.constraint_points()
+        point_constraints = collections.defaultdict(list)
+        for row, row_points in enumerate(constraint_points):
+            for point in row_points:
+                point_constraints[point].append(row)
+
+        assigned = numpy.zeros(len(cluster), dtype=bool)
+        ret = []
+        for seed in range(len(cluster)):
+            if assigned[seed]:
+                continue
+            members = {seed}
+            basis = numpy.empty((0, jacobian.shape[1]))
+            grown = True
+            while grown:
+                grown = False
+                candidates = {
+                    point
+                    for member in members
+                    for row in point_constraints[member]
+                    for point in constraint_points[row]
+                }
+                for candidate in sorted(candidates - members):
+                    if assigned[candidate]:
+                        continue
+                    extended = members | {candidate}
+                    new_rows = [
+                        row
+                        for row in point_constraints[candidate]
+                        if constraint_points[row] <= extended
+                    ]
+                    if not new_rows:
+                        continue
+                    new_rows = jacobian[new_rows]
+                    residual = new_rows - new_rows.dot(basis.T).dot(basis)
+                    _, singular_values, vt = numpy.linalg.svd(
+                        residual, full_matrices=False
+                    )
+                    rank = numpy.count_nonzero(singular_values > tolerance)
+                    if len(basis) + rank == 2 * len(extended) - 3:
+                        members = extended
+                        basis = numpy.vstack([basis, vt[:rank]])
+                        grown = True
+
+            if len(members) >= self._minimum_cluster_size:
+                subset = numpy.array(sorted(members), dtype=numpy.intp)
+                assigned[subset] = True
+                ret.append(subset)
+        return ret
+
+    def _make_cluster(self, indices, block_rows):
+        """ Create a RigidCluster from variable indices of its points and
+        rows of its internal constraints. """
+        local_index = numpy.zeros(len(self._variables), dtype=self._variable_index_dtype)
+        local_index[indices.ravel()] = numpy.arange(indices.size)
+
+        parts = []
+        for block, rows in block_rows:
+            parameters = self._block_parameters(block, rows)
+            for name in block.variable_fields:
+                parameters[name] = local_index[parameters[name]]
+            parts.append((block.responsible_class, parameters))
+
+        return reduction.RigidCluster(indices, parts, block_rows)
+
+    @staticmethod
+    def _block_parameters(block, rows):
+        """ Return a record array with copy of the given rows of block parameters """
+        array = block.parameter_array
+        ret = numpy.empty(len(rows), dtype=array.dtype)
+        for name in array.dtype.names:
+            ret[name] = array[name][rows]
         return ret
 
+    def _cluster_jacobian(self, cluster, x):
+        return numpy.vstack(
+            [_block_jacobian(cls, x, parameters) for cls, parameters in cluster.parts]
+        )
+
+    def _solve_cluster(self, cluster, initial):
+        """ Return values of the cluster variables that satisfy its internal
+        constraints as close to initial as possible, or None if the constraints
+        can't be satisfied. """
+        x0 = initial[cluster.indices.ravel()]
+        if self.scaling:
+            length_scale = self._extent(x0.reshape(-1, 2))
+            error_scales = cluster.error_scales(length_scale)
+        else:
+            length_scale = 1
+            error_scales = numpy.ones(1)
+
+        def error(x):
+            return numpy.max(numpy.abs(cluster.evaluate(x) / error_scales))
+
+        if error(x0) <= self._cluster_tolerance:
+            return x0
+
+        result = optimize.minimize(
+            method="SLSQP",
+            x0=numpy.zeros_like(x0),
+            options={"ftol": self._cluster_tolerance},
+            fun=lambda z: numpy.sum(z ** 2),
+            jac=lambda z: 2 * z,
+            constraints={
+                "type": "eq",
+                "fun": lambda z: cluster.evaluate(x0 + length_scale * z)
+                / error_scales,
+                "jac": lambda z: self._cluster_jacobian(
+                    cluster, x0 + length_scale * z
+                )
+                * length_scale
+                / error_scales[:, numpy.newaxis],
+            },
+        )
+        self.statistics["cluster_solves"] += 1
+
+        values = x0 + length_scale * result.x
+        if error(values) > self._feasibility_tolerance:
+            return None
+        return values
+
+    def _length_scale(self, values):
+        """ Characteristic length of the sketch: diagonal of the bounding box of
+        points used by the constraints. It depends on the size of the sketch only,
+        not on its position. """
+        return self._extent(values[self._point_indices()])
+
+    def _point_indices(self):
+        """ Return array (k, 2) with variable indices of x and y of points
+        in `point_parameters` of all constraints (with duplicates). """
+        pairs = [numpy.empty((0, 2), dtype=self._variable_index_dtype)]
+        for block in self._nonempty_blocks():
+            array = block.parameter_array
+            for x, y in block.responsible_class.point_parameters:
+                pairs.append(numpy.stack([array[x], array[y]], axis=-1))
+        return numpy.concatenate(pairs)
+
+    @staticmethod
+    def _extent(points):
+        """ Diagonal of the bounding box of points in array (k, 2),
+        1 if there are no points or they all coincide. """
+        if len(points):
+            ret = numpy.hypot(*numpy.ptp(points, axis=0))
+            if ret > 0:
+                return ret
+        return 1.0
+
+    def _error_scales(self, length_scale):
+        """ Return array with scale of each constraint error, according to
+        `error_unit` of the constraints. Angles are kept in radians, which are
+        already dimensionless. """
+        unit_scales = {"distance": length_scale, "angle": 1.0}
+        return numpy.concatenate(
+            [
+                numpy.full(len(block), unit_scales[block.responsible_class.error_unit])
+                for block in self._nonempty_blocks()
+            ]
+        )
+
+    def _multi_start(self, initial, active):
+        """ Project randomly perturbed copies of initial onto the constraints
+        selected by the mask active all at once and return the feasible one
+        that is closest to initial.
+        The unperturbed initial values are always one of the candidates.
+        If none of the candidates converges, returns initial. """
+        random = numpy.random.RandomState(self.multi_start_seed)
+        spread = self.multi_start_spread * self._length_scale(initial)
+
+        candidates = numpy.tile(initial, (self.multi_start + 1, 1))
+        candidates[1:] += random.normal(scale=spread, size=candidates[1:].shape)
+
+        candidates, residuals = self._project_batch(candidates, active)
+        if self.scaling:
+            residuals /= self._error_scales(self._length_scale(initial))[active]
+        errors = numpy.max(numpy.abs(residuals), axis=1)
+
+        feasible = numpy.flatnonzero(errors <= self._feasibility_tolerance)
+        if len(feasible) == 0:
+            return initial
+
+        distances = numpy.sum((candidates[feasible] - initial) ** 2, axis=1)
+        return candidates[feasible[numpy.argmin(distances)]]
+
+    def _project_batch(self, candidates, active):
+        """ Move each row of candidates onto the constraints selected by
+        the mask active using damped minimum norm Gauss-Newton steps, all rows
+        at once. Returns the moved candidates and their constraint errors. """
+        residuals = self._evaluate_constraints(candidates)[:, active]
+        norms = numpy.sum(residuals ** 2, axis=1)
+
+        for _ in range(self._newton_iterations):
+            if numpy.all(numpy.max(numpy.abs(residuals), axis=1) <= 1e-12):
+                break
+
+            jacobians = self._evaluate_constraint_jacobians_batch(candidates)[
+                :, active
+            ]
+            steps = numpy.einsum(
+                "kij,kj->ki", numpy.linalg.pinv(jacobians, rcond=1e-10), residuals
+            )
+
+            # Halve steps of candidates whose error would grow
+            scale = numpy.ones(len(candidates))
+            for _ in range(8):
+                moved = candidates - scale[:, numpy.newaxis] * steps
+                moved_residuals = self._evaluate_constraints(moved)[:, active]
+                moved_norms = numpy.sum(moved_residuals ** 2, axis=1)
+                worse = ~(moved_norms < norms)
+                if not numpy.any(worse):
+                    break
+                scale[worse] /= 2
+
+            accept = moved_norms < norms
+            candidates[accept] = moved[accept]
+            residuals[accept] = moved_residuals[accept]
+            norms[accept] = moved_norms[accept]
+
+            if not numpy.any(accept):
+                break
+
+        return candidates, residuals
+
+    def _evaluate_constraints(self, x):
+        """ Evaluate all constraint errors into an array.
+        x can also be stacked to shape (k, n), the result then has shape (k, m). """
+        if self._parallel():
+            ret = numpy.empty(x.shape[:-1] + (self._constraint_count,))
+
+            def evaluate(cls, parameters, output_slice):
+                ret[..., output_slice] = cls.evaluate(x, parameters)
+
+            self._run_chunks(evaluate)
+            return ret
+
+        return numpy.concatenate(
+            [
+                block.responsible_class.evaluate(x, block.parameter_array.array())
+                for block in self._nonempty_blocks()
+            ],
+            axis=-1,
+        )
+
     def _evaluate_constraint_jacobians(self, x):
+        if self._parallel():
+            ret = numpy.empty((self._constraint_count, len(x)))
+
+            def evaluate(cls, parameters, output_slice):
+                ret[output_slice] = _block_jacobian(cls, x, parameters)
+
+            self._run_chunks(evaluate)
+            return ret
+
         return numpy.vstack(
-            autograd.jacobian(
-                lambda x: responsible_class.evaluate(x, block.parameter_array.array())
-            )(x)
-            for responsible_class, block in self._constraints.items()
+            [
+                _block_jacobian(
+                    block.responsible_class, x, block.parameter_array.array()
+                )
+                for block in self._nonempty_blocks()
+            ]
+        )
+
+    def _sparse_constraint_jacobians(self, x):
+        """ Return jacobian of all constraint errors at x (rows ordered as in
+        `_evaluate_constraints`) as a sparse CSR matrix. """
+        rows = []
+        columns = []
+        data = []
+        offset = 0
+        for block in self._nonempty_blocks():
+            parameters = block.parameter_array.array()
+            derivatives = _block_derivatives(
+                block.responsible_class, x, parameters, block.variable_fields
+            )
+            block_rows = numpy.arange(offset, offset + len(block))
+            for i, field in enumerate(block.variable_fields):
+                rows.append(block_rows)
+                columns.append(parameters[field])
+                data.append(derivatives[:, i])
+            offset += len(block)
+
+        if rows:
+            rows = numpy.concatenate(rows)
+            columns = numpy.concatenate(columns)
+            data = numpy.concatenate(data)
+        ret = sparse.coo_matrix(
+            (data, (rows, columns)), shape=(offset, len(x)), dtype=self._number_dtype
+        ).tocsr()
+        ret.sum_duplicates()
+        return ret
+
+    def _parallel(self):
+        """ Should evaluation use the thread pool? """
+        return (
+            bool(self.evaluation_threads)
+            and self._constraint_count >= self.parallel_threshold
+        )
+
+    def _run_chunks(self, function):
+        """ Call function(responsible class, parameters, output slice) for
+        row chunks of all blocks in the thread pool and wait for all of them.
+        Output slices are disjoint ranges of rows of `_evaluate_constraints()`
+        output. """
+        if self._executor is None or self._executor_threads != self.evaluation_threads:
+            if self._executor is not None:
+                self._executor.shutdown()
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                self.evaluation_threads
+            )
+            self._executor_threads = self.evaluation_threads
+
+        futures = []
+        offset = 0
+        for block in self._nonempty_blocks():
+            parameters = block.parameter_array.array()
+            count = len(block)
+            if count >= self.parallel_threshold:
+                chunk_size = -(-count // self.evaluation_threads)
+            else:
+                chunk_size = count
+            for start in range(0, count, chunk_size):
+                stop = min(start + chunk_size, count)
+                futures.append(
+                    self._executor.submit(
+                        function,
+                        block.responsible_class,
+                        _parameter_rows(parameters, start, stop),
+                        slice(offset + start, offset + stop),
+                    )
+                )
+            offset += count
+
+        for future in futures:
+            future.result()
+
+    def _evaluate_constraint_jacobians_batch(self, x):
+        """ Evaluate constraint jacobians for stacked states x of shape (k, n).
+        Returns array of shape (k, m, n). """
+        return numpy.concatenate(
+            [
+                _block_jacobian(
+                    block.responsible_class, x, block.parameter_array.array()
+                )
+                for block in self._nonempty_blocks()
+            ],
+            axis=1,
         )
 
+    def _notify_listeners(self, changed):
+        for listener in self._listeners:
+            listener(changed)
+
+    def _nonempty_blocks(self):
+        return (block for block in self._blocks if len(block))
+
+    def _incidence_matrix(self):
+        """ Return a sparse matrix with a row for each variable and a column for each
+        constraint id. Values are the number of times the constraint uses
+        the variable. """
+        indptr, indices = self._incidence.to_csr()
+        return sparse.csr_matrix(
+            (numpy.ones(len(indices)), indices, indptr),
+            shape=(len(self._variables), len(self._constraint_objects)),
+        )
+
+    def _jacobian_sparsity(self):
+        """ Return sparsity pattern of the constraint jacobian (rows ordered as
+        in `_evaluate_constraints`) as a sparse boolean matrix. """
+        rows = []
+        columns = []
+        offset = 0
+        for block in self._nonempty_blocks():
+            block_rows = numpy.arange(offset, offset + len(block))
+            for field in block.variable_fields:
+                rows.append(block_rows)
+                columns.append(block.parameter_array[field])
+            offset += len(block)
+
+        if rows:
+            rows = numpy.concatenate(rows)
+            columns = numpy.concatenate(columns)
+        ret = sparse.coo_matrix(
+            (numpy.ones(len(rows), dtype=bool), (rows, columns)),
+            shape=(offset, len(self._variables)),
+        ).tocsr()
+        ret.sum_duplicates()
+        return ret
+
     def _print_internal_state(self):
-        for index, (var, constraints) in enumerate(self._variables.items()):
-            print("variables[{}]: {}, used by {}".format(index, var, constraints))
-        for responsible_class, block in self._constraints.items():
-            print(responsible_class)
-            for constraint in block.constraints:
-                print("  ", str(constraint))
+        for index, var in enumerate(self._variables):
+            print(
+                "variables[{}]: {}, used by {}".format(
+                    index,
+                    var,
+                    [
+                        self._constraint_objects[i]
+                        for i in self._incidence.row(index)
+                    ],
+                )
+            )
+        for block in self._blocks:
+            print(block.responsible_class)
+            for constraint_id in block.ids:
+                print("  ", constraint_id, str(self._constraint_objects[constraint_id]))
 
     def _assert_internal_state(self):
         """ Asserts that the inner state of the solver is ok and everything is
         linked where it should. """
 
         self._variables._assert_internal_state()  # I still don't 100% trust IndexedDict :)
+        self._incidence._assert_internal_state()
+        assert len(self._incidence) == len(self._variables)
 
-        constraints_from_variables = collections_extended.bag()
-        for var_constraints in self._variables.values():
-            constraints_from_variables |= var_constraints
-
-        for constraint in constraints_from_variables:
-            responsible_class = self._get_responsible_class(constraint)
-            assert constraint in self._constraints[responsible_class].constraints
+        assert len(self._constraint_objects) == len(self._constraint_locations)
+        for constraint, constraint_id in self._constraint_ids.items():
+            assert self._constraint_objects[constraint_id] is constraint
+        for constraint_id in self._free_constraint_ids:
+            assert self._constraint_objects[constraint_id] is None
+            assert not self._constraint_id_used(constraint_id)
 
+        expected_incidence = collections.Counter()
         constraint_count = 0
 
-        for responsible_class, block in self._constraints.items():
-            assert len(block.constraints) == len(block.parameter_array)
-            assert len(block.constraints) > 0, "Empty constraint block"
-            for i, constraint in enumerate(block.constraints):
-                assert constraint in constraints_from_variables
+        for block_index, block in enumerate(self._blocks):
+            assert block.index == block_index
+            assert self._constraints[block.responsible_class] is block
+            assert len(block.ids) == len(block.parameter_array)
+
+            for row, constraint_id in enumerate(block.ids):
                 constraint_count += 1
+                assert tuple(self._constraint_locations[constraint_id]) == (
+                    block_index,
+                    row,
+                )
 
-                constraint_parameters = constraint.get_parameters()
-                constraint_variables = self._constraint_variables(constraint_parameters)
-                assert len(constraint_variables) > 0
-                for v in constraint_variables:
-                    assert v in self._variables
-                    assert constraint in self._variables[v]
+                for field_index, field in enumerate(block.variable_fields):
+                    variable_index = int(block.parameter_array[field][row])
+                    assert variable_index < len(self._variables)
+                    expected_incidence[
+                        variable_index, int(constraint_id), field_index
+                    ] += 1
 
-                dtype, values = self._constraint_parameters(constraint_parameters)
-                assert block.parameter_array.dtype == dtype
-                assert tuple(block.parameter_array[i]) == values
+                constraint = self._constraint_objects[constraint_id]
+                if constraint is None:
+                    # Added by add_constraints
+                    continue
+                assert (
+                    self._get_responsible_class(type(constraint))
+                    is block.responsible_class
+                )
+                constraint_parameters = list(constraint.get_parameters())
+                assert len(self._constraint_variables(constraint_parameters)) > 0
+                schema = _get_schema(type(constraint))
+                assert [name for name, _ in constraint_parameters] == schema.names
+                assert [
+                    isinstance(value, objects.Variable)
+                    for _, value in constraint_parameters
+                ] == schema.is_variable
+                values = self._constraint_parameters(
+                    schema, constraint_parameters, register=False
+                )
+                assert block.parameter_array.dtype == schema.dtype
+                assert tuple(block.parameter_array[row]) == values
+
+        assert len(self._suspended) == len(self._constraint_locations)
+        suspended = self._suspended.array()
+        assert self._suspended_count == numpy.count_nonzero(suspended)
+        for constraint_id in self._free_constraint_ids:
+            assert not suspended[constraint_id]
+        for members in self._groups.values():
+            assert all(self._constraint_id_used(i) for i in members)
+        assert len(self._residuals) == len(self._constraint_locations)
+        residuals = self._residuals.array()
+        for constraint_id in self._free_constraint_ids:
+            assert numpy.isnan(residuals[constraint_id])
+        for constraint_id, changes in self._parameter_changes.items():
+            assert self._constraint_id_used(constraint_id)
+            block = self._blocks[self._constraint_locations["block"][constraint_id]]
+            assert set(changes) <= set(block.numeric_fields)
 
         assert self._constraint_count == constraint_count
+        assert constraint_count == len(self._constraint_objects) - len(
+            self._free_constraint_ids
+        )
+        assert len(self._constraint_ids) == sum(
+            1 for constraint in self._constraint_objects if constraint is not None
+        )
+
+        incidence = collections.Counter()
+        for variable_index in range(len(self._variables)):
+            if self._incidence.row_size(variable_index) == 0:
+                assert self._variables.key(variable_index) in self._added_variables
+            row = self._incidence.row(variable_index)
+            for constraint_id, field_index in zip(
+                row, self._incidence.payloads(variable_index)
+            ):
+                incidence[variable_index, int(constraint_id), int(field_index)] += 1
+        assert incidence == expected_incidence
 
         # Returns True to allow using this method as `assert self._assert_internal_state()`
         return True
@@ -194,53 +1956,363 @@ class Solver:
             self.solve()
 
     @staticmethod
-    def _get_responsible_class(constraint):
-        """ Return a class that handles evaluations for given constraint. """
-        # TODO: Properly support subclassing constraints
-        ret = constraint.__class__
-        assert isinstance(constraint, ret)
+    def _get_responsible_class(cls):
+        """ Return a class that handles evaluations for constraints of class cls.
+        This is the class that defines the `evaluate` kernel, so subclasses
+        that only change the constructor share a block with their base. """
+        try:
+            return _responsible_classes[cls]
+        except KeyError:
+            pass
+        ret = next(c for c in cls.__mro__ if "evaluate" in c.__dict__)
+        _responsible_classes[cls] = ret
         return ret
 
     def _constraint_variables(self, parameters):
         return [v for _, v in parameters if isinstance(v, objects.Variable)]
 
-    def _constraint_parameters(self, parameters):
-        dtype = []
-        values = []
-        for name, value in parameters:
-            if isinstance(value, objects.Variable):
-                dtype.append((name, self._variable_index_dtype))
-                values.append(self._variables.index(value))
-            else:
-                dtype.append((name, self._number_dtype))
-                values.append(value)
+    def _constraint_parameters(self, schema, parameters, register=True):
+        """ Convert constraint parameters to a record for the parameter array.
+        Parameters must match the schema.
+        If `register` is True, unknown variables get added to the solver. """
+        if register:
+            variable_index = self._register_variable
+        else:
+            variable_index = self._variables.index
+        return tuple(
+            variable_index(value) if is_variable else value
+            for (_, value), is_variable in zip(parameters, schema.is_variable)
+        )
+
+    def _get_block(self, responsible_class, schema):
+        """ Return block for the responsible class, create it if necessary """
+        try:
+            block = self._constraints[responsible_class]
+        except KeyError:
+            block = _ConstraintBlock(
+                len(self._blocks),
+                responsible_class,
+                schema.dtype,
+                self.parameter_storage,
+                self.parameter_layout,
+            )
+            self._constraints[responsible_class] = block
+            self._blocks.append(block)
+        if block.parameter_array.dtype != schema.dtype:
+            raise TypeError(
+                "Parameters don't match the evaluation kernel of {}".format(
+                    responsible_class.__name__
+                )
+            )
+        return block
 
-        return dtype, tuple(values)
+    def _constraint_id_used(self, constraint_id):
+        return (
+            0 <= constraint_id < len(self._constraint_locations)
+            and self._constraint_locations["block"][constraint_id] != self._free_block
+        )
 
+    def _remove_constraint_id(self, constraint_id):
+        """ Remove constraint from its block and free its id.
+        Returns indices of variables that the constraint used. """
+        block_index, row = self._constraint_locations[constraint_id]
+        block = self._blocks[block_index]
+        record = block.parameter_array[row]
+        variable_indices = [int(record[field]) for field in block.variable_fields]
 
-class _VariableRecord:
-    __slots__ = ("index", "constraints")
+        for field_index, variable_index in enumerate(variable_indices):
+            self._incidence.remove(variable_index, constraint_id, field_index)
 
-    def __init__(self, index):
-        self.index = index
-        self.constraints = set()
+        moved_id = block.fast_pop(row)
+        if moved_id is not None:
+            self._constraint_locations["row"][moved_id] = row
+
+        if self._suspended[constraint_id]:
+            self._suspended[constraint_id] = False
+            self._suspended_count -= 1
+        self._residuals[constraint_id] = numpy.nan
+        for members in self._groups.values():
+            members.discard(constraint_id)
+
+        self._constraint_objects[constraint_id] = None
+        self._constraint_locations[constraint_id] = (self._free_block, 0)
+        self._free_constraint_ids.append(constraint_id)
+        self._constraint_count -= 1
+        self._structure_version += 1
+        # Removing a constraint can't violate the others, the id may be reused
+        self._dirty_constraint_ids.discard(constraint_id)
+        self._parameter_changes.pop(constraint_id, None)
+        # The prediction refers to constraints by ids
+        self._prediction = None
+
+        return variable_indices
+
+    def _remove_variables(self, variable_indices):
+        """ Remove variables with given indices that are no longer used,
+        together with unused variables registered by `add_variables()`. """
+        variable_indices = set(variable_indices)
+        for variable in self._added_variables:
+            try:
+                variable_indices.add(self._variables.index(variable))
+            except KeyError:
+                # Already removed with its constraints
+                pass
+        self._added_variables.clear()
+
+        # Descending order makes sure that variables moved by _remove_variable
+        # are never the ones still waiting for removal
+        for variable_index in sorted(variable_indices, reverse=True):
+            if self._incidence.row_size(variable_index) == 0:
+                self._remove_variable(variable_index)
+
+    def _register_variable(self, variable):
+        """ Return index of a variable, adding it to the solver if necessary. """
+        try:
+            return self._variables.index(variable)
+        except KeyError:
+            self._variables[variable] = None
+            return self._incidence.add_row()
+
+    def _remove_variable(self, variable_index):
+        """ Remove an unused variable, moving the last variable to its place. """
+        old_index = len(self._variables) - 1
+        _, new_index, _, _ = self._variables.fast_pop(index=variable_index)
+        self._incidence.pop_row(variable_index)
+        assert new_index == variable_index
+
+        if new_index == old_index:
+            return
+
+        # Point all uses of the moved variable to its new index
+        locations = self._constraint_locations[self._incidence.row(new_index)]
+        field_indices = self._incidence.payloads(new_index)
+        for block_index in numpy.unique(locations["block"]):
+            block = self._blocks[block_index]
+            in_block = locations["block"] == block_index
+            for field_index in numpy.unique(field_indices[in_block]):
+                rows = locations["row"][in_block & (field_indices == field_index)]
+                field = block.variable_fields[field_index]
+                block.parameter_array[field][rows] = new_index
+
+    def _allocate_constraint_id(self, constraint):
+        if self._free_constraint_ids:
+            constraint_id = self._free_constraint_ids.pop()
+            self._constraint_objects[constraint_id] = constraint
+        else:
+            constraint_id = len(self._constraint_objects)
+            self._constraint_objects.append(constraint)
+            self._constraint_locations.append((self._free_block, 0))
+            self._suspended.append(False)
+            self._residuals.append(numpy.nan)
+        self._constraint_ids[constraint] = constraint_id
+        return constraint_id
+
+    def _allocate_constraint_ids(self, count):
+        """ Allocate ids for count constraints without objects """
+        split = len(self._free_constraint_ids) - min(count, len(self._free_constraint_ids))
+        reused = self._free_constraint_ids[split:][::-1]
+        del self._free_constraint_ids[split:]
+
+        new_count = count - len(reused)
+        first_new = len(self._constraint_objects)
+        self._constraint_objects.extend([None] * new_count)
+        locations = numpy.zeros(new_count, dtype=self._constraint_locations.dtype)
+        locations["block"] = self._free_block
+        self._constraint_locations.extend(locations)
+        self._suspended.extend(numpy.zeros(new_count, dtype=bool))
+        self._residuals.extend(numpy.full(new_count, numpy.nan))
+
+        return numpy.concatenate(
+            [
+                numpy.array(reused, dtype=self._constraint_id_dtype),
+                numpy.arange(
+                    first_new, first_new + new_count, dtype=self._constraint_id_dtype
+                ),
+            ]
+        )
 
 
 class _ConstraintBlock:
     """ Group of constraints of the same type (sharing the same responsible class),
     that can be evaluated togetgher using numpy """
 
-    __slots__ = ("constraints", "parameter_array")
+    __slots__ = (
+        "index",
+        "responsible_class",
+        "variable_fields",
+        "numeric_fields",
+        "ids",
+        "parameter_array",
+    )
+
+    def __init__(self, index, responsible_class, dtype, storage=None, layout="records"):
+        self.index = index
+        self.responsible_class = responsible_class
+        if layout == "records":
+            self.parameter_array = util.DynamicArray(dtype=dtype, storage=storage)
+        elif layout == "columns":
+            self.parameter_array = util.ColumnarArray(dtype=dtype, storage=storage)
+        else:
+            raise ValueError("Unknown parameter layout {!r}".format(layout))
+        self.variable_fields = [
+            name
+            for name in self.parameter_array.dtype.names
+            if self.parameter_array.dtype[name] == Solver._variable_index_dtype
+        ]
+        self.numeric_fields = [
+            name
+            for name in self.parameter_array.dtype.names
+            if name not in self.variable_fields
+        ]
+        self.ids = util.DynamicArray(dtype=Solver._constraint_id_dtype)  # row -> id
+
+    def storage_arrays(self):
+        """ Return list of DynamicArrays holding the parameters """
+        if isinstance(self.parameter_array, util.ColumnarArray):
+            return list(self.parameter_array.column_arrays().values())
+        return [self.parameter_array]
 
-    def __init__(self, dtype):
-        self.constraints = collections_extended.setlist()
-        self.parameter_array = util.DynamicArray(dtype=dtype)
+    def close(self):
+        self.parameter_array.close()
+        self.ids.close()
 
-    def fast_pop(self, constraint):
-        """ Swap the deleted constraint to the back and pop """
-        index = self.constraints.index(constraint)
-        if index != len(self.constraints) - 1:
-            self.constraints[index] = self.constraints[-1]
-            self.parameter_array[index] = self.parameter_array[-1]
-        self.constraints.pop()
+    def fast_pop(self, row):
+        """ Swap the given row to the back and pop.
+        Returns id of the constraint that was moved to `row`, or None if
+        the removed row was the last one. """
+        last = len(self.ids) - 1
+        if row != last:
+            moved_id = self.ids[last]
+            self.ids[row] = moved_id
+            self.parameter_array[row] = self.parameter_array[last]
+        else:
+            moved_id = None
+        self.ids.pop()
         self.parameter_array.pop()
+        return moved_id
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def _parameter_rows(parameters, start, stop):
+    """ Return a view of rows start:stop of block parameters (a record array or
+    a dict of columns) """
+    if isinstance(parameters, dict):
+        return {name: column[start:stop] for name, column in parameters.items()}
+    return parameters[start:stop]
+
+
+def _block_jacobian(cls, x, parameters):
+    """ Return jacobian of errors of a block of constraints of the responsible
+    class cls at x. x may be stacked to shape (k, n), the result then has shape
+    (k, rows, n). Uses analytic derivatives of the class if it has them,
+    autograd otherwise. """
+    if cls.jacobian is None:
+        if x.ndim == 1:
+            return autograd.jacobian(lambda x: cls.evaluate(x, parameters))(x)
+
+        # Rows of x are independent, so a single backward pass gives
+        # derivatives of the whole block for all k states at once.
+        schema = _get_schema(cls)
+        fields = [name for name, v in zip(schema.names, schema.is_variable) if v]
+    else:
+        fields = cls.variable_parameters
+
+    derivatives = _block_derivatives(cls, x, parameters, fields)
+    rows = derivatives.shape[-2]
+    ret = numpy.zeros(derivatives.shape[:-1] + x.shape[-1:])
+    row_indices = numpy.arange(rows)
+    for i, name in enumerate(fields):
+        # One field at a time, so that a variable used by several fields of
+        # the same row accumulates its derivatives
+        ret[..., row_indices, parameters[name]] += derivatives[..., i]
+    return ret
+
+
+def _block_derivatives(cls, x, parameters, fields):
+    """ Return derivatives of errors of a block of constraints at x by
+    the variable parameter fields, array of shape (rows, len(fields)).
+    x may be stacked to shape (k, n), the result then has shape
+    (k, rows, len(fields)).
+
+    Without analytic derivatives of the class, each row is evaluated with its
+    own copy of the variables it uses, so that a single backward pass gives
+    derivatives of all rows. """
+    if cls.jacobian is not None:
+        return cls.jacobian(x, parameters)
+
+    names = parameters.keys() if isinstance(parameters, dict) else parameters.dtype.names
+    local = {name: parameters[name] for name in names}
+    count = len(local[fields[0]])
+    copies = []
+    for i, field in enumerate(fields):
+        copies.append(x[..., parameters[field]])
+        local[field] = numpy.arange(i * count, (i + 1) * count)
+    gradient = autograd.grad(lambda v: autograd.numpy.sum(cls.evaluate(v, local)))(
+        numpy.concatenate(copies, axis=-1)
+    )
+    return numpy.swapaxes(
+        gradient.reshape(x.shape[:-1] + (len(fields), count)), -1, -2
+    )
+
+
+def _parameter_derivatives(cls, x, parameters, name):
+    """ Return derivative of each constraint error by its numeric parameter
+    `name`, at x. parameters is a record array. """
+    local = {field: parameters[field] for field in parameters.dtype.names}
+
+    def errors(values):
+        local[name] = values
+        return autograd.numpy.sum(cls.evaluate(x, local))
+
+    return autograd.grad(errors)(numpy.array(parameters[name], dtype=float))
+
+
+_schemas = {}  # constraint class -> _Schema
+_responsible_classes = {}  # constraint class -> class defining its evaluate kernel
+
+
+class _Schema:
+    """ Layout of parameters of a constraint class """
+
+    __slots__ = ("names", "is_variable", "dtype")
+
+    def __init__(self, names, is_variable):
+        self.names = names
+        self.is_variable = is_variable
+        self.dtype = numpy.dtype(
+            [
+                (name, Solver._variable_index_dtype if v else Solver._number_dtype)
+                for name, v in zip(names, is_variable)
+            ]
+        )
+
+
+def _get_schema(cls, parameters=None):
+    """ Return schema of a constraint class.
+    Uses the parameters declared by the class, schema of classes without
+    the declaration is inferred from `parameters` (return value of
+    get_parameters of the first added instance). """
+    try:
+        return _schemas[cls]
+    except KeyError:
+        pass
+
+    if cls.variable_parameters is not None:
+        variable_names = list(cls.variable_parameters)
+        numeric_names = list(cls.numeric_parameters)
+        schema = _Schema(
+            variable_names + numeric_names,
+            [True] * len(variable_names) + [False] * len(numeric_names),
+        )
+    elif parameters is not None:
+        schema = _Schema(
+            [name for name, _ in parameters],
+            [isinstance(value, objects.Variable) for _, value in parameters],
+        )
+    else:
+        raise ValueError("{} doesn't declare its parameters".format(cls.__name__))
+
+    _schemas[cls] = schema
+    return schema
@@ -0,0 +1,517 @@
+import collections
+import math
+
+import numpy
+
+from . import objects
+from . import util
+
+
+class SpatialIndex:
+    """ Uniform grid over points, line segments, arcs and polylines for hit testing
+    and region queries.
+
+    Every indexed object is decomposed into primitives (points, segments and arcs),
+    whose coordinates are cached in numpy arrays. Queries gather candidate
+    primitives from grid cells and test them in a single vectorised pass.
+
+    Cached coordinates are refreshed by calling `update()` with the changed variables.
+    If a solver is passed to the constructor, the index registers itself as
+    a listener and gets updated after every solve. """
+
+    _point = 0
+    _segment = 1
+    _arc = 2
+
+    _free = 255
+
+    _primitive_dtype = [
+        ("kind", numpy.uint8),
+        ("coords", numpy.float64, (5,)),  # x0, y0, x1, y1, h
+        ("bbox", numpy.float64, (4,)),  # min x, min y, max x, max y
+        ("cells", numpy.int64, (4,)),  # min i, min j, max i, max j
+    ]
+
+    # Primitives spanning more cells than this are not bucketed, but tested
+    # with every query instead.
+    _max_cells = 64
+
+    # Number of rings of grid cells searched in `nearest()` before falling
+    # back to testing all primitives.
+    _max_rings = 4
+
+    _arc_samples = 16
+
+    def __init__(self, solver=None, cell_size=10.0):
+        if cell_size <= 0:
+            raise ValueError("Cell size must be positive")
+
+        self.cell_size = float(cell_size)
+
+        self._primitives = util.DynamicArray(dtype=self._primitive_dtype)
+        self._free_slots = []
+        self._owners = []  # slot -> indexed object
+        self._slot_variables = []  # slot -> tuple of variables (or None)
+
+        self._entities = {}  # indexed object -> list of slots
+        self._variable_slots = {}  # variable -> list of (slot, coordinate index)
+
+        self._grid = collections.defaultdict(set)  # (i, j) -> set of slots
+        self._large = set()  # slots that are not in the grid
+
+        self._solver = solver
+        if solver is not None:
+            solver.add_listener(self.update)
+
+    def close(self):
+        """ Stop receiving updates from the solver """
+        if self._solver is not None:
+            self._solver.remove_listener(self.update)
+            self._solver = None
+
+    def add(self, obj):
+        """ Add a Point, LineSegment, Arc or Polyline to the index. """
+        if obj in self._entities:
+            raise ValueError("Object already indexed")
+
+        if isinstance(obj, objects.Point):
+            primitives = [(self._point, (obj.x, obj.y))]
+        elif isinstance(obj, objects.LineSegment):
+            primitives = [(self._segment, self._segment_coords(obj))]
+        elif isinstance(obj, objects.Arc):
+            primitives = [(self._arc, self._segment_coords(obj) + (obj.h,))]
+        elif isinstance(obj, objects.Polyline):
+            primitives = [
+                (self._segment, self._segment_coords(segment))
+                for segment in obj.line_segments
+            ]
+        else:
+            raise TypeError("Can't index {}".format(type(obj).__name__))
+
+        slots = [self._add_primitive(obj, kind, coords) for kind, coords in primitives]
+        self._entities[obj] = slots
+        self._rebucket(numpy.array(slots, dtype=numpy.intp))
+
+    def remove(self, obj):
+        """ Remove a previously added object from the index. """
+        try:
+            slots = self._entities.pop(obj)
+        except KeyError:
+            raise ValueError("Object not indexed")
+
+        for slot in slots:
+            self._remove_primitive(slot)
+
+    def update(self, variables=None):
+        """ Refresh cached coordinates of the given variables (all variables if None)
+        and move the affected primitives in the grid. """
+        if variables is None:
+            variables = list(self._variable_slots)
+
+        slots = []
+        indices = []
+        values = []
+        for variable in variables:
+            try:
+                references = self._variable_slots[variable]
+            except KeyError:
+                continue
+            value = float(variable)
+            for slot, index in references:
+                slots.append(slot)
+                indices.append(index)
+                values.append(value)
+
+        if not slots:
+            return
+
+        slots = numpy.array(slots, dtype=numpy.intp)
+        self._primitives.array()["coords"][slots, indices] = values
+        self._rebucket(numpy.unique(slots))
+
+    def nearest(self, x, y, max_distance=math.inf):
+        """ Find the indexed object closest to point (x, y).
+        Returns a tuple (object, distance), or None if no object is closer than
+        max_distance. """
+        query = numpy.array([x, y], dtype=numpy.float64)
+        i, j = self._cell(query)
+
+        best_slot = None
+        best_distance = math.inf
+        seen = set()
+
+        ring = 0
+        while True:
+            if ring > self._max_rings:
+                candidates = self._live_slots()
+            else:
+                candidates = self._ring_slots(i, j, ring)
+                if ring == 0:
+                    candidates |= self._large
+                candidates -= seen
+                seen |= candidates
+                candidates = numpy.fromiter(
+                    candidates, dtype=numpy.intp, count=len(candidates)
+                )
+
+            if len(candidates):
+                distances = self._distances(candidates, query)
+                argmin = numpy.argmin(distances)
+                if distances[argmin] < best_distance:
+                    best_distance = distances[argmin]
+                    best_slot = candidates[argmin]
+
+            if ring > self._max_rings:
+                break
+
+            # Everything in cells further than `ring` is at least this far away
+            lower_bound = ring * self.cell_size
+            if best_distance <= lower_bound or lower_bound > max_distance:
+                break
+            ring += 1
+
+        if best_slot is None or best_distance > max_distance:
+            return None
+        return self._owners[best_slot], float(best_distance)
+
+    def query_box(self, x0, y0, x1, y1, contained=False):
+        """ Return a list of indexed objects intersecting the given rectangle
+        (or lying completely inside it if `contained` is True). """
+        box = numpy.array(
+            [min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)], dtype=numpy.float64
+        )
+        i0, j0 = self._cell(box[:2])
+        i1, j1 = self._cell(box[2:])
+
+        candidates = set(self._large)
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > len(self._grid):
+            for (i, j), bucket in self._grid.items():
+                if i0 <= i <= i1 and j0 <= j <= j1:
+                    candidates.update(bucket)
+        else:
+            for i in range(i0, i1 + 1):
+                for j in range(j0, j1 + 1):
+                    candidates.update(self._grid.get((i, j), ()))
+        candidates = numpy.fromiter(candidates, dtype=numpy.intp, count=len(candidates))
+
+        if contained:
+            hits = self._contained(candidates, box)
+            hit_slots = set(candidates[hits].tolist())
+            # An object is contained only if all of its primitives are
+            return [
+                obj
+                for obj in self._unique_owners(candidates[hits])
+                if all(slot in hit_slots for slot in self._entities[obj])
+            ]
+        else:
+            hits = self._intersects(candidates, box)
+            return self._unique_owners(candidates[hits])
+
+    def __len__(self):
+        return len(self._entities)
+
+    def __contains__(self, obj):
+        return obj in self._entities
+
+    def _unique_owners(self, slots):
+        return list(
+            collections.OrderedDict.fromkeys(self._owners[slot] for slot in slots)
+        )
+
+    @staticmethod
+    def _segment_coords(obj):
+        return (obj.a.x, obj.a.y, obj.b.x, obj.b.y)
+
+    def _add_primitive(self, owner, kind, coords):
+        coord_values = [float(c) for c in coords]
+        coord_values.extend([0.0] * (5 - len(coord_values)))
+        record = (kind, coord_values, (0, 0, 0, 0), (0, 0, -1, -1))
+
+        if self._free_slots:
+            slot = self._free_slots.pop()
+            self._primitives[slot] = record
+            self._owners[slot] = owner
+            self._slot_variables[slot] = coords
+        else:
+            slot = len(self._primitives)
+            self._primitives.append(record)
+            self._owners.append(owner)
+            self._slot_variables.append(coords)
+
+        for index, variable in enumerate(coords):
+            if isinstance(variable, objects.Variable):
+                self._variable_slots.setdefault(variable, []).append((slot, index))
+
+        return slot
+
+    def _remove_primitive(self, slot):
+        self._unbucket(slot, self._primitives[slot]["cells"])
+        self._large.discard(slot)
+
+        for index, variable in enumerate(self._slot_variables[slot]):
+            if not isinstance(variable, objects.Variable):
+                continue
+            references = self._variable_slots[variable]
+            references.remove((slot, index))
+            if not references:
+                del self._variable_slots[variable]
+
+        self._primitives.array()["kind"][slot] = self._free
+        self._owners[slot] = None
+        self._slot_variables[slot] = None
+        self._free_slots.append(slot)
+
+    def _live_slots(self):
+        return numpy.flatnonzero(self._primitives.array()["kind"] != self._free)
+
+    def _cell(self, xy):
+        i, j = numpy.floor(xy / self.cell_size).astype(numpy.int64)
+        return int(i), int(j)
+
+    def _ring_slots(self, i, j, ring):
+        """ Return set of slots in grid cells exactly `ring` cells away from (i, j) """
+        ret = set()
+        if ring == 0:
+            ret.update(self._grid.get((i, j), ()))
+            return ret
+        for k in range(-ring, ring + 1):
+            for cell in ((i + k, j - ring), (i + k, j + ring)):
+                ret.update(self._grid.get(cell, ()))
+        for k in range(-ring + 1, ring):
+            for cell in ((i - ring, j + k), (i + ring, j + k)):
+                ret.update(self._grid.get(cell, ()))
+        return ret
+
+    def _rebucket(self, slots):
+        """ Recalculate bounding boxes of given primitives and move them to
+        the right grid cells. """
+        array = self._primitives.array()
+        bbox = self._bounding_boxes(array[slots])
+        array["bbox"][slots] = bbox
+
+        cells = numpy.floor(bbox / self.cell_size).astype(numpy.int64)
+        old_cells = array["cells"][slots]
+        moved = numpy.flatnonzero(numpy.any(cells != old_cells, axis=1))
+
+        for k in moved:
+            slot = slots[k]
+            self._unbucket(slot, old_cells[k])
+            self._large.discard(slot)
+
+            i0, j0, i1, j1 = cells[k]
+            if (i1 - i0 + 1) * (j1 - j0 + 1) > self._max_cells:
+                self._large.add(slot)
+            else:
+                for i in range(i0, i1 + 1):
+                    for j in range(j0, j1 + 1):
+                        self._grid[i, j].add(slot)
+
+        array["cells"][slots] = cells
+
+    def _unbucket(self, slot, cells):
+        i0, j0, i1, j1 = cells
+        if slot in self._large:
+            return
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                bucket = self._grid[i, j]
+                bucket.discard(slot)
+                if not bucket:
+                    del self._grid[i, j]
+
+    @classmethod
+    def _bounding_boxes(cls, primitives):
+        kind = primitives["kind"]
+        coords = primitives["coords"]
+
+        x = coords[:, [0, 2]]
+        y = coords[:, [1, 3]]
+        bbox = numpy.column_stack(
+            [x.min(axis=1), y.min(axis=1), x.max(axis=1), y.max(axis=1)]
+        )
+
+        point = kind == cls._point
+        bbox[point] = coords[point][:, [0, 1, 0, 1]]
+
+        arc = numpy.flatnonzero(kind == cls._arc)
+        if len(arc):
+            center, radius, normal, midpoint, h, curved = cls._arc_geometry(
+                coords[arc]
+            )
+            # Extreme points of the circle, included only if they lie on the arc
+            for axis, sign in ((0, -1), (1, -1), (0, 1), (1, 1)):
+                extreme = center.copy()
+                extreme[:, axis] += sign * radius
+                on_arc = curved & cls._on_arc_side(extreme, midpoint, normal, h)
+                column = axis + (2 if sign > 0 else 0)
+                reduce = numpy.maximum if sign > 0 else numpy.minimum
+                bbox[arc[on_arc], column] = reduce(
+                    bbox[arc[on_arc], column], extreme[on_arc, axis]
+                )
+
+        return bbox
+
+    @staticmethod
+    def _arc_geometry(coords):
+        """ Calculate center, radius, unit normal (pointing to the right of ab),
+        chord midpoint, height and curvature flag for arcs given by coords rows. """
+        a = coords[:, 0:2]
+        b = coords[:, 2:4]
+        h = coords[:, 4]
+
+        d = b - a
+        chord = numpy.hypot(d[:, 0], d[:, 1])
+        safe_chord = numpy.where(chord > 0, chord, 1)
+        normal = numpy.column_stack([d[:, 1], -d[:, 0]]) / safe_chord[:, numpy.newaxis]
+        midpoint = (a + b) / 2
+
+        # Arcs with negligible height are handled as line segments
+        curved = numpy.abs(h) > 1e-9 * chord
+        safe_h = numpy.where(curved, h, 1)
+        half_chord = chord / 2
+        signed_radius = (half_chord * half_chord + h * h) / (2 * safe_h)
+        center = midpoint + ((h - signed_radius)[:, numpy.newaxis] * normal)
+
+        return center, numpy.abs(signed_radius), normal, midpoint, h, curved
+
+    @staticmethod
+    def _on_arc_side(xy, midpoint, normal, h):
+        """ Points on the circle are on the arc iff they lie on the same side of the
+        chord as the arc midpoint. """
+        side = numpy.einsum("ij,ij->i", xy - midpoint, normal)
+        return side * numpy.sign(h) >= 0
+
+    def _distances(self, slots, query):
+        primitives = self._primitives.array()[slots]
+        kind = primitives["kind"]
+        coords = primitives["coords"]
+
+        a = coords[:, 0:2]
+        b = coords[:, 2:4]
+        distances = self._segment_distances(a, b, query)
+
+        point = kind == self._point
+        distances[point] = numpy.hypot(*(query - a[point]).T)
+
+        arc = numpy.flatnonzero(kind == self._arc)
+        if len(arc):
+            center, radius, normal, midpoint, h, curved = self._arc_geometry(
+                coords[arc]
+            )
+            to_query = query - center
+            center_distance = numpy.hypot(to_query[:, 0], to_query[:, 1])
+            safe_distance = numpy.where(center_distance > 0, center_distance, 1)
+            projected = (
+                center + to_query * (radius / safe_distance)[:, numpy.newaxis]
+            )
+            on_arc = self._on_arc_side(projected, midpoint, normal, h)
+            endpoint_distance = numpy.minimum(
+                numpy.hypot(*(query - a[arc]).T), numpy.hypot(*(query - b[arc]).T)
+            )
+            arc_distances = numpy.where(
+                on_arc, numpy.abs(center_distance - radius), endpoint_distance
+            )
+            distances[arc[curved]] = arc_distances[curved]
+
+        return distances
+
+    @staticmethod
+    def _segment_distances(a, b, query):
+        d = b - a
+        length_squared = numpy.einsum("ij,ij->i", d, d)
+        safe_length_squared = numpy.where(length_squared > 0, length_squared, 1)
+        t = numpy.einsum("ij,ij->i", query - a, d) / safe_length_squared
+        t = numpy.clip(t, 0, 1)
+        closest = a + t[:, numpy.newaxis] * d
+        return numpy.hypot(*(query - closest).T)
+
+    def _contained(self, slots, box):
+        bbox = self._primitives.array()["bbox"][slots]
+        return numpy.all(bbox[:, :2] >= box[:2], axis=1) & numpy.all(
+            bbox[:, 2:] <= box[2:], axis=1
+        )
+
+    def _intersects(self, slots, box):
+        primitives = self._primitives.array()[slots]
+        bbox = primitives["bbox"]
+        overlap = numpy.all(bbox[:, :2] <= box[2:], axis=1) & numpy.all(
+            bbox[:, 2:] >= box[:2], axis=1
+        )
+        # Primitives with bounding box completely inside are hits without
+        # further testing.
+        hits = overlap & self._contained(slots, box)
+
+        kind = primitives["kind"]
+        coords = primitives["coords"]
+
+        undecided = numpy.flatnonzero(overlap & ~hits & (kind == self._segment))
+        hits[undecided] = self._segments_intersect_box(
+            coords[undecided, 0:2], coords[undecided, 2:4], box
+        )
+
+        undecided = numpy.flatnonzero(overlap & ~hits & (kind == self._arc))
+        if len(undecided):
+            # Approximate the arcs by polylines
+            samples = self._sample_arcs(coords[undecided])
+            count = self._arc_samples
+            a = samples[:, :-1].reshape(-1, 2)
+            b = samples[:, 1:].reshape(-1, 2)
+            pieces = self._segments_intersect_box(a, b, box).reshape(-1, count)
+            hits[undecided] = numpy.any(pieces, axis=1)
+
+        return hits
+
+    @staticmethod
+    def _segments_intersect_box(a, b, box):
+        """ Separating axis test of segments ab against an axis aligned box """
+        overlap = numpy.all(numpy.minimum(a, b) <= box[2:], axis=1) & numpy.all(
+            numpy.maximum(a, b) >= box[:2], axis=1
+        )
+
+        corners = numpy.array(
+            [[box[0], box[1]], [box[2], box[1]], [box[0], box[3]], [box[2], box[3]]]
+        )
+        d = b - a
+        relative = corners[numpy.newaxis, :, :] - a[:, numpy.newaxis, :]
+        cross = (
+            d[:, numpy.newaxis, 0] * relative[:, :, 1]
+            - d[:, numpy.newaxis, 1] * relative[:, :, 0]
+        )
+        separated = numpy.all(cross > 0, axis=1) | numpy.all(cross < 0, axis=1)
+
+        return overlap & ~separated
+
+    @classmethod
+    def _sample_arcs(cls, coords):
+        """ Return array of shape (len(coords), _arc_samples + 1, 2) with points
+        along the arcs. """
+        center, radius, normal, midpoint, h, curved = cls._arc_geometry(coords)
+        a = coords[:, 0:2]
+        b = coords[:, 2:4]
+
+        start = numpy.arctan2(a[:, 1] - center[:, 1], a[:, 0] - center[:, 0])
+        end = numpy.arctan2(b[:, 1] - center[:, 1], b[:, 0] - center[:, 0])
+        # Positive height curves counterclockwise from a to b
+        sweep = numpy.where(
+            h > 0,
+            numpy.remainder(end - start, 2 * math.pi),
+            -numpy.remainder(start - end, 2 * math.pi),
+        )
+
+        t = numpy.linspace(0, 1, cls._arc_samples + 1)
+        angles = start[:, numpy.newaxis] + sweep[:, numpy.newaxis] * t
+        samples = numpy.stack(
+            [
+                center[:, 0:1] + radius[:, numpy.newaxis] * numpy.cos(angles),
+                center[:, 1:2] + radius[:, numpy.newaxis] * numpy.sin(angles),
+            ],
+            axis=2,
+        )
+
+        # Flat arcs are sampled along their chord
+        flat = ~curved
+        samples[flat] = a[flat, numpy.newaxis, :] + t[:, numpy.newaxis] * (
+            b[flat] - a[flat]
+        )[:, numpy.newaxis, :]
+
+        return samples
@@ -0,0 +1,339 @@
+""" Differential testing of solver modes against the reference solver.
+
+`random_sketch()` generates a random but consistent sketch together with
+a sequence of operations on it (adding and removing constraints, moving points,
+changing lengths and solving). `compare()` runs the same sequence through
+the reference configuration (plain unscaled SLSQP on all variables) and through
+each of the optimized modes, checks internal state of the solver after
+every operation and reports constraint errors, distance of the solutions from
+the reference ones and timings.
+
+Use `python -m parametric.testing` to print a report for a range of seeds. """
+
+import argparse
+import collections
+import math
+import time
+
+import numpy
+
+from . import constraints
+from . import objects
+from .solver import Solver
+
+# Solver options of the reference configuration
+reference = {
+    "scaling": False,
+    "constructive": False,
+    "rigid_clusters": False,
+    "multi_start": 0,
+    "continuation": False,
+    "evaluation_threads": None,
+    "parameter_layout": "records",
+}
+
+# Optimized modes, as changes of the reference options
+modes = collections.OrderedDict(
+    [
+        ("scaling", {"scaling": True}),
+        ("constructive", {"constructive": True}),
+        ("rigid_clusters", {"rigid_clusters": True}),
+        ("threads", {"evaluation_threads": 4, "parallel_threshold": 1}),
+        ("columns", {"parameter_layout": "columns"}),
+        ("multi_start", {"multi_start": 4, "multi_start_seed": 0}),
+        # Small step, so that the small edits of random sketches use continuation
+        ("continuation", {"continuation": True, "continuation_step": 0.01}),
+        ("default", None),  # Options of a newly created Solver
+    ]
+)
+
+# Modes that legitimately end at a different solution of under-constrained
+# sketches: continuation stays close to the path of a parameter edit instead of
+# the values before the solve. Only their constraint errors are checked.
+path_dependent = {"continuation"}
+
+Result = collections.namedtuple("Result", ["error", "difference", "times"])
+
+
+class Sketch:
+    """ Initial point positions (array of shape (k, 2)) and a list of
+    operations:
+
+    - ("add", kind, point indices, value): Add a constraint, kind is one of
+      "fixed_x", "fixed_y", "angle", "length", "perpendicular", "horizontal"
+      and "vertical", value is the numeric parameter (or None).
+    - ("remove", i): Remove constraint added by operation i.
+    - ("move", point index, x, y): Move a point using `set_values()`.
+    - ("set", i, value): Change length of the constraint added by operation i
+      using `set_parameter()`.
+    - ("solve",) """
+
+    def __init__(self, points, operations):
+        self.points = points
+        self.operations = operations
+
+    def size(self):
+        return max(numpy.max(numpy.ptp(self.points, axis=0)), 1)
+
+    def translated(self, dx, dy):
+        """ Return a copy of the sketch moved by (dx, dy) """
+        operations = []
+        for operation in self.operations:
+            if operation[0] == "add" and operation[1] in ("fixed_x", "fixed_y"):
+                shift = dx if operation[1] == "fixed_x" else dy
+                operation = operation[:3] + (operation[3] + shift,)
+            elif operation[0] == "move":
+                operation = operation[:2] + (operation[2] + dx, operation[3] + dy)
+            operations.append(operation)
+        return Sketch(self.points + [dx, dy], operations)
+
+
+def random_sketch(seed, parts=3, noise=0.3, removals=2, moves=2, edits=2):
+    """ Generate a random sketch made of rectangles, with constraints taken
+    from a target geometry, so that it can always be solved.
+
+    Each rectangle gets a non redundant subset of constraints that make it rigid,
+    and is either placed absolutely or relative to the previous one.
+    Points start randomly perturbed from the target. Edits scale lengths by
+    up to 20 %, large edits have several solutions that the modes
+    legitimately choose differently. """
+    rng = numpy.random.RandomState(seed)
+    target = []
+    added = []
+
+    def add(kind, points, value=None):
+        if rng.uniform() < 0.85:
+            added.append(("add", kind, points, value))
+
+    for part in range(parts):
+        width, height = rng.uniform(2, 6, 2)
+        aligned = rng.uniform() < 0.5
+        angle = 0 if aligned else rng.uniform(-math.pi, math.pi)
+        c, s = math.cos(angle), math.sin(angle)
+        origin = numpy.array([10 * part, rng.uniform(-2, 2)])
+        corners = [(0, 0), (width, 0), (width, height), (0, height)]
+        p = list(range(len(target), len(target) + 4))
+        target.extend(origin + [c * x - s * y, s * x + c * y] for x, y in corners)
+
+        def distance(a, b):
+            return float(numpy.hypot(*(target[b] - target[a])))
+
+        add("length", (p[0], p[1]), distance(p[0], p[1]))
+        add("length", (p[1], p[2]), distance(p[1], p[2]))
+        add("length", (p[2], p[3]), distance(p[2], p[3]))
+        if aligned:
+            add("vertical", (p[1], p[2]))
+            add("horizontal", (p[2], p[3]))
+        else:
+            add("perpendicular", (p[0], p[1], p[1], p[2]))
+            add("perpendicular", (p[1], p[2], p[2], p[3]))
+
+        if part == 0 or rng.uniform() < 0.5:
+            add("fixed_x", (p[0],), float(target[p[0]][0]))
+            add("fixed_y", (p[0],), float(target[p[0]][1]))
+        else:
+            add("length", (p[0] - 4, p[0]), distance(p[0] - 4, p[0]))
+        add("angle", (p[0], p[1]), math.degrees(angle))
+
+    target = numpy.array(target)
+    order = rng.permutation(len(added))
+    operations = []
+    for i, index in enumerate(order):
+        operations.append(added[index])
+        if rng.uniform() < 0.2 or i == len(order) - 1:
+            operations.append(("solve",))
+
+    adds = [i for i, operation in enumerate(operations) if operation[0] == "add"]
+    removed = rng.choice(adds, size=min(removals, len(adds)), replace=False)
+    for i in removed:
+        operations.append(("remove", int(i)))
+        operations.append(("solve",))
+    lengths = [
+        i
+        for i in sorted(set(adds) - set(removed.tolist()))
+        if operations[i][1] == "length"
+    ]
+    for i in rng.choice(lengths, size=min(edits, len(lengths)), replace=False):
+        value = operations[i][3] * rng.uniform(0.8, 1.2)
+        operations.append(("set", int(i), float(value)))
+        operations.append(("solve",))
+    for _ in range(moves):
+        point = int(rng.randint(len(target)))
+        x, y = target[point] + rng.normal(scale=noise, size=2)
+        operations.append(("move", point, float(x), float(y)))
+        operations.append(("solve",))
+
+    points = target + rng.normal(scale=noise, size=target.shape)
+    return Sketch(points, operations)
+
+
+def run(sketch, options):
+    """ Run operations of the sketch on a new solver with given options
+    (None for defaults). Checks internal state of the solver after every
+    operation.
+
+    Returns a tuple (solutions, errors, times): point positions after every
+    solve, maximal absolute constraint error after every solve and total time
+    spent in each kind of operation. """
+    solver = Solver()
+    solver.auto_solve = False
+    for name, value in (options or {}).items():
+        setattr(solver, name, value)
+
+    points = [objects.Point(x, y) for x, y in sketch.points]
+    added = {}
+    solutions = []
+    errors = []
+    times = collections.Counter()
+
+    for i, operation in enumerate(sketch.operations):
+        kind = operation[0]
+        start = time.perf_counter()
+        if kind == "add":
+            added[i] = _make_constraint(points, *operation[1:])
+            solver.add_constraint(added[i])
+        elif kind == "remove":
+            solver.remove_constraint(added.pop(operation[1]))
+        elif kind == "move":
+            point, x, y = operation[1:]
+            solver.set_values({points[point].x: x, points[point].y: y})
+        elif kind == "set":
+            solver.set_parameter(added[operation[1]], "length", operation[2])
+        elif kind == "solve":
+            solver.solve()
+        else:
+            raise ValueError("Unknown operation {!r}".format(kind))
+        times[kind] += time.perf_counter() - start
+
+        assert solver._assert_internal_state()
+
+        if kind == "solve":
+            solutions.append(numpy.array([[float(p.x), float(p.y)] for p in points]))
+            x = numpy.array([float(v) for v in solver._variables])
+            errors.append(
+                numpy.max(numpy.abs(solver._evaluate_constraints(x)), initial=0)
+            )
+
+    return solutions, errors, times
+
+
+def compare(sketch, compared_modes=None):
+    """ Run the sketch with the reference options and with each mode
+    (name -> option changes, all of `modes` by default).
+
+    Returns an ordered dict name -> Result, with the largest constraint error,
+    the largest distance of a coordinate from the reference solution (both
+    relative to the sketch size) and times by operation. """
+    if compared_modes is None:
+        compared_modes = modes
+
+    size = sketch.size()
+    reference_solutions, reference_errors, reference_times = run(sketch, reference)
+    ret = collections.OrderedDict()
+    ret["reference"] = Result(max(reference_errors) / size, 0.0, reference_times)
+
+    for name, changes in compared_modes.items():
+        if changes is None:
+            options = None
+        else:
+            options = dict(reference)
+            options.update(changes)
+        solutions, errors, times = run(sketch, options)
+        difference = max(
+            numpy.max(numpy.abs(a - b))
+            for a, b in zip(solutions, reference_solutions)
+        )
+        ret[name] = Result(max(errors) / size, difference / size, times)
+
+    return ret
+
+
+def check(results, error_tolerance=1e-5, difference_tolerance=1e-3):
+    """ Raise AssertionError if any mode has larger relative constraint error
+    or distance from the reference solution than the tolerances.
+    Errors are only checked if the reference solution satisfies the constraints,
+    distances are not checked for `path_dependent` modes. """
+    reference_ok = results["reference"].error <= error_tolerance
+    for name, result in results.items():
+        if reference_ok and result.error > error_tolerance:
+            raise AssertionError(
+                "{}: constraint error {:.2e}".format(name, result.error)
+            )
+        if name in path_dependent:
+            continue
+        if result.difference > difference_tolerance:
+            raise AssertionError(
+                "{}: difference from reference {:.2e}".format(name, result.difference)
+            )
+
+
+def _make_constraint(points, kind, point_indices, value):
+    p = [points[i] for i in point_indices]
+    if kind == "fixed_x":
+        return constraints.VariableFixed(p[0].x, value)
+    elif kind == "fixed_y":
+        return constraints.VariableFixed(p[0].y, value)
+    elif kind == "angle":
+        return constraints.AbsoluteAngle(objects.LineSegment(p[0], p[1]), value)
+    elif kind == "length":
+        return constraints.Length(objects.LineSegment(p[0], p[1]), value)
+    elif kind == "perpendicular":
+        return constraints.Perpendicular(
+            objects.LineSegment(p[0], p[1]), objects.LineSegment(p[2], p[3])
+        )
+    elif kind == "horizontal":
+        return constraints.Horizontal(p[0], p[1])
+    elif kind == "vertical":
+        return constraints.Vertical(p[0], p[1])
+    else:
+        raise ValueError("Unknown constraint kind {!r}".format(kind))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare optimized solver modes against the reference solver"
+    )
+    parser.add_argument("--seeds", type=int, default=20)
+    parser.add_argument("--parts", type=int, default=3)
+    args = parser.parse_args()
+
+    totals = collections.OrderedDict()
+    failures = collections.Counter()
+    for seed in range(args.seeds):
+        results = compare(random_sketch(seed, parts=args.parts))
+        for name, result in results.items():
+            error, difference, time_sum = totals.get(name, (0.0, 0.0, 0.0))
+            totals[name] = (
+                max(error, result.error),
+                max(difference, result.difference),
+                time_sum + sum(result.times.values()),
+            )
+            pair = collections.OrderedDict(
+                [("reference", results["reference"]), (name, result)]
+            )
+            try:
+                check(pair)
+            except AssertionError:
+                failures[name] += 1
+
+    reference_time = totals["reference"][2]
+    print(
+        "{:16} {:>10} {:>11} {:>10} {:>8} {:>9}".format(
+            "mode", "max error", "max diff", "time", "speedup", "failures"
+        )
+    )
+    for name, (error, difference, time_sum) in totals.items():
+        print(
+            "{:16} {:10.1e} {:11.1e} {:7.1f} ms {:7.2f}x {:9}".format(
+                name,
+                error,
+                difference,
+                time_sum * 1000,
+                reference_time / time_sum,
+                failures[name],
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
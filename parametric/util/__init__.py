@@ -1,2 +1,5 @@
+from .columnar_array import ColumnarArray
 from .dynamic_array import DynamicArray
 from .indexed_dict import IndexedDict
+from .incidence import Incidence
+from .lazy_module import LazyModule
@@ -0,0 +1,106 @@
+import collections
+
+import numpy
+
+from .dynamic_array import DynamicArray
+
+
+class ColumnarArray:
+    """ Dynamic array of records with a structured dtype, stored as
+    a separate contiguous DynamicArray for each field (struct of arrays).
+
+    Supports the subset of DynamicArray interface used with record dtypes:
+    indexing by field name gives a contiguous column, indexing by row gives
+    a record. `array()` returns a dict of columns, so that code indexing
+    records by field name works with both layouts.
+
+    Reserved storages (see DynamicArray) split reserved_bytes between
+    the columns, so that all of them together reserve as much as a single
+    array of records would. """
+
+    def __init__(self, dtype, size_hint=None, storage=None, reserved_bytes=None):
+        self.dtype = numpy.dtype(dtype)
+        if self.dtype.names is None:
+            raise ValueError("ColumnarArray needs a structured dtype")
+
+        if size_hint is None and storage is not None:
+            if reserved_bytes is None:
+                reserved_bytes = DynamicArray.reserved_bytes
+            size_hint = max(reserved_bytes // max(self.dtype.itemsize, 1), 1)
+
+        self._columns = collections.OrderedDict(
+            (
+                name,
+                DynamicArray(
+                    dtype=self.dtype[name], size_hint=size_hint, storage=storage
+                ),
+            )
+            for name in self.dtype.names
+        )
+
+    def append(self, value):
+        for column, item in zip(self._columns.values(), value):
+            column.append(item)
+
+    def extend(self, values):
+        """ Append records from a structured array with matching fields """
+        for name, column in self._columns.items():
+            column.extend(values[name])
+
+    def pop(self):
+        if len(self) == 0:
+            raise IndexError("Pop from empty array")
+        ret = self[len(self) - 1]
+        for column in self._columns.values():
+            column.pop()
+        return ret
+
+    def columns(self):
+        """ Return an ordered dict field name -> column array """
+        return collections.OrderedDict(
+            (name, column.array()) for name, column in self._columns.items()
+        )
+
+    def column_arrays(self):
+        """ Return an ordered dict field name -> DynamicArray of the column """
+        return collections.OrderedDict(self._columns)
+
+    def array(self):
+        """ Return content as a dict of columns, matching field access on
+        a record array. """
+        return self.columns()
+
+    def close(self):
+        for column in self._columns.values():
+            column.close()
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self._columns[key].array()
+
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError("Index out of range")
+        return numpy.array(
+            tuple(column[key] for column in self._columns.values()), dtype=self.dtype
+        )[()]
+
+    def __setitem__(self, key, value):
+        if isinstance(key, str):
+            self._columns[key].array()[:] = value
+            return
+
+        for column, item in zip(self._columns.values(), value):
+            column[key] = item
+
+    def __len__(self):
+        return len(next(iter(self._columns.values())))
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def __repr__(self):
+        return "{}({})".format(
+            self.__class__.__name__, ", ".join(self._columns.keys())
+        )
@@ -1,31 +1,193 @@
+import math
+import mmap
+import operator
+
 import numpy
 
 
 class DynamicArray:
-    """ Dynamic 1D array that supports efficient appends (like array.array) based on numpy (supporting dtypes) """
+    """ Dynamic 1D array that supports efficient appends (like array.array) based on numpy (supporting dtypes)
+
+    Storage modes:
+    - None: Ordinary numpy allocation, reallocated (copied) when growing
+      or shrinking.
+    - "mmap": Anonymous memory map reserving space up front, for size_hint items
+      or reserved_bytes if there is no hint. Memory pages are only committed
+      by the OS when touched, so reserving generously is cheap and growing
+      within the reservation never copies.
+    - "shared": Like "mmap", but in a `multiprocessing.shared_memory` block that
+      other processes can map using `DynamicArray.attach()`.
+
+    Reserved storages never shrink. Exceeding the reservation falls back to
+    copy on grow: a new reservation of growth_factor times the required size is
+    allocated and the content is copied over (for shared storage this also
+    changes `name`).
+
+    Capacity policy: When full, the array grows to growth_factor times the
+    required size. It shrinks (to growth_factor times its size) once the size
+    drops below shrink_threshold times the capacity. To avoid repeated
+    reallocations when alternately adding and removing items near a threshold,
+    growth_factor * shrink_threshold must be less than 1.
+    Counters `reallocations` and `bytes_copied` help with tuning these. """
 
     _initial_size = 10
 
-    def __init__(self, dtype=None, size_hint=None):
+    # Address space reserved by "mmap" and "shared" storages without size_hint
+    reserved_bytes = 1 << 24
+
+    growth_factor = 1.5
+    shrink_threshold = 0.4
+
+    def __init__(
+        self,
+        dtype=None,
+        size_hint=None,
+        storage=None,
+        growth_factor=None,
+        shrink_threshold=None,
+        reserved_bytes=None,
+    ):
         dt = numpy.dtype(dtype)
         if dt.shape != ():
             raise ValueError("Sub-aray dtypes are not supported now")
+        if storage not in (None, "mmap", "shared"):
+            raise ValueError("Unknown storage {!r}".format(storage))
+        if storage is not None and dt.hasobject:
+            raise ValueError("Object dtypes can only use the default storage")
+
+        if growth_factor is not None:
+            self.growth_factor = growth_factor
+        if reserved_bytes is not None:
+            self.reserved_bytes = reserved_bytes
+        if shrink_threshold is not None:
+            self.shrink_threshold = shrink_threshold
+        if self.growth_factor <= 1:
+            raise ValueError("Growth factor must be greater than 1")
+        if self.growth_factor * self.shrink_threshold >= 1:
+            raise ValueError("growth_factor * shrink_threshold must be less than 1")
 
-        initial_size = self._initial_size if size_hint is None else size_hint
-        self._array = numpy.zeros((initial_size,), dtype=dtype)
         self.size = 0
         self.dtype = dt
+        self.storage = storage
+        self.reallocations = 0
+        self.bytes_copied = 0
+        self._buffer = None  # mmap or SharedMemory backing the array, if any
+        self._owner = True
+
+        if size_hint is not None:
+            initial_size = size_hint
+        elif storage is None:
+            initial_size = self._initial_size
+        else:
+            initial_size = max(
+                self.reserved_bytes // max(dt.itemsize, 1), self._initial_size
+            )
+        self._array = self._allocate(initial_size)
+
+    @classmethod
+    def attach(cls, name, dtype, size):
+        """ Map an array with shared storage created by another process.
+        Name is the `name` attribute of the original array, size its current
+        length. The attached array sees modifications made by the owner
+        until the owner reallocates it. """
+        from multiprocessing import shared_memory
+
+        ret = cls.__new__(cls)
+        ret.dtype = numpy.dtype(dtype)
+        ret.storage = "shared"
+        ret._owner = False
+        ret.reallocations = 0
+        ret.bytes_copied = 0
+        try:
+            ret._buffer = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Before Python 3.13 attaching registers the block with the resource
+            # tracker, which would unlink it when this process exits.
+            from multiprocessing import resource_tracker
 
-    def _update_size(self, size, min_size=0):
-        self._array.resize(max(3 * size // 2, min_size))
+            ret._buffer = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(ret._buffer._name, "shared_memory")
+        ret._array = numpy.ndarray(
+            (ret._buffer.size // max(ret.dtype.itemsize, 1),),
+            dtype=ret.dtype,
+            buffer=ret._buffer.buf,
+        )
+        if size > len(ret._array):
+            raise ValueError("Shared memory block is too small")
+        ret.size = size
+        return ret
+
+    @property
+    def name(self):
+        """ Name of the shared memory block, None for other storages """
+        if self.storage != "shared":
+            return None
+        return self._buffer.name
+
+    def close(self):
+        """ Release the shared memory block (unlinking it if this array created it).
+        The array must not be used afterwards. """
+        if self.storage != "shared":
+            return
+        buffer = self._buffer
+        self._array = None
+        self._buffer = None
+        if self._owner:
+            buffer.unlink()
+        try:
+            buffer.close()
+        except BufferError:
+            # Views of the array are still alive, the mapping gets released
+            # together with them
+            pass
+
+    def _allocate(self, capacity):
+        """ Return a new zeroed array with given capacity in the current storage """
+        if self.storage is None:
+            return numpy.zeros((capacity,), dtype=self.dtype)
+
+        nbytes = max(capacity * self.dtype.itemsize, 1)
+        if self.storage == "mmap":
+            self._buffer = mmap.mmap(-1, nbytes)
+            buffer = self._buffer
+        else:
+            from multiprocessing import shared_memory
+
+            if self._buffer is not None:
+                self.close()
+            self._buffer = shared_memory.SharedMemory(create=True, size=nbytes)
+            self._owner = True
+            buffer = self._buffer.buf
+        return numpy.ndarray((capacity,), dtype=self.dtype, buffer=buffer)
+
+    def _reallocate(self, capacity):
+        """ Move the content to a new array with given capacity.
+        Unlike ndarray.resize this works while views of the array exist
+        (the views keep referring to the old data). """
+        old = self._array[: min(self.size, capacity)]
+        if self.storage == "shared":
+            # Allocating would release the old block
+            old = old.copy()
+        new = self._allocate(capacity)
+        new[: len(old)] = old
+        self._array = new
+
+        self.reallocations += 1
+        self.bytes_copied += old.nbytes
 
     def _maybe_inflate(self, size):
         if size > len(self._array):
-            self._update_size(size)
+            self._reallocate(
+                max(int(math.ceil(size * self.growth_factor)), self._initial_size)
+            )
 
     def _maybe_deflate(self, size):
-        if size < len(self._array) / 2:
-            self._update_size(size, self._initial_size)
+        if self.storage is None and size < len(self._array) * self.shrink_threshold:
+            new_capacity = max(
+                int(math.ceil(size * self.growth_factor)), self._initial_size
+            )
+            if new_capacity < len(self._array):
+                self._reallocate(new_capacity)
 
     def append(self, value):
         new_size = self.size + 1
@@ -44,7 +206,10 @@ class DynamicArray:
 
         return v
 
-    def extend(self, values):
+    def extend(self, values, size_hint=None):
+        """ Append all values.
+        If values don't have a length, size_hint (or `operator.length_hint()`)
+        is used to preallocate space. """
         offset = self.size
 
         try:
@@ -54,23 +219,23 @@ class DynamicArray:
         else:
             new_size = self.size + length
             self._maybe_inflate(new_size)
-            self.size = new_size
 
             try:
                 # First try to do numpy slice assignment for speeed
-                self._array[offset : self.size] = values
-            except TypeError:
+                self._array[offset:new_size] = values
+            except (TypeError, ValueError):
+                # Objects that report different length than they actually
+                # have (list does that) are handled as iterables
                 pass
             else:
+                self.size = new_size
                 return
+            size_hint = length
 
-            # TODO: Handle objects that report different length than it actualy is
-            # (list does that). At that point length and size_hint are basically equivalent
-            for i, value in enumerate(values, offset):
-                self._array[i] = value
-            return
+        if size_hint is None:
+            size_hint = operator.length_hint(values)
+        self._maybe_inflate(self.size + size_hint)
 
-        # TODO: Use size_hint
         for value in values:
             self.append(value)
 
@@ -84,21 +249,24 @@ class DynamicArray:
         """ Resize the internal array to size if possible.
         Useful to pre allocate area for later insertions in advance.
         Note that this is one shot only, any following operation will cause the
-        the array to resize as normal. """
-        self._array.resize(max(self.size, size))
+        the array to resize as normal.
+        Reserved storages only ever grow. """
+        size = max(self.size, size)
+        if self.storage is None or size > len(self._array):
+            self._reallocate(size)
 
     def shrink(self):
         """ Shrink the internal array as much as possible.
         Equivalent to reserve(0) """
-        self._array.resize(self.size)
+        self.reserve(0)
 
     def array(self):
         """ Return a slice of the internal numpy array """
         return self._array[: self.size]
 
-    def __array__(self, dtype=None):
+    def __array__(self, dtype=None, copy=None):
         """ To match numpy's protocol """
-        if dtype is None:
+        if dtype is None and not copy:
             return self.array()
         else:
             return numpy.array(self.array(), dtype=dtype)
@@ -0,0 +1,299 @@
+import numpy
+
+from .dynamic_array import DynamicArray
+
+
+class Incidence:
+    """ Mapping from dense integer rows to multisets of integer items,
+    stored CSR-style in a single pool array.
+
+    Each row owns a contiguous range of the pool with some slack at the end,
+    so appending to a row is amortized O(1) (a full row is moved to the end
+    of the pool with doubled capacity). Removing an item swaps the last item
+    of the row into its place.
+    Rows are removed by swapping the last row into their place (like
+    IndexedDict.fast_pop), so that row indices can stay aligned with
+    an IndexedDict. Space left behind by moved and removed rows is reclaimed
+    by compacting the pool once it takes more than half of it.
+
+    If payload_dtype is given, every item carries an additional payload value
+    stored in a parallel pool. """
+
+    _initial_capacity = 4
+
+    def __init__(self, dtype=numpy.uint32, payload_dtype=None):
+        self._starts = DynamicArray(dtype=numpy.int64)
+        self._counts = DynamicArray(dtype=numpy.int64)
+        self._capacities = DynamicArray(dtype=numpy.int64)
+        self._pool = DynamicArray(dtype=dtype)
+        if payload_dtype is None:
+            self._payload_pool = None
+        else:
+            self._payload_pool = DynamicArray(dtype=payload_dtype)
+        self._waste = 0
+
+    @property
+    def dtype(self):
+        return self._pool.dtype
+
+    def add_row(self, capacity=None):
+        """ Add an empty row to the end, return its index. """
+        if capacity is None:
+            capacity = self._initial_capacity
+        self._starts.append(self._allocate(capacity))
+        self._counts.append(0)
+        self._capacities.append(capacity)
+        return len(self._starts) - 1
+
+    def add_rows(self, count, capacity=None):
+        """ Add count empty rows to the end, return index of the first one. """
+        if capacity is None:
+            capacity = self._initial_capacity
+        first = len(self._starts)
+        start = self._allocate(count * capacity)
+        self._starts.extend(start + capacity * numpy.arange(count, dtype=numpy.int64))
+        self._counts.extend(numpy.zeros(count, dtype=numpy.int64))
+        self._capacities.extend(numpy.full(count, capacity, dtype=numpy.int64))
+        return first
+
+    def pop_row(self, row=-1):
+        """ Remove a row by moving the last row to its place.
+        Returns the new index of the moved row (equal to `row` if the removed
+        row was the last one). """
+        last = len(self._starts) - 1
+        if row < 0:
+            row += last + 1
+        if not 0 <= row <= last:
+            raise IndexError("Row index out of range")
+
+        self._waste += int(self._capacities[row])
+        if row != last:
+            self._starts[row] = self._starts[last]
+            self._counts[row] = self._counts[last]
+            self._capacities[row] = self._capacities[last]
+        self._starts.pop()
+        self._counts.pop()
+        self._capacities.pop()
+
+        self._maybe_compact()
+
+        return row
+
+    def append(self, row, item, payload=0):
+        """ Add an item (with payload) to a row. """
+        count = int(self._counts[row])
+        start = self._reserve(row, count + 1)
+
+        self._pool[start + count] = item
+        if self._payload_pool is not None:
+            self._payload_pool[start + count] = payload
+        self._counts[row] = count + 1
+
+        self._maybe_compact()
+
+    def extend(self, rows, items, payloads=0):
+        """ Add items[i] (with payloads[i]) to row rows[i] for all i.
+        Equivalent to repeated append, but vectorized: all rows that need to grow
+        are moved to the end of the pool together. """
+        rows = numpy.asarray(rows, dtype=numpy.int64)
+        if not len(rows):
+            return
+        order = numpy.argsort(rows, kind="stable")
+        rows = rows[order]
+        items = numpy.asarray(items)[order]
+        payloads = numpy.broadcast_to(payloads, order.shape)[order]
+
+        unique_rows, offsets, added = numpy.unique(
+            rows, return_index=True, return_counts=True
+        )
+        starts = self._starts.array()
+        counts = self._counts.array()
+        capacities = self._capacities.array()
+
+        # Move rows that would overflow to a new area at the end of the pool
+        needed = counts[unique_rows] + added
+        overflow = needed > capacities[unique_rows]
+        grown = unique_rows[overflow]
+        if len(grown):
+            needed = needed[overflow]
+            new_capacities = numpy.maximum(
+                numpy.maximum(2 * capacities[grown], needed), self._initial_capacity
+            )
+            new_starts = self._allocate(int(new_capacities.sum())) + numpy.concatenate(
+                [[0], numpy.cumsum(new_capacities)[:-1]]
+            )
+            # Allocation may have reallocated the arrays
+            starts = self._starts.array()
+            counts = self._counts.array()
+            capacities = self._capacities.array()
+
+            source = _ranges(starts[grown], counts[grown])
+            destination = _ranges(new_starts, counts[grown])
+            for pool in self._pools():
+                pool = pool.array()
+                pool[destination] = pool[source]
+
+            self._waste += int(capacities[grown].sum())
+            starts[grown] = new_starts
+            capacities[grown] = new_capacities
+
+        group = numpy.repeat(numpy.arange(len(unique_rows)), added)
+        rank = numpy.arange(len(rows)) - offsets[group]
+        positions = starts[rows] + counts[rows] + rank
+        self._pool.array()[positions] = items
+        if self._payload_pool is not None:
+            self._payload_pool.array()[positions] = payloads
+        counts[unique_rows] += added
+
+        self._maybe_compact()
+
+    def _reserve(self, row, size):
+        """ Make sure that a row has capacity for size items, return its start """
+        start = int(self._starts[row])
+        capacity = int(self._capacities[row])
+        if size <= capacity:
+            return start
+
+        count = int(self._counts[row])
+        new_capacity = max(2 * capacity, size, self._initial_capacity)
+        new_start = self._allocate(new_capacity)
+        for pool in self._pools():
+            pool = pool.array()
+            pool[new_start : new_start + count] = pool[start : start + count]
+        self._waste += capacity
+        self._starts[row] = new_start
+        self._capacities[row] = new_capacity
+        return new_start
+
+    def remove(self, row, item, payload=None):
+        """ Remove one occurence of item from a row.
+        If payload is not None, only an item with matching payload is removed.
+        Raises ValueError if the item is not present. """
+        start = int(self._starts[row])
+        count = int(self._counts[row])
+
+        matches = self._pool.array()[start : start + count] == item
+        if payload is not None:
+            matches &= self._payload_pool.array()[start : start + count] == payload
+        found = numpy.flatnonzero(matches)
+        if len(found) == 0:
+            raise ValueError("Item not in row")
+
+        last = start + count - 1
+        for pool in self._pools():
+            pool = pool.array()
+            pool[start + found[0]] = pool[last]
+        self._counts[row] = count - 1
+
+    def row(self, row):
+        """ Return a view of the items of a row (in no particular order).
+        The view is only valid until the next modification. """
+        start = int(self._starts[row])
+        return self._pool.array()[start : start + int(self._counts[row])]
+
+    def payloads(self, row):
+        """ Return a view of payloads of a row, in the same order as `row()`.
+        The view is only valid until the next modification. """
+        start = int(self._starts[row])
+        return self._payload_pool.array()[start : start + int(self._counts[row])]
+
+    def row_size(self, row):
+        return int(self._counts[row])
+
+    def row_sizes(self):
+        """ Return a view of sizes of all rows """
+        return self._counts.array()
+
+    def to_csr(self):
+        """ Return the incidence as a pair of arrays (indptr, indices) in
+        the usual CSR format. """
+        counts = self._counts.array()
+        indptr = numpy.zeros(len(counts) + 1, dtype=numpy.int64)
+        numpy.cumsum(counts, out=indptr[1:])
+        indices = self._pool.array()[self._gather_indices(indptr)]
+        return indptr, indices
+
+    def compact(self):
+        """ Move all rows next to each other, releasing all unused space in the pool.
+        Rows keep their capacities. """
+        counts = self._counts.array()
+        capacities = self._capacities.array()
+
+        indptr = numpy.zeros(len(counts) + 1, dtype=numpy.int64)
+        numpy.cumsum(counts, out=indptr[1:])
+        new_starts = numpy.zeros(len(counts), dtype=numpy.int64)
+        numpy.cumsum(capacities[:-1], out=new_starts[1:])
+
+        offsets = numpy.arange(indptr[-1]) - numpy.repeat(indptr[:-1], counts)
+        destination = numpy.repeat(new_starts, counts) + offsets
+        source = self._gather_indices(indptr)
+        size = int(capacities.sum())
+
+        def compacted(old_pool):
+            pool = DynamicArray(dtype=old_pool.dtype, size_hint=size)
+            pool.extend(numpy.zeros(size, dtype=old_pool.dtype))
+            pool.array()[destination] = old_pool.array()[source]
+            return pool
+
+        self._pool = compacted(self._pool)
+        if self._payload_pool is not None:
+            self._payload_pool = compacted(self._payload_pool)
+        self._starts[:] = new_starts
+        self._waste = 0
+
+    def __len__(self):
+        return len(self._starts)
+
+    def _allocate(self, capacity):
+        """ Reserve space for `capacity` items at the end of the pool,
+        return start index. """
+        start = len(self._pool)
+        for pool in self._pools():
+            pool.extend(numpy.zeros(capacity, dtype=pool.dtype))
+        return start
+
+    def _pools(self):
+        if self._payload_pool is None:
+            return (self._pool,)
+        else:
+            return (self._pool, self._payload_pool)
+
+    def _gather_indices(self, indptr):
+        """ Return pool indices of all items, row after row """
+        counts = self._counts.array()
+        offsets = numpy.arange(indptr[-1]) - numpy.repeat(indptr[:-1], counts)
+        return numpy.repeat(self._starts.array(), counts) + offsets
+
+    def _maybe_compact(self):
+        if self._waste > max(len(self._pool) // 2, 16 * self._initial_capacity):
+            self.compact()
+
+    def _assert_internal_state(self):
+        """ Asserts that the inner state is consistent.
+        Returns True, so it can be used in an assert expression itself. """
+        starts = self._starts.array()
+        counts = self._counts.array()
+        capacities = self._capacities.array()
+
+        assert len(starts) == len(counts) == len(capacities)
+        assert numpy.all(counts >= 0)
+        assert numpy.all(counts <= capacities)
+        assert numpy.all(starts + capacities <= len(self._pool))
+        assert capacities.sum() + self._waste == len(self._pool)
+        if self._payload_pool is not None:
+            assert len(self._payload_pool) == len(self._pool)
+
+        order = numpy.argsort(starts, kind="stable")
+        assert numpy.all(
+            (starts[order] + capacities[order])[:-1] <= starts[order][1:]
+        ), "Overlapping rows"
+
+        return True
+
+
+def _ranges(starts, lengths):
+    """ Return concatenated aranges [start, start + length) """
+    offsets = numpy.arange(lengths.sum()) - numpy.repeat(
+        numpy.cumsum(lengths) - lengths, lengths
+    )
+    return numpy.repeat(starts, lengths) + offsets
@@ -1,18 +1,46 @@
-import collections
+import collections.abc
 
+import numpy
+
+_tombstone = object()
+
+
+class IndexedDict(collections.abc.MutableMapping):
+    """ Ordered dict whose items can also be accessed by their position.
+
+    With `tombstones=True` order preserving deletes (pop, del, popitem, delete_many)
+    only mark the slot of the removed item as deleted instead of shifting all
+    following items, which makes them O(1). `move_to_end` (to the end) is O(1) too.
+    Indices are then slot positions, which are not contiguous and may be larger
+    than len(). Once the fraction of deleted slots exceeds compaction_threshold,
+    the slots are compacted in one pass and `on_compact` is called with
+    an array mapping old indices to new ones (-1 for deleted slots). """
 
-class IndexedDict(collections.MutableMapping):
     _marker = object()
 
-    def __init__(self, *args, **kwargs):
+    def __init__(
+        self,
+        *args,
+        tombstones=False,
+        compaction_threshold=0.5,
+        on_compact=None,
+        **kwargs
+    ):
         """ Create empty IndexedDict and call self.update(*args, **kwargs). """
+        if not 0 < compaction_threshold <= 1:
+            raise ValueError("Compaction threshold must be in (0, 1]")
+        self.tombstones = tombstones
+        self.compaction_threshold = compaction_threshold
+        self.on_compact = on_compact
         self.clear()
         self.update(*args, **kwargs)
 
     def clear(self):
         """ Remove all items. """
         self._dict = {}  # key -> (index, value)
-        self._list = []  # index -> (key, value)
+        self._list = []  # index -> (key, value) or _tombstone
+        self._tombstone_count = 0
+        self._head = 0  # All slots before this one are tombstones
 
     def get(self, key=_marker, index=_marker, d=None):
         """ Return value with given key or index.
@@ -26,7 +54,7 @@ class IndexedDict(collections.MutableMapping):
                 return value
         elif index is not self._marker and key is self._marker:
             try:
-                key, value = self._list[index]
+                index, (key, value) = self._slot(index)
             except IndexError:
                 return d
             else:
@@ -37,40 +65,24 @@ class IndexedDict(collections.MutableMapping):
     def pop(self, key=_marker, index=_marker, d=_marker):
         """ Remove and return value with given key or index (last item by default).
         If key is not found, d is returned if given, otherwise KeyError or IndexError is raised.
-        This is generally O(N) unless removing last item, then O(1). """
-        if index is self._marker and key is not self._marker:
-            try:
-                index, value = self._dict.pop(key)
-            except KeyError:
-                if d is self._marker:
-                    raise
-                else:
-                    return d
-            key2, value2 = self._list.pop(index)
-            assert key == key2
-        elif key is self._marker:
-            try:
+        This is generally O(N) unless removing last item or using tombstones,
+        then O(1). """
+        try:
+            if index is self._marker and key is not self._marker:
+                index, value = self._dict[key]
+            elif key is self._marker:
                 if index is self._marker:
-                    index = len(self._list) - 1
-                    key, value = self._list.pop()
-                else:
-                    key, value = self._list.pop(index)
-                    if index < 0:
-                        index += len(self._list) + 1
-            except IndexError:
-                if d is self._marker:
-                    raise
-                else:
-                    return d
-            index2, value2 = self._dict.pop(key)
-            assert index == index2
-        else:
-            raise self._key_and_index_error()
-
-        assert value is value2
-
-        self._fix_indices_after_delete(index)
+                    index = -1
+                index, (key, value) = self._slot(index)
+            else:
+                raise self._key_and_index_error()
+        except (KeyError, IndexError):
+            if d is self._marker:
+                raise
+            else:
+                return d
 
+        self._remove(index, key)
         return value
 
     def fast_pop(self, key=_marker, index=_marker):
@@ -85,65 +97,114 @@ class IndexedDict(collections.MutableMapping):
             index, popped_value = self._dict.pop(key)
         elif key is self._marker:
             if index is self._marker:
-                index = len(self._list) - 1
-                key, popped_value2 = self._list[-1]
-            else:
-                key, popped_value2 = self._list[index]
-                if index < 0:
-                    index += len(self._list)
+                index = -1
+            index, (key, popped_value2) = self._slot(index)
             index2, popped_value = self._dict.pop(key)
             assert index == index2
         else:
             raise self._key_and_index_error()
 
-        if key == self._list[-1][0]:
+        if index == len(self._list) - 1:
             # The item we're removing happens to be the last in the list, no swapping needed
             _, popped_value2 = self._list.pop()
             assert popped_value is popped_value2
-            return popped_value, len(self._list), key, popped_value
+            self._trim()
+            return popped_value, index, key, popped_value
         else:
             # Swap the last item onto the deleted spot and pop the last item from the list
             self._list[index] = self._list[-1]
             moved_key, moved_value = self._list.pop()
             self._dict[moved_key] = (index, moved_value)
+            self._trim()
             return popped_value, index, moved_key, moved_value
 
+    def fast_pop_many(self, keys=(), indices=()):
+        """ Remove all items with given keys or indices, filling their places
+        with items from the end (like repeated fast_pop, but in one pass).
+        With tombstones no items are moved, except by compaction.
+        Returns tuple (popped values, old indices of moved items, new indices
+        of moved items). """
+        removed, values = self._collect(keys, indices)
+
+        if self.tombstones:
+            mapping = self._delete_slots(removed)
+            moved = numpy.flatnonzero(mapping != numpy.arange(len(mapping)))
+            moved = moved[mapping[moved] >= 0]
+            return values, moved, mapping[moved]
+
+        for index in removed:
+            del self._dict[self._list[index][0]]
+
+        new_size = len(self._list) - len(removed)
+        removed_set = set(removed)
+        holes = sorted(index for index in removed if index < new_size)
+        moved = [
+            index for index in range(new_size, len(self._list)) if index not in removed_set
+        ]
+        assert len(holes) == len(moved)
+
+        for hole, index in zip(holes, moved):
+            entry = self._list[index]
+            self._list[hole] = entry
+            self._dict[entry[0]] = (hole, entry[1])
+        del self._list[new_size:]
+
+        return (
+            values,
+            numpy.array(moved, dtype=numpy.int64),
+            numpy.array(holes, dtype=numpy.int64),
+        )
+
+    def delete_many(self, keys=(), indices=()):
+        """ Remove all items with given keys or indices, keeping the order of
+        the remaining ones.
+        Returns an array mapping indices from before the call to the new ones
+        (-1 for removed items).
+        Runs in O(N), or O(number of removed items) plus amortized compaction
+        with tombstones (the mapping still has to be built, though). """
+        removed, values = self._collect(keys, indices)
+        return self._delete_slots(removed)
+
     def popitem(self, last=True):
         """ Remove and return last (default) or first (last=False) pair (key, value).
         Raises KeyError if the dictionary is empty.
-        Runs in O(1) for last item, O(N) for first one. """
-        try:
-            if last:
-                key, value = self._list.pop()
-                index = len(self._list)
-            else:
-                key, value = self._list.pop(0)
-                index = 0
-        except IndexError:
+        Runs in O(1) for last item, O(N) for first one (amortized O(1) with
+        tombstones). """
+        if not len(self):
             raise KeyError("IndexedDict is empty")
 
-        index2, value2 = self._dict.pop(key)
-        assert index == index2
-        assert value is value2
-
-        if not last:
-            self._fix_indices_after_delete()
+        if last:
+            index = len(self._list) - 1
+        else:
+            index = self._first_index()
+        key, value = self._list[index]
 
+        self._remove(index, key)
         return key, value
 
     def move_to_end(self, key=_marker, index=_marker, last=True):
-        """ Move an existing element to the end (or beginning if last==False). O(N). """
+        """ Move an existing element to the end (or beginning if last==False).
+        O(N), moving to the end is O(1) with tombstones. """
         if index is self._marker and key is not self._marker:
             index, value = self._dict[key]
         elif index is not self._marker and key is self._marker:
-            key, value = self._list[index]
-
-            # Normalize index
-            if index < 0:
-                index += len(self._list)
+            index, (key, value) = self._slot(index)
         else:
             raise self._key_eq_index_error()
 
+        if self.tombstones:
+            if last:
+                if index != len(self._list) - 1:
+                    self._list[index] = _tombstone
+                    self._tombstone_count += 1
+                    self._dict[key] = (len(self._list), value)
+                    self._list.append((key, value))
+                    self._maybe_compact()
+                return
+            else:
+                self.compact()
+                index = self._dict[key][0]
+
         if last:
             index_range = range(len(self._list) - 1, index - 1, -1)
             self._dict[key] = (len(self._list) - 1, value)
@@ -156,11 +217,29 @@ class IndexedDict(collections.MutableMapping):
             self._dict[previous[0]] = i, previous[1]
             previous, self._list[i] = self._list[i], previous
 
+    def compact(self):
+        """ Remove all tombstones, making indices contiguous again.
+        Calls on_compact if any indices changed.
+        Returns array mapping old indices to new ones (-1 for removed slots),
+        or None if there was nothing to compact. """
+        if not self._tombstone_count:
+            return None
+        mapping = self._compact()
+        if self.on_compact is not None:
+            self.on_compact(mapping)
+        return mapping
+
     def copy(self):
         """ A shallow copy """
-        ret = IndexedDict()
+        ret = IndexedDict(
+            tombstones=self.tombstones,
+            compaction_threshold=self.compaction_threshold,
+            on_compact=self.on_compact,
+        )
         ret._dict = self._dict.copy()
         ret._list = self._list.copy()
+        ret._tombstone_count = self._tombstone_count
+        ret._head = self._head
         return ret
 
     def index(self, key):
@@ -169,13 +248,15 @@ class IndexedDict(collections.MutableMapping):
 
     def key(self, index):
         """ Return key of a record at given index """
-        return self._list[index][0]
+        return self._slot(index)[1][0]
 
     def __len__(self):
-        return len(self._list)
+        return len(self._list) - self._tombstone_count
 
     def __repr__(self):
-        return "IndexedDict({})".format(repr(self._list))
+        return "IndexedDict({})".format(
+            repr([entry for entry in self._list if entry is not _tombstone])
+        )
 
     def __getitem__(self, key):
         return self._dict[key][1]
@@ -190,18 +271,14 @@ class IndexedDict(collections.MutableMapping):
         self._dict[key] = index, value
 
     def __delitem__(self, key):
-        index, value = self._dict.pop(key)
-        key2, value2 = self._list.pop(index)
-        assert key == key2
-        assert value is value2
-
-        self._fix_indices_after_delete(index)
+        index, value = self._dict[key]
+        self._remove(index, key)
 
     def __contains__(self, key):
         return key in self._dict
 
     def __iter__(self):
-        return (item[0] for item in self._list)
+        return (entry[0] for entry in self._list if entry is not _tombstone)
 
     @staticmethod
     def _key_and_index_error():
@@ -211,6 +288,94 @@ class IndexedDict(collections.MutableMapping):
     def _key_eq_index_error():
         raise TypeError("Exactly one of `key` and `index` must be specified")
 
+    def _slot(self, index):
+        """ Return normalized index and the (key, value) pair stored there.
+        Raises IndexError for tombstones. """
+        if index < 0:
+            index += len(self._list)
+        if index < 0:
+            raise IndexError("Index out of range")
+        entry = self._list[index]
+        if entry is _tombstone:
+            raise IndexError("No item at index {}".format(index))
+        return index, entry
+
+    def _first_index(self):
+        while self._list[self._head] is _tombstone:
+            self._head += 1
+        return self._head
+
+    def _remove(self, index, key):
+        """ Remove item at given index, preserving order """
+        del self._dict[key]
+        if self.tombstones:
+            self._list[index] = _tombstone
+            self._tombstone_count += 1
+            self._trim()
+            self._maybe_compact()
+        else:
+            del self._list[index]
+            self._fix_indices_after_delete(index)
+
+    def _collect(self, keys, indices):
+        """ Validate keys and indices of items to remove, return list of unique
+        indices and list of corresponding values. """
+        removed = {}
+        for key in keys:
+            index, value = self._dict[key]
+            removed[index] = value
+        for index in indices:
+            index, (key, value) = self._slot(index)
+            removed[index] = value
+        return list(removed.keys()), list(removed.values())
+
+    def _delete_slots(self, removed):
+        """ Remove items at given indices preserving order of the rest,
+        return mapping of indices. """
+        mapping = numpy.arange(len(self._list), dtype=numpy.int64)
+        mapping[removed] = -1
+
+        for index in removed:
+            del self._dict[self._list[index][0]]
+            self._list[index] = _tombstone
+        self._tombstone_count += len(removed)
+
+        if self.tombstones:
+            self._trim()
+            compaction = self._maybe_compact()
+        else:
+            compaction = self._compact()
+        if compaction is not None:
+            valid = mapping >= 0
+            mapping[valid] = compaction[mapping[valid]]
+
+        return mapping
+
+    def _trim(self):
+        """ Remove tombstones from the end of the list """
+        while self._list and self._list[-1] is _tombstone:
+            self._list.pop()
+            self._tombstone_count -= 1
+        self._head = min(self._head, len(self._list))
+
+    def _maybe_compact(self):
+        if self._tombstone_count > self.compaction_threshold * len(self._list):
+            return self.compact()
+        return None
+
+    def _compact(self):
+        mapping = numpy.full(len(self._list), -1, dtype=numpy.int64)
+        new_list = []
+        for i, entry in enumerate(self._list):
+            if entry is not _tombstone:
+                mapping[i] = len(new_list)
+                self._dict[entry[0]] = (len(new_list), entry[1])
+                new_list.append(entry)
+        self._list = new_list
+        self._tombstone_count = 0
+        self._head = 0
+        return mapping
+
     def _fix_indices_after_delete(self, starting_index=0):
         for i, (k, v) in enumerate(self._list[starting_index:], starting_index):
             self._dict[k] = (i, v)
@@ -219,10 +384,16 @@ class IndexedDict(collections.MutableMapping):
         """ Asserts that the inner state of the solver is consistent.
         Returns True, so it can be used in an assert expression itself. """
 
-        assert len(self._dict) == len(self._list)
+        assert len(self._dict) == len(self)
         for k, (i, v) in self._dict.items():
             k2, v2 = self._list[i]
             assert k2 == k
             assert v2 is v
 
+        tombstones = [i for i, entry in enumerate(self._list) if entry is _tombstone]
+        assert len(tombstones) == self._tombstone_count
+        assert self.tombstones or not tombstones
+        assert not self._list or self._list[-1] is not _tombstone
+        assert all(entry is _tombstone for entry in self._list[: self._head])
+
         return True
@@ -0,0 +1,40 @@
+import importlib
+import threading
+
+
+class LazyModule:
+    """ Stand-in for a module that is imported only when one of its attributes is
+    first accessed.
+
+    `on_import` is called with the module right after it is imported (exactly once).
+    Accessed attributes are cached on the proxy, so repeated lookups don't go
+    through `__getattr__`. """
+
+    def __init__(self, name, on_import=None):
+        self._lazy_name = name
+        self._lazy_on_import = on_import
+        self._lazy_module = None
+        self._lazy_lock = threading.Lock()
+
+    def _load(self):
+        """ Import the module (if it wasn't imported already) and return it. """
+        if self._lazy_module is None:
+            with self._lazy_lock:
+                if self._lazy_module is None:
+                    module = importlib.import_module(self._lazy_name)
+                    if self._lazy_on_import is not None:
+                        self._lazy_on_import(module)
+                    self._lazy_module = module
+        return self._lazy_module
+
+    def __getattr__(self, attribute):
+        if attribute.startswith("_lazy_"):
+            raise AttributeError(attribute)
+        value = getattr(self._load(), attribute)
+        setattr(self, attribute, value)
+        return value
+
+    def __repr__(self):
+        return "{}({!r}, loaded={})".format(
+            self.__class__.__name__, self._lazy_name, self._lazy_module is not None
+        )
@@ -1,3 +1,7 @@
+import math
+
+import autograd
+import autograd.numpy as numpy
 import pytest
 
 from parametric.constraints import *
@@ -41,6 +45,13 @@ def get_constraint_parameters(c):
                 Point(Variable(1), Variable(1)), Point(Variable(10), Variable(0))
             ),
         ),
+        ArcLength(Arc(Point(0, 0), Point(10, 0), Variable(2)), 12),
+        ArcRadius(Arc(Point(0, 0), Point(10, 0), Variable(2)), 5),
+        ArcTangent(
+            Arc(Point(0, 0), Point(10, 0), Variable(2)),
+            LineSegment(Point(-5, 1), Point(0, 0)),
+        ),
+        PointOnArc(Arc(Point(0, 0), Point(10, 0), Variable(2)), Point(5, -3)),
     ],
 )
 def test_constraint_evaluate(constraint):
@@ -53,3 +64,106 @@ def test_constraint_evaluate(constraint):
     print(type(constraint))
     print(eval_func(values))
     print(autograd.jacobian(eval_func)(values))  # noqa
+
+
+def _arc(h):
+    return Arc(Point(1, 2), Point(7, -1), Variable(h))
+
+
+def _arc_constraints(h):
+    arc = _arc(h)
+    return [
+        ArcLength(arc, 8),
+        ArcRadius(arc, 4),
+        ArcTangent(arc, LineSegment(Point(-3, 1), arc.a)),
+        ArcTangent(arc, LineSegment(arc.b, Point(9, 4))),
+        PointOnArc(arc, Point(3, 0)),
+    ]
+
+
+@pytest.mark.parametrize("h", [2.5, -1.5, 1e-3, 1e-5, 0, 20])
+@pytest.mark.parametrize("index", range(5))
+def test_arc_jacobian(h, index):
+    """ Analytic derivatives match autograd """
+    constraint = _arc_constraints(h)[index]
+    values, parameters = get_constraint_parameters(constraint)
+    parameters = parameters.reshape(1)
+    cls = constraint.__class__
+
+    expected = autograd.jacobian(lambda x: cls.evaluate(x, parameters))(values)
+    analytic = numpy.zeros_like(expected)
+    derivatives = cls.jacobian(values, parameters)
+    for i, name in enumerate(cls.variable_parameters):
+        analytic[:, parameters[name]] += derivatives[:, i]
+
+    assert numpy.allclose(analytic, expected, atol=1e-8)
+
+
+@pytest.mark.parametrize("index", range(5))
+def test_arc_stacked(index):
+    """ Arc kernels evaluate stacked states like the other constraints """
+    constraint = _arc_constraints(1)[index]
+    values, parameters = get_constraint_parameters(constraint)
+    parameters = parameters.reshape(1)
+    cls = constraint.__class__
+    stacked = numpy.stack([values, values + 0.1])
+
+    errors = cls.evaluate(stacked, parameters)
+    derivatives = cls.jacobian(stacked, parameters)
+
+    assert errors.shape == (2, 1)
+    assert derivatives.shape == (2, 1, len(cls.variable_parameters))
+    assert numpy.allclose(errors[1], cls.evaluate(values + 0.1, parameters))
+
+
+@pytest.mark.parametrize("h", [1, -1, 1e-4, 1e-7, 1e-12, 0])
+def test_arc_length_small_height(h):
+    """ Arc length is continuous and exact for nearly flat arcs """
+    values, parameters = get_constraint_parameters(
+        ArcLength(Arc(Point(0, 0), Point(2, 0), Variable(h)), 0)
+    )
+    length = ArcLength.evaluate(values, parameters)
+
+    if h == 0:
+        expected = 2
+    else:
+        radius = (1 + h * h) / (2 * h)
+        expected = radius * 4 * math.atan(h)
+    assert numpy.isfinite(length)
+    assert length == pytest.approx(expected, rel=1e-14)
+
+
+@pytest.mark.parametrize("h", [1, -1, 0.3, 5])
+def test_arc_geometry(h):
+    """ Errors are zero for points, tangents and radius of the circle
+    that the spatial index uses for the arc """
+    a = Point(0, 0)
+    b = Point(2, 0)
+    arc = Arc(a, b, Variable(h))
+    # Center at midpoint + (h - r) * right normal, right normal is (0, -1)
+    radius = (1 + h * h) / (2 * h)
+    center = (1, radius - h)
+
+    constraints = [ArcRadius(arc, abs(radius))]
+    for angle in [0.5, 2, 4]:
+        constraints.append(
+            PointOnArc(
+                arc,
+                Point(
+                    center[0] + radius * math.cos(angle),
+                    center[1] + radius * math.sin(angle),
+                ),
+            )
+        )
+    for end in [a, b]:
+        x = float(end.x) - center[0]
+        y = float(end.y) - center[1]
+        constraints.append(
+            ArcTangent(arc, LineSegment(end, Point(float(end.x) - y, float(end.y) + x)))
+        )
+
+    for constraint in constraints:
+        values, parameters = get_constraint_parameters(constraint)
+        assert constraint.__class__.evaluate(values, parameters) == pytest.approx(
+            0, abs=1e-12
+        )
@@ -0,0 +1,95 @@
+import math
+
+import numpy
+import pytest
+
+from parametric import constraints
+from parametric.constructive import propagate
+
+
+def records(dtype, rows):
+    return numpy.array(rows, dtype=dtype)
+
+
+index = numpy.uint32
+fixed_dtype = [("variable", index), ("value", float)]
+equal_dtype = [("v1", index), ("v2", index)]
+segment_dtype = [("ax", index), ("ay", index), ("bx", index), ("by", index)]
+
+
+def test_fixed_and_equal():
+    parameters = {
+        constraints.VariableFixed: records(fixed_dtype, [(0, 5)]),
+        constraints.VariablesEqual: records(equal_dtype, [(2, 1), (1, 0)]),
+    }
+    known, values = propagate(parameters, numpy.zeros(4))
+    assert list(known) == [True, True, True, False]
+    assert list(values) == [5, 5, 5, 0]
+
+
+def test_known_and_blocked():
+    parameters = {
+        constraints.VariableFixed: records(fixed_dtype, [(0, 5), (3, 1)]),
+        constraints.VariablesEqual: records(equal_dtype, [(2, 1), (1, 0)]),
+    }
+    blocked = numpy.array([False, True, False, True])
+    known, values = propagate(parameters, numpy.zeros(4), blocked=blocked)
+    assert list(known) == [True, False, False, False]
+
+    # Continue from variable 1 placed elsewhere
+    known[1] = True
+    known, values = propagate(parameters, [5, 7, 0, 0], known, blocked)
+    assert list(known) == [True, True, True, False]
+    assert list(values) == [5, 7, 7, 0]
+
+
+def test_angle_and_length():
+    """ Segment 1 -> 0 placed from its known end point, Length given
+    in the opposite direction """
+    parameters = {
+        constraints.VariableFixed: records(fixed_dtype, [(2, 1), (3, 2)]),
+        constraints.AbsoluteAngle: records(
+            segment_dtype + [("angle", float)], [(2, 3, 0, 1, math.pi / 2)]
+        ),
+        constraints.Length: records(
+            segment_dtype + [("length", float)], [(0, 1, 2, 3, 3)]
+        ),
+    }
+    known, values = propagate(parameters, numpy.zeros(4))
+    assert numpy.all(known)
+    assert values == pytest.approx([1, 5, 1, 2])
+
+
+def test_angle_without_length():
+    parameters = {
+        constraints.VariableFixed: records(fixed_dtype, [(0, 1), (1, 2)]),
+        constraints.AbsoluteAngle: records(
+            segment_dtype + [("angle", float)], [(0, 1, 2, 3, 0)]
+        ),
+    }
+    known, _ = propagate(parameters, numpy.zeros(4))
+    assert list(known) == [True, True, False, False]
+
+
+@pytest.mark.parametrize("side", [1, -1])
+def test_perpendicular_picks_closer_solution(side):
+    """ Known segment (0, 0) -> (2, 0), perpendicular segment of length 3
+    from its end point """
+    perpendicular_dtype = [
+        (name + i, index) for i in ("1", "2") for name in ("ax", "ay", "bx", "by")
+    ]
+    parameters = {
+        constraints.VariableFixed: records(
+            fixed_dtype, [(0, 0), (1, 0), (2, 2), (3, 0)]
+        ),
+        constraints.Perpendicular: records(
+            perpendicular_dtype, [(0, 1, 2, 3, 2, 3, 4, 5)]
+        ),
+        constraints.Length: records(
+            segment_dtype + [("length", float)], [(2, 3, 4, 5, 3)]
+        ),
+    }
+    x = numpy.array([0, 0, 2, 0, 2.5, side * 1.0])
+    known, values = propagate(parameters, x)
+    assert numpy.all(known)
+    assert values[4:] == pytest.approx([2, side * 3])
@@ -0,0 +1,52 @@
+import subprocess
+import sys
+
+import pytest
+
+heavy_modules = ["scipy", "autograd"]
+
+
+def run_isolated(code):
+    """ Run code in a fresh interpreter and return its stdout """
+    return subprocess.check_output([sys.executable, "-c", code], universal_newlines=True)
+
+
+def loaded_modules(code):
+    output = run_isolated(
+        code
+        + "\nimport sys\nprint(' '.join(m for m in {!r} if m in sys.modules))".format(
+            heavy_modules
+        )
+    )
+    return output.split()
+
+
+def test_import_is_light():
+    assert loaded_modules("import parametric") == []
+
+
+def test_construction_is_light():
+    code = """
+import parametric
+s = parametric.Solver()
+s.auto_solve = False
+a = parametric.Point(0, 0)
+b = parametric.Point(1, 1)
+l = parametric.LineSegment(a, b)
+c = parametric.Length(l, 5)
+parametric.Perpendicular(l, parametric.LineSegment(b, parametric.Point(2, 0)))
+index = parametric.SpatialIndex(s)
+index.add(l)
+"""
+    assert loaded_modules(code) == []
+
+
+@pytest.mark.parametrize("module", ["scipy", "autograd"])
+def test_solve_loads_dependencies(module):
+    code = """
+import parametric
+s = parametric.Solver()
+l = parametric.LineSegment(parametric.Point(0, 0), parametric.Point(1, 1))
+s.add_constraint(parametric.Length(l, 5))
+"""
+    assert module in loaded_modules(code)
@@ -0,0 +1,188 @@
+# pylint: disable=redefined-outer-name
+# pylint: disable=W0212
+
+import numpy
+import pytest
+
+from parametric import *
+from parametric import recording
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "recording.jsonl.gz")
+
+
+def record_session(solver, path):
+    """ Build a small sketch with auto solving, drag it around and remove
+    a constraint. """
+    points = [Point(0, 0), Point(10, 1), Point(9, 11)]
+    lines = [LineSegment(points[0], points[1]), LineSegment(points[1], points[2])]
+
+    solver.start_recording(path)
+    fixed = VariableFixed(points[0].x, 0)
+    for c in [
+        fixed,
+        VariableFixed(points[0].y, 0),
+        Length(lines[0], 5),
+        Length(lines[1], 5),
+        Perpendicular(lines[0], lines[1]),
+    ]:
+        solver.add_constraint(c)
+    solver.set_values({points[2].x: 3, points[2].y: 7})
+    points[1].x._value = 7  # Changed behind the solver's back
+    solver.solve()
+    solver.remove_constraint(fixed)
+    solver.stop_recording()
+
+
+def test_read(path):
+    solver = Solver()
+    record_session(solver, path)
+
+    header, entries = recording.read(path)
+    assert header["options"]["auto_solve"]
+    ops = [entry["op"] for entry in entries]
+    assert ops.count("variable") == 6
+    assert ops.count("add_constraint") == 5
+    assert ops.count("value") == 1
+    # Solves triggered by the other operations are part of their timings
+    assert ops.count("solve") == 1
+    assert all(entry["time"] >= 0 for entry in entries if "time" in entry)
+
+
+def test_replay(path):
+    solver = Solver()
+    record_session(solver, path)
+
+    replayed = Solver()
+    results = recording.replay(path, replayed)
+    assert [entry["op"] for entry, _ in results] == ["add_constraint"] * 5 + [
+        "set_values",
+        "solve",
+        "remove_constraint",
+    ]
+    assert all(replay_time >= 0 for _, replay_time in results)
+
+    assert replayed._constraint_count == solver._constraint_count
+    assert [float(v) for v in replayed._variables] == pytest.approx(
+        [float(v) for v in solver._variables]
+    )
+    assert replayed._assert_internal_state()
+
+
+def test_stop_without_recording():
+    solver = Solver()
+    solver.stop_recording()
+    assert solver._recorder is None
+
+
+def test_recording_twice(path):
+    solver = Solver()
+    solver.start_recording(path)
+    with pytest.raises(RuntimeError):
+        solver.start_recording(path)
+    solver.stop_recording()
+
+
+def test_replay_bulk(path):
+    solver = Solver()
+    points = [Point(i, 0.5 * (i % 2)) for i in range(6)]
+    solver.start_recording(path)
+    solver.add_constraint(VariableFixed(points[0].x, 0))
+    indices = solver.add_variables([v for p in points for v in p]).reshape(-1, 2)
+    ids = solver.add_constraints(
+        Length,
+        ax=indices[:-1, 0],
+        ay=indices[:-1, 1],
+        bx=indices[1:, 0],
+        by=indices[1:, 1],
+        length=numpy.full(5, 2.0),
+    )
+    solver.remove_constraints(ids[:2])
+    solver.stop_recording()
+
+    replayed = Solver()
+    results = recording.replay(path, replayed)
+    assert [entry["op"] for entry, _ in results] == [
+        "add_constraint",
+        "add_variables",
+        "add_constraints",
+        "remove_constraints",
+    ]
+    assert replayed._constraint_count == solver._constraint_count == 4
+    assert [float(v) for v in replayed._variables] == pytest.approx(
+        [float(v) for v in solver._variables]
+    )
+
+
+def test_replay_set_parameters(path):
+    solver = Solver()
+    points = [Point(i, 0.5 * (i % 2)) for i in range(4)]
+    angle = AbsoluteAngle(LineSegment(points[0], points[1]), 0)
+    solver.start_recording(path)
+    solver.add_constraint(VariableFixed(points[0].x, 0))
+    solver.add_constraint(VariableFixed(points[0].y, 0))
+    solver.add_constraint(angle)
+    indices = solver.add_variables([v for p in points for v in p]).reshape(-1, 2)
+    ids = solver.add_constraints(
+        Length,
+        ax=indices[:-1, 0],
+        ay=indices[:-1, 1],
+        bx=indices[1:, 0],
+        by=indices[1:, 1],
+        length=numpy.full(3, 1.5),
+    )
+    solver.set_parameter(angle, "angle", 30)
+    solver.set_parameters(ids[1:], "length", [3, 4])
+    solver.stop_recording()
+
+    header, entries = recording.read(path)
+    set_parameter = next(entry for entry in entries if entry["op"] == "set_parameter")
+    assert set_parameter["value"] == 30
+    assert set_parameter["parameters"]["angle"] == pytest.approx(numpy.radians(30))
+
+    replayed = Solver()
+    results = recording.replay(path, replayed)
+    assert [entry["op"] for entry, _ in results][-2:] == [
+        "set_parameter",
+        "set_parameters",
+    ]
+    assert [float(v) for v in replayed._variables] == pytest.approx(
+        [float(v) for v in solver._variables]
+    )
+    assert replayed._assert_internal_state()
+
+
+def test_replay_suspend(path):
+    solver = Solver()
+    solver.start_recording(path)
+    points = [Point(0, 0), Point(3, 1), Point(4, 4)]
+    ids = [
+        solver.add_constraint(c)
+        for c in [
+            VariableFixed(points[0].x, 0),
+            VariableFixed(points[0].y, 0),
+            Length(LineSegment(points[0], points[1]), 2),
+            Length(LineSegment(points[1], points[2]), 2),
+        ]
+    ]
+    solver.add_to_group("lengths", ids[2:])
+    solver.suspend_group("lengths")
+    solver.set_values({points[2].x: 10})
+    solver.resume_constraints(ids[3:])
+    solver.stop_recording()
+
+    replayed = Solver()
+    results = recording.replay(path, replayed)
+    assert [entry["op"] for entry, _ in results][-4:] == [
+        "add_to_group",
+        "suspend_group",
+        "set_values",
+        "resume_constraints",
+    ]
+    assert list(replayed.group("lengths")) == ids[2:]
+    assert list(replayed.suspended_ids()) == ids[2:3]
+    assert [float(v) for v in replayed._variables] == pytest.approx(
+        [float(v) for v in solver._variables]
+    )
@@ -0,0 +1,81 @@
+# pylint: disable=redefined-outer-name
+
+import numpy
+import pytest
+
+from parametric.reduction import Reduction, fit_pose
+
+
+@pytest.fixture
+def reduction():
+    """ Seven variables, two of them free, one cluster of a triangle and
+    one of a segment """
+    triangle = numpy.array([[0, 1], [2, 3], [6, 7]])
+    segment = numpy.array([[8, 9], [10, 11]])
+    triangle_shape = numpy.array([[-1.0, -1.0], [2.0, -1.0], [-1.0, 2.0]])
+    segment_shape = numpy.array([[-0.5, 0.0], [0.5, 0.0]])
+    return Reduction(12, [(triangle, triangle_shape), (segment, segment_shape)])
+
+
+def test_layout(reduction):
+    assert list(reduction.free) == [4, 5]
+    assert reduction.size == 2 + 2 * 3
+    assert list(reduction.scales(10)) == [10, 10, 10, 10, 1, 10, 10, 1]
+
+
+def test_identity():
+    reduction = Reduction(5)
+    x = numpy.arange(5.0)
+    assert reduction.is_identity()
+    assert list(reduction.reduce(x)) == list(x)
+    assert list(reduction.expand(x)) == list(x)
+
+
+def test_round_trip(reduction):
+    y = numpy.array([3, 4, 1, 2, 0.5, -7, 8, -2.5])
+    x = reduction.expand(y)
+    assert reduction.reduce(x) == pytest.approx(y)
+
+
+def test_expand_keeps_shape(reduction):
+    x = reduction.expand(numpy.array([3, 4, 1, 2, 0.5, -7, 8, -2.5]))
+    assert numpy.hypot(x[8] - x[10], x[9] - x[11]) == pytest.approx(1)
+    assert numpy.hypot(x[0] - x[2], x[1] - x[3]) == pytest.approx(3)
+
+
+def test_chain(reduction):
+    """ Chained derivatives match finite differences of a function of the full
+    variables """
+    weights = numpy.random.RandomState(0).normal(size=(3, 12))
+
+    def f(x):
+        return weights.dot(x ** 2)
+
+    y = numpy.array([3, 4, 1, 2, 0.5, -7, 8, -2.5])
+    jacobian = 2 * weights * reduction.expand(y)
+    chained = reduction.chain(jacobian, y)
+
+    step = 1e-6
+    for i in range(reduction.size):
+        dy = numpy.zeros_like(y)
+        dy[i] = step
+        difference = (f(reduction.expand(y + dy)) - f(reduction.expand(y - dy))) / (
+            2 * step
+        )
+        assert chained[:, i] == pytest.approx(difference, rel=1e-5, abs=1e-5)
+
+
+def test_fit_pose():
+    shape = numpy.array([[-1.0, -1.0], [2.0, -1.0], [-1.0, 2.0]])
+    angle = 0.3
+    rotation = numpy.array(
+        [[numpy.cos(angle), -numpy.sin(angle)], [numpy.sin(angle), numpy.cos(angle)]]
+    )
+    expected = shape.dot(rotation.T) + [5, -2]
+    points = expected + [[0, 0], [0, 0], [3, 4]]
+    known = numpy.array([[True, True], [True, True], [False, True]])
+
+    assert fit_pose(shape, points, known) == pytest.approx(expected)
+    # A single known point doesn't determine the rotation
+    known[1, 0] = False
+    assert fit_pose(shape, points, known) is None
@@ -0,0 +1,172 @@
+# pylint: disable=redefined-outer-name
+
+import os
+import tempfile
+
+import pytest
+
+from parametric.server import Client, SolverServer
+from parametric.solver import Solver
+
+
+@pytest.fixture(params=["unix", "tcp"])
+def address(request):
+    if request.param == "unix":
+        directory = tempfile.mkdtemp()
+        server = SolverServer(os.path.join(directory, "socket"))
+    else:
+        server = SolverServer(("127.0.0.1", 0))
+    server.start()
+    yield server.address
+    server.shutdown()
+
+
+@pytest.fixture
+def client(address):
+    with Client(address) as ret:
+        ret.request("s", "open")
+        yield ret
+
+
+def build_segment(client):
+    client.request("s", "point", name="a", x=0, y=0)
+    client.request("s", "point", name="b", x=3, y=1)
+    client.request("s", "line", name="l", a="a", b="b")
+    client.request("s", "add", name="fix_x", type="VariableFixed", args=["a.x", 0])
+    client.request("s", "add", name="fix_y", type="VariableFixed", args=["a.y", 0])
+    client.request("s", "add", name="angle", type="AbsoluteAngle", args=["l", 0])
+    return client.request("s", "add", name="length", type="Length", args=["l", 5])
+
+
+def test_build_and_solve(client):
+    response = build_segment(client)
+    assert response["changed"]["b.x"] == pytest.approx(5, abs=1e-3)
+
+    values = client.request("s", "get", names=["a", "b"])["values"]
+    assert values["b"] == pytest.approx([5, 0], abs=1e-3)
+
+
+def test_drag(client):
+    build_segment(client)
+    client.request("s", "remove", name="angle")
+    response = client.request("s", "drag", values={"b": [0, 10]})
+
+    assert {"b.x", "b.y"} <= set(response["changed"])
+    assert response["changed"].get("a.x", 0) == pytest.approx(0, abs=1e-3)
+    assert response["changed"]["b.y"] == pytest.approx(5, abs=1e-3)
+
+
+def test_set_parameter(client):
+    build_segment(client)
+    response = client.request("s", "set", name="length", parameter="length", value=8)
+    assert response["changed"]["b.x"] == pytest.approx(8, abs=1e-3)
+
+    response = client.request("s", "set", name="angle", parameter="angle", value=90)
+    assert response["changed"]["b.y"] == pytest.approx(8, abs=1e-3)
+
+
+def test_pipelined(client):
+    client.send("s", "point", name="a", x=-1, y=0)
+    for i in range(10):
+        client.send("s", "add", name="c{}".format(i), type="VariableFixed", args=["a.x", i])
+        client.send("s", "remove", name="c{}".format(i))
+    client.send("s", "get", names=["a"])
+
+    assert client.receive()["changed"] == {}
+    for i in range(10):
+        assert client.receive()["changed"]["a.x"] == pytest.approx(i, abs=1e-3)
+        assert client.receive()["changed"] == {}
+    assert client.receive()["values"]["a"] == pytest.approx([9, 0], abs=1e-3)
+
+
+def test_sessions_are_separate(client):
+    client.request("s", "point", name="a", x=0, y=0)
+    client.request("s", "point", name="b", x=0, y=0)
+    client.request("t", "open")
+    client.request("t", "point", name="a", x=0, y=0)
+    with pytest.raises(RuntimeError):
+        client.request("t", "get", names=["b"])
+
+    client.request("s", "add", name="fix", type="VariableFixed", args=["a.x", 1])
+    client.request("t", "add", name="fix", type="VariableFixed", args=["a.x", 2])
+    client.request("s", "solve")
+    client.request("t", "solve")
+    assert client.request("s", "get", names=["a"])["values"]["a"] == pytest.approx(
+        [1, 0], abs=1e-3
+    )
+    assert client.request("t", "get", names=["a"])["values"]["a"] == pytest.approx(
+        [2, 0], abs=1e-3
+    )
+
+    client.request("s", "open", reset=True)
+    for name in ["a", "b", "fix"]:
+        with pytest.raises(RuntimeError):
+            client.request("s", "remove", name=name)
+    client.request("s", "point", name="a", x=0, y=0)
+    assert client.request("t", "get", names=["a"])["values"]["a"] == pytest.approx(
+        [2, 0], abs=1e-3
+    )
+
+
+def test_failed_add_is_rolled_back(client, monkeypatch):
+    build_segment(client)
+
+    def solve(self):
+        raise RuntimeError("Solve failed")
+
+    monkeypatch.setattr(Solver, "solve", solve)
+    with pytest.raises(RuntimeError):
+        client.request("s", "add", name="longer", type="Length", args=["l", 8])
+    monkeypatch.undo()
+
+    with pytest.raises(RuntimeError):
+        client.request("s", "remove", name="longer")
+    client.request("s", "drag", values={"b": [3, 1]})
+    values = client.request("s", "get", names=["b"])["values"]
+    assert values["b"] == pytest.approx([5, 0], abs=1e-3)
+
+
+def test_close_releases_solver(client, monkeypatch):
+    closed = []
+    close = Solver.close
+
+    def recording_close(self):
+        closed.append(self)
+        close(self)
+
+    monkeypatch.setattr(Solver, "close", recording_close)
+    client.request("t", "open")
+    client.request("t", "close")
+    assert len(closed) == 1
+    client.request("s", "open", reset=True)
+    assert len(closed) == 2
+    client.request("s", "open")
+    assert len(closed) == 2
+
+
+def test_errors(client):
+    with pytest.raises(RuntimeError):
+        client.request("s", "add", name="x", type="_Constraint", args=[])
+    with pytest.raises(RuntimeError):
+        client.request("s", "remove", name="missing")
+    with pytest.raises(RuntimeError):
+        client.request("s", "frobnicate")
+    with pytest.raises(RuntimeError):
+        client.request("nonexistent", "solve")
+
+    client.request("s", "point", name="a", x=0, y=0)
+    with pytest.raises(RuntimeError):
+        client.request("s", "point", name="a", x=0, y=0)
+
+
+def test_point_name_collision(client):
+    client.request("s", "variable", name="p.y", value=1)
+    with pytest.raises(RuntimeError):
+        client.request("s", "point", name="p", x=0, y=0)
+
+    # Nothing of the failed point was defined
+    for name in ["p", "p.x"]:
+        with pytest.raises(RuntimeError):
+            client.request("s", "get", names=[name])
+    assert client.request("s", "get", names=["p.y"])["values"] == {"p.y": 1}
+    client.request("s", "point", name="q", x=0, y=0)
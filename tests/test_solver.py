@@ -0,0 +1,1494 @@
+# pylint: disable=redefined-outer-name
+# pylint: disable=W0212
+
+import math
+import os
+import subprocess
+import sys
+
+import numpy
+import pytest
+
+from parametric import *
+
+
+@pytest.fixture
+def solver():
+    ret = Solver()
+    ret.auto_solve = False
+    yield ret
+    assert ret._assert_internal_state()
+
+
+@pytest.fixture
+def square():
+    """ Points of a 10x10 square and its four sides """
+    points = [Point(0, 0), Point(10, 0), Point(10, 10), Point(0, 10)]
+    lines = [LineSegment(points[i - 1], points[i]) for i in range(4)]
+    return points, lines
+
+
+def square_constraints(points, lines):
+    return [
+        VariableFixed(points[0].x, 0),
+        VariableFixed(points[0].y, 0),
+        AbsoluteAngle(lines[1], 0),
+        Length(lines[1], 5),
+        Perpendicular(lines[1], lines[2]),
+        Length(lines[2], 5),
+        Horizontal(points[2], points[3]),
+        Vertical(points[0], points[3]),
+    ]
+
+
+def test_add_constraint(solver, square):
+    constraints = square_constraints(*square)
+    for c in constraints:
+        solver.add_constraint(c)
+
+    assert len(solver._variables) == 8
+    assert solver._constraint_count == len(constraints)
+
+
+def test_add_twice(solver):
+    c = VariableFixed(Variable(1), 2)
+    solver.add_constraint(c)
+    with pytest.raises(ValueError):
+        solver.add_constraint(c)
+
+
+def test_remove_missing(solver):
+    with pytest.raises(ValueError):
+        solver.remove_constraint(VariableFixed(Variable(1), 2))
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("layout", ["records", "columns"])
+def test_remove_in_random_order(solver, square, seed, layout):
+    solver.parameter_layout = layout
+    constraints = square_constraints(*square)
+    for c in constraints:
+        solver.add_constraint(c)
+
+    for i in numpy.random.RandomState(seed).permutation(len(constraints)):
+        solver.remove_constraint(constraints[i])
+
+    assert len(solver._variables) == 0
+    assert solver._constraint_count == 0
+
+
+def test_constraint_ids_reused(solver):
+    a = VariableFixed(Variable(1), 2)
+    b = VariableFixed(Variable(1), 2)
+    solver.add_constraint(a)
+    solver.remove_constraint(a)
+    solver.add_constraint(b)
+    assert len(solver._constraint_objects) == 1
+
+
+@pytest.mark.parametrize("storage", [None, "mmap"])
+@pytest.mark.parametrize("layout", ["records", "columns"])
+def test_solve(square, storage, layout):
+    solver = Solver()
+    solver.parameter_storage = storage
+    solver.parameter_layout = layout
+    for c in square_constraints(*square):
+        solver.add_constraint(c)
+
+    expected = [(0, 0), (5, 0), (5, 5), (0, 5)]
+    for p, (x, y) in zip(square[0], expected):
+        assert float(p.x) == pytest.approx(x, abs=1e-4)
+        assert float(p.y) == pytest.approx(y, abs=1e-4)
+
+
+@pytest.mark.skipif(not os.path.isdir("/dev/shm"), reason="Needs /dev/shm")
+@pytest.mark.parametrize("layout", ["records", "columns"])
+def test_shared_parameters(square, layout):
+    points, lines = square
+    with Solver() as solver:
+        solver.auto_solve = False
+        solver.parameter_storage = "shared"
+        solver.parameter_layout = layout
+        for c in square_constraints(points, lines):
+            solver.add_constraint(c)
+
+        arrays = solver.shared_parameter_arrays()
+        assert set(arrays) == set(solver._constraints)
+        lengths = arrays[Length]
+        assert len(lengths) == (1 if layout == "records" else 5)
+        names = [name for block in arrays.values() for name, _, _ in block]
+        assert all(os.path.exists(os.path.join("/dev/shm", n)) for n in names)
+
+        # Sum of the lengths from a worker process
+        name, dtype, length = lengths[-1]
+        code = "\n".join(
+            [
+                "import ast, sys",
+                "from parametric.util import DynamicArray",
+                "dtype = ast.literal_eval(sys.argv[2])",
+                "array = DynamicArray.attach(sys.argv[1], dtype, int(sys.argv[3]))",
+                "values = array.array()",
+                "print(sum(values['length'] if values.dtype.names else values))",
+                "array.close()",
+            ]
+        )
+        result = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                code,
+                name,
+                repr(dtype.descr if dtype.names else dtype.str),
+                str(length),
+            ],
+            stdout=subprocess.PIPE,
+            check=True,
+            universal_newlines=True,
+            timeout=60,
+        )
+        assert float(result.stdout) == 10
+
+    assert not any(os.path.exists(os.path.join("/dev/shm", n)) for n in names)
+
+
+def test_jacobian_sparsity(solver, square):
+    for c in square_constraints(*square):
+        solver.add_constraint(c)
+
+    x = numpy.array([float(v) for v in solver._variables])
+    jacobian = solver._evaluate_constraint_jacobians(x)
+    sparsity = solver._jacobian_sparsity().toarray()
+
+    assert sparsity.shape == jacobian.shape
+    assert not numpy.any(jacobian[~sparsity])
+
+
+def test_incidence_matrix(solver, square):
+    points, lines = square
+    perpendicular = Perpendicular(lines[0], lines[1])  # Shares points[0]
+    solver.add_constraint(perpendicular)
+
+    matrix = solver._incidence_matrix().toarray()
+    constraint_id = solver._constraint_ids[perpendicular]
+    assert matrix[solver._variables.index(points[0].x), constraint_id] == 2
+    assert matrix[:, constraint_id].sum() == 8
+
+
+def test_remove_relocates_shared_variable(solver):
+    """ Removing the only user of the first variable moves the last variable
+    (used by several fields of several constraints) to its place. """
+    a = Point(0, 0)
+    b = Point(1, 1)
+    first = VariableFixed(Variable(5), 5)
+    solver.add_constraint(first)
+    ab = LineSegment(a, b)
+    ba = LineSegment(b, a)
+    perpendicular = Perpendicular(ab, ba)
+    length = Length(ab, 3)
+    solver.add_constraint(perpendicular)
+    solver.add_constraint(length)
+
+    last = solver._variables.key(-1)
+    solver.remove_constraint(first)
+
+    assert solver._variables.index(last) == 0
+    for constraint in [perpendicular, length]:
+        block_index, row = solver._constraint_locations[
+            solver._constraint_ids[constraint]
+        ]
+        record = solver._blocks[block_index].parameter_array[row]
+        for name, value in constraint.get_parameters():
+            if isinstance(value, Variable):
+                assert record[name] == solver._variables.index(value)
+
+
+def test_set_values():
+    solver = Solver()
+    a = Point(0, 0)
+    b = Point(3, 0)
+    segment = LineSegment(a, b)
+    solver.add_constraint(VariableFixed(a.x, 0))
+    solver.add_constraint(VariableFixed(a.y, 0))
+    solver.add_constraint(Length(segment, 3))
+
+    notified = []
+    solver.add_listener(notified.extend)
+    solver.set_values({b.x: 0, b.y: 10})
+
+    assert float(b.x) == pytest.approx(0, abs=1e-4)
+    assert float(b.y) == pytest.approx(3, abs=1e-4)
+    assert b.x in notified
+    assert b.y in notified
+
+
+def random_quadrilateral(seed):
+    """ Quadrilateral with mirrorable constraints and random initial positions """
+    rng = numpy.random.RandomState(seed)
+    points = [Point(*rng.uniform(0, 10, 2)) for _ in range(4)]
+    lines = [LineSegment(points[i], points[(i + 1) % 4]) for i in range(4)]
+    return [
+        VariableFixed(points[0].x),
+        VariableFixed(points[0].y),
+        AbsoluteAngle(lines[0], 0),
+        Length(lines[0], 10),
+        Length(lines[1], 4),
+        Perpendicular(lines[0], lines[1]),
+        Length(lines[2], 10),
+        Perpendicular(lines[2], lines[3]),
+    ]
+
+
+def solve_distance(constraints, multi_start):
+    solver = Solver()
+    solver.auto_solve = False
+    solver.multi_start = multi_start
+    solver.multi_start_seed = 0
+    for c in constraints:
+        solver.add_constraint(c)
+
+    initial = numpy.array([float(v) for v in solver._variables])
+    solver.solve()
+    x = numpy.array([float(v) for v in solver._variables])
+
+    error = numpy.max(numpy.abs(solver._evaluate_constraints(x)))
+    return numpy.sum((x - initial) ** 2), error
+
+
+@pytest.mark.parametrize("seed", [3, 4, 12, 19])
+def test_multi_start(seed):
+    single_distance, single_error = solve_distance(random_quadrilateral(seed), 0)
+    distance, error = solve_distance(random_quadrilateral(seed), 8)
+
+    assert error < 1e-6
+    if single_error < 1e-6:
+        assert distance <= single_distance + 1e-6
+
+
+def test_evaluate_batch(solver, square):
+    for c in square_constraints(*square):
+        solver.add_constraint(c)
+
+    x = numpy.random.RandomState(0).normal(size=(3, len(solver._variables)))
+    errors = solver._evaluate_constraints(x)
+    jacobians = solver._evaluate_constraint_jacobians_batch(x)
+
+    for i in range(3):
+        assert errors[i] == pytest.approx(solver._evaluate_constraints(x[i]))
+        assert numpy.allclose(
+            jacobians[i], solver._evaluate_constraint_jacobians(x[i])
+        )
+
+
+@pytest.mark.parametrize("factor", [1e-6, 1, 1e6])
+@pytest.mark.parametrize("scaling", [False, True])
+# Offsets of the sketch from the origin, relative to its size
+@pytest.mark.parametrize("offset", [(0, 0), (1e4, 0), (-1e5, 3e4)])
+def test_scaling(factor, scaling, offset):
+    dx, dy = factor * numpy.array(offset)
+    a = Point(dx, dy)
+    b = Point(dx + factor * 3, dy + factor * 1)
+    c = Point(dx + factor * 4, dy + factor * 5)
+    ab = LineSegment(a, b)
+    bc = LineSegment(b, c)
+
+    solver = Solver()
+    solver.auto_solve = False
+    solver.scaling = scaling
+    # The sketch is simple enough to be placed without the optimizer
+    solver.constructive = False
+    for constraint in [
+        VariableFixed(a.x, dx),
+        VariableFixed(a.y, dy),
+        AbsoluteAngle(ab, 0),
+        Length(ab, factor * 5),
+        Perpendicular(ab, bc),
+        Length(bc, factor * 5),
+    ]:
+        solver.add_constraint(constraint)
+    solver.solve()
+
+    if scaling or factor == 1:
+        for p, (x, y) in zip([a, b, c], [(0, 0), (5, 0), (5, 5)]):
+            assert (float(p.x) - dx) / factor == pytest.approx(x, abs=1e-5)
+            assert (float(p.y) - dy) / factor == pytest.approx(y, abs=1e-5)
+    assert solver.statistics["solves"] == 1
+    assert solver.statistics["iterations"] > 0
+
+
+def chain(solver, segments, bulk):
+    """ Chain of unit length segments starting at a fixed point.
+    Returns the points. """
+    points = [Point(i, i % 2) for i in range(segments + 1)]
+    fixed = [VariableFixed(points[0].x, 0), VariableFixed(points[0].y, 0)]
+    if bulk:
+        indices = solver.add_variables([v for p in points for v in p]).reshape(-1, 2)
+        solver.add_constraints(
+            VariableFixed, variable=indices[0], value=numpy.zeros(2)
+        )
+        solver.add_constraints(
+            Length,
+            ax=indices[:-1, 0],
+            ay=indices[:-1, 1],
+            bx=indices[1:, 0],
+            by=indices[1:, 1],
+            length=numpy.ones(segments),
+        )
+    else:
+        for c in fixed:
+            solver.add_constraint(c)
+        for a, b in zip(points[:-1], points[1:]):
+            solver.add_constraint(Length(LineSegment(a, b), 1))
+    return points
+
+
+def test_add_constraints(solver):
+    points = chain(solver, 10, True)
+    assert solver._constraint_count == 12
+    assert len(solver._variables) == 22
+    assert len(solver._blocks) == 2
+
+    reference = Solver()
+    reference.auto_solve = False
+    chain(reference, 10, False)
+    assert numpy.array_equal(
+        solver._evaluate_constraints(numpy.arange(22.0)),
+        reference._evaluate_constraints(numpy.arange(22.0)),
+    )
+
+    solver.solve()
+    for a, b in zip(points[:-1], points[1:]):
+        assert numpy.hypot(
+            float(b.x) - float(a.x), float(b.y) - float(a.y)
+        ) == pytest.approx(1, abs=1e-4)
+
+
+def test_add_constraints_mixed(solver, square):
+    points, lines = square
+    for c in square_constraints(points, lines)[:4]:
+        solver.add_constraint(c)
+    indices = solver.variable_indices([points[0].y, points[1].y])
+    ids = solver.add_constraints(VariablesEqual, v1=indices[:1], v2=indices[1:])
+    assert len(solver._constraints[VariablesEqual]) == 1
+
+    solver.remove_constraints(ids)
+    assert solver._constraint_count == 4
+
+
+def test_remove_constraints(solver):
+    chain(solver, 10, True)
+    ids = numpy.random.RandomState(0).permutation(12)
+    solver.remove_constraints(ids[:5])
+    assert solver._constraint_count == 7
+    solver.remove_constraints(ids[5:])
+    assert solver._constraint_count == 0
+    assert len(solver._variables) == 0
+
+    # Ids get reused
+    chain(solver, 3, True)
+    assert len(solver._constraint_objects) == 12
+
+
+def test_remove_constraints_by_id_of_object(solver):
+    c = VariableFixed(Variable(1), 2)
+    constraint_id = solver.add_constraint(c)
+    solver.remove_constraints([constraint_id])
+    assert c not in solver._constraint_ids
+    assert solver._constraint_count == 0
+
+
+@pytest.mark.parametrize("ids", [[0, 0], [100], [-1]])
+def test_remove_constraints_invalid(solver, ids):
+    chain(solver, 2, True)
+    with pytest.raises(ValueError):
+        solver.remove_constraints(ids)
+    assert solver._constraint_count == 4
+
+
+def test_unused_variables_pruned(solver):
+    unused = [Variable(0), Variable(1)]
+    indices = solver.add_variables(unused + [Variable(2), Variable(3)])
+    ids = solver.add_constraints(VariablesEqual, v1=indices[2:3], v2=indices[3:])
+    assert len(solver._variables) == 4
+
+    solver.remove_constraints(ids)
+    assert len(solver._variables) == 0
+    assert solver._assert_internal_state()
+
+    # Variables registered again before a later removal survive while used
+    indices = solver.add_variables(unused)
+    constraint_id = solver.add_constraints(
+        VariablesEqual, v1=indices[:1], v2=indices[1:]
+    )[0]
+    constraint = VariablesEqual(Variable(4), Variable(5))
+    solver.add_constraint(constraint)
+    solver.remove_constraint(constraint)
+    assert list(solver._variables) == unused
+    solver.remove_constraints([constraint_id])
+    assert len(solver._variables) == 0
+
+
+def test_add_constraints_invalid(solver):
+    indices = solver.add_variables([Variable(0), Variable(1)])
+    with pytest.raises(ValueError):
+        solver.add_constraints(VariablesEqual, v1=indices[:1])
+    with pytest.raises(ValueError):
+        solver.add_constraints(VariablesEqual, v1=indices, v2=indices[:1])
+    with pytest.raises(IndexError):
+        solver.add_constraints(VariablesEqual, v1=indices, v2=indices + 1)
+    assert solver._constraint_count == 0
+
+
+def test_inferred_schema(solver):
+    class Undeclared(VariablesEqual):
+        variable_parameters = None
+
+    solver.add_constraint(Undeclared(Variable(1), Variable(2)))
+    with pytest.raises(ValueError):
+        solver.add_constraints(Undeclared, v1=[0], v2=[1])
+
+
+def test_subclasses_share_block(solver, square):
+    for c in square_constraints(*square):
+        solver.add_constraint(c)
+
+    assert set(solver._constraints) == {
+        VariableFixed,
+        AbsoluteAngle,
+        Length,
+        Perpendicular,
+        VariablesEqual,
+    }
+    assert len(solver._constraints[VariablesEqual]) == 2
+
+    solver.solve()
+    points = square[0]
+    assert float(points[2].y) == pytest.approx(float(points[3].y), abs=1e-4)
+    assert float(points[0].x) == pytest.approx(float(points[3].x), abs=1e-4)
+
+
+def test_subclass_bulk(solver):
+    indices = solver.add_variables([Variable(0), Variable(1)])
+    solver.add_constraints(Vertical, v1=indices[:1], v2=indices[1:])
+    assert list(solver._constraints) == [VariablesEqual]
+
+
+def test_subclass_parameter_mismatch(solver):
+    class Mismatched(VariablesEqual):
+        variable_parameters = ("v1", "v2", "v3")
+
+        def __init__(self, a, b, c):
+            super().__init__(a, b)
+            self.variable3 = c
+
+        def get_parameters(self):
+            return super().get_parameters() + [("v3", self.variable3)]
+
+    solver.add_constraint(VariablesEqual(Variable(0), Variable(1)))
+    with pytest.raises(TypeError):
+        solver.add_constraint(Mismatched(Variable(0), Variable(1), Variable(2)))
+    assert len(solver._variables) == 2
+
+
+def test_subclass_parameter_mismatch_bulk(solver):
+    class Mismatched(VariablesEqual):
+        variable_parameters = ("v1", "v2", "v3")
+
+    indices = solver.add_variables([Variable(0), Variable(1), Variable(2)])
+    solver.add_constraints(VariablesEqual, v1=indices[:1], v2=indices[1:2])
+    with pytest.raises(TypeError):
+        solver.add_constraints(
+            Mismatched, v1=indices[:1], v2=indices[1:2], v3=indices[2:]
+        )
+    assert solver._constraint_count == 1
+    assert solver._assert_internal_state()
+
+    # The solver keeps working
+    solver.add_constraints(VariablesEqual, v1=indices[1:2], v2=indices[2:])
+    solver.solve()
+    assert solver._constraint_count == 2
+
+
+def triangulated_polygon(center, count, seed):
+    """ Polygon made rigid by lengths of its sides and diagonals from its first
+    vertex, placed by fixing the first vertex and angle of the first side.
+    Vertices start randomly perturbed from a regular polygon. """
+    rng = numpy.random.RandomState(seed)
+    angles = numpy.linspace(0, 2 * numpy.pi, count, endpoint=False)
+    points = [
+        Point(center + 3 * numpy.cos(a) + rng.normal(), 3 * numpy.sin(a) + rng.normal())
+        for a in angles
+    ]
+    constraints = [
+        VariableFixed(points[0].x, center + 3),
+        VariableFixed(points[0].y, 0),
+        AbsoluteAngle(LineSegment(points[0], points[1]), 100),
+    ]
+    for i in range(count):
+        constraints.append(
+            Length(LineSegment(points[i - 1], points[i]), 2 + i % 3)
+        )
+    for i in range(2, count - 1):
+        constraints.append(Length(LineSegment(points[0], points[i]), 4 + i % 2))
+    return points, constraints
+
+
+def solved_values(constraints, rigid_clusters):
+    solver = Solver()
+    solver.auto_solve = False
+    solver.constructive = False
+    solver.rigid_clusters = rigid_clusters
+    for c in constraints:
+        solver.add_constraint(c)
+    initial = [float(v) for v in solver._variables]
+    solver.solve()
+    ret = [float(v) for v in solver._variables]
+    for v, value in zip(solver._variables, initial):
+        v._value = value
+    return solver, numpy.array(ret)
+
+
+def test_rigid_cluster_square(solver, square):
+    solver.constructive = False
+    for c in square_constraints(*square):
+        solver.add_constraint(c)
+    solver.solve()
+
+    assert solver.statistics["rigid_clusters"] == 1
+    # Points 0, 1, 2 form a cluster, point 3 stays free
+    assert solver.statistics["optimized_variables"] == 3 + 2
+
+    expected = [(0, 0), (5, 0), (5, 5), (0, 5)]
+    for p, (x, y) in zip(square[0], expected):
+        assert float(p.x) == pytest.approx(x, abs=1e-4)
+        assert float(p.y) == pytest.approx(y, abs=1e-4)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_rigid_clusters_match_full_problem(seed):
+    constraints = []
+    for i in range(3):
+        constraints.extend(triangulated_polygon(20 * i, 6, seed * 3 + i)[1])
+
+    solver, reduced = solved_values(constraints, True)
+    _, full = solved_values(constraints, False)
+
+    assert solver.statistics["rigid_clusters"] == 3
+    assert solver.statistics["optimized_variables"] == 3 * 3
+    assert numpy.max(numpy.abs(solver._evaluate_constraints(reduced))) < 1e-6
+    assert reduced == pytest.approx(full, abs=1e-4)
+
+
+def test_rigid_clusters_with_constructive(solver):
+    """ Cluster with enough points placed by the constructive stage is placed
+    as a whole, a cluster with a single placed coordinate is still moved as
+    a whole by the optimizer """
+    points1, polygon1 = triangulated_polygon(0, 6, 0)
+    points2, polygon2 = triangulated_polygon(20, 6, 1)
+    constraints = polygon1 + polygon2[3:]
+    constraints.append(Horizontal(points1[0], points2[0]))
+    constraints.append(Length(LineSegment(points1[0], points2[0]), 20))
+    constraints.append(AbsoluteAngle(LineSegment(points2[0], points2[1]), 30))
+    for c in constraints:
+        solver.add_constraint(c)
+    _, expected = solved_values(constraints, False)
+    solver.solve()
+
+    assert solver.statistics["constructive_variables"] == 12
+    assert solver.statistics["rigid_clusters"] == 1
+    assert solver.statistics["optimized_variables"] == 3
+    x = numpy.array([float(v) for v in solver._variables])
+    assert numpy.max(numpy.abs(solver._evaluate_constraints(x))) < 1e-6
+    assert x == pytest.approx(expected, abs=1e-4)
+
+
+def test_flexible_group_is_not_a_cluster(solver):
+    points = [Point(0, 0), Point(4, 0), Point(5, 3), Point(0, 3)]
+    for i in range(4):
+        solver.add_constraint(Length(LineSegment(points[i - 1], points[i]), 4))
+    solver.solve()
+
+    assert solver.statistics["rigid_clusters"] == 0
+    assert solver.statistics["optimized_variables"] == 8
+
+
+def test_rigid_parts_of_flexible_group(solver):
+    """ Two rigid triangles connected by a single length """
+    solver.constructive = False
+    points1, triangle1 = triangulated_polygon(0, 3, 0)
+    points2, triangle2 = triangulated_polygon(20, 3, 1)
+    # The second triangle is placed only relative to the first one
+    for c in triangle1 + triangle2[3:]:
+        solver.add_constraint(c)
+    solver.add_constraint(Length(LineSegment(points1[0], points2[0]), 15))
+    solver.add_constraint(Horizontal(points1[0], points2[0]))
+    solver.add_constraint(AbsoluteAngle(LineSegment(points2[0], points2[1]), 30))
+    solver.solve()
+
+    assert solver.statistics["rigid_clusters"] == 2
+    assert solver.statistics["optimized_variables"] == 6
+    assert float(points2[0].x) == pytest.approx(18, abs=1e-4)
+    x = numpy.array([float(v) for v in solver._variables])
+    assert numpy.max(numpy.abs(solver._evaluate_constraints(x))) < 1e-6
+
+
+def test_rigid_clusters_follow_changes(solver, square):
+    solver.constructive = False
+    points, lines = square
+    constraints = square_constraints(points, lines)
+    for c in constraints:
+        solver.add_constraint(c)
+    solver.solve()
+    assert solver.statistics["rigid_clusters"] == 1
+
+    # Without the right angle the remaining lengths are flexible.
+    # Moving a point makes sure that the solves are not skipped.
+    solver.remove_constraint(constraints[4])
+    solver.set_values({points[2].x: 6})
+    solver.solve()
+    assert solver.statistics["rigid_clusters"] == 1
+
+    solver.add_constraint(Length(LineSegment(points[0], points[2]), 5 * 2 ** 0.5))
+    solver.set_values({points[2].x: 6, points[2].y: 4})
+    solver.solve()
+    assert solver.statistics["rigid_clusters"] == 2
+    assert float(points[2].x) == pytest.approx(5, abs=1e-4)
+    assert float(points[2].y) == pytest.approx(5, abs=1e-4)
+
+
+def test_inconsistent_cluster_is_left_to_optimizer(solver):
+    """ Triangle whose sides violate the triangle inequality can't be solved
+    internally, the optimizer gets its constraints instead """
+    points = [Point(0, 0), Point(1, 0), Point(0, 1)]
+    for i, length in enumerate([1, 1, 5]):
+        solver.add_constraint(Length(LineSegment(points[i - 1], points[i]), length))
+    solver.solve()
+
+    assert solver.statistics["rigid_clusters"] == 0
+    assert solver.statistics["optimized_variables"] == 6
+
+
+def test_constructive_square(solver, square):
+    for c in square_constraints(*square):
+        solver.add_constraint(c)
+    solver.solve()
+
+    assert solver.statistics["constructive_variables"] == 8
+    assert solver.statistics["optimized_variables"] == 0
+    assert solver.statistics["iterations"] == 0
+    expected = [(0, 0), (5, 0), (5, 5), (0, 5)]
+    for p, (x, y) in zip(square[0], expected):
+        assert float(p.x) == pytest.approx(x, abs=1e-9)
+        assert float(p.y) == pytest.approx(y, abs=1e-9)
+
+
+@pytest.mark.parametrize("constructive", [False, True])
+def test_constructive_partial(constructive):
+    """ Segment placed by angle and length, followed by a chain of segments
+    with lengths only, which is left to the optimizer """
+    rng = numpy.random.RandomState(0)
+    points = [Point(3 * i + rng.uniform(-1, 1), rng.uniform(-1, 1)) for i in range(6)]
+    solver = Solver()
+    solver.auto_solve = False
+    solver.constructive = constructive
+    solver.rigid_clusters = False
+    solver.add_constraint(VariableFixed(points[0].x, 0))
+    solver.add_constraint(VariableFixed(points[0].y, 0))
+    solver.add_constraint(AbsoluteAngle(LineSegment(points[0], points[1]), 0))
+    for a, b in zip(points[:-1], points[1:]):
+        solver.add_constraint(Length(LineSegment(a, b), 3))
+    solver.solve()
+
+    assert solver.statistics["constructive_variables"] == (4 if constructive else 0)
+    assert solver.statistics["optimized_variables"] == (8 if constructive else 12)
+    assert float(points[1].x) == pytest.approx(3, abs=1e-6)
+    x = numpy.array([float(v) for v in solver._variables])
+    assert numpy.max(numpy.abs(solver._evaluate_constraints(x))) < 1e-6
+
+
+def test_constructive_conflict_is_left_to_optimizer(solver):
+    """ Placed values that violate another constraint disable the constructive
+    stage """
+    a = Point(0, 0)
+    b = Point(1, 1)
+    solver.add_constraint(VariableFixed(a.x, 0))
+    solver.add_constraint(VariableFixed(a.y, 0))
+    solver.add_constraint(VariableFixed(b.x, 1))
+    solver.add_constraint(VariablesEqual(a.x, b.x))
+    solver.solve()
+
+    assert solver.statistics["constructive_variables"] == 0
+    assert solver.statistics["optimized_variables"] == 3
+
+
+def test_solve_skipped_after_removal(solver, square):
+    constraints = square_constraints(*square)
+    for c in constraints:
+        solver.add_constraint(c)
+    solver.solve()
+    assert solver.statistics["solves"] == 1
+
+    solver.remove_constraint(constraints[-1])
+    solver.solve()
+    assert solver.statistics["solves"] == 1
+    assert solver.statistics["skipped_solves"] == 1
+
+
+def test_solve_skipped_for_satisfied_addition(solver, square):
+    points, lines = square
+    for c in square_constraints(points, lines):
+        solver.add_constraint(c)
+    solver.solve()
+
+    # Already satisfied by the solved square
+    solver.add_constraint(Length(LineSegment(points[0], points[2]), 5 * 2 ** 0.5))
+    solver.solve()
+    assert solver.statistics["skipped_solves"] == 1
+
+    solver.add_constraint(Length(LineSegment(points[1], points[3]), 8))
+    solver.solve()
+    assert solver.statistics["skipped_solves"] == 1
+    assert solver.statistics["solves"] == 2
+
+
+def test_solve_after_set_values(solver):
+    a = Point(0, 0)
+    b = Point(3, 4)
+    for c in [VariableFixed(a.x, 0), VariableFixed(a.y, 0)]:
+        solver.add_constraint(c)
+    solver.add_constraint(Length(LineSegment(a, b), 5))
+    solver.solve()
+    assert solver.statistics["solves"] == 1
+
+    # Still on the circle
+    solver.set_values({b.x: 4, b.y: 3})
+    solver.solve()
+    assert solver.statistics["solves"] == 1
+    assert solver.statistics["skipped_solves"] == 1
+
+    solver.set_values({b.x: 8, b.y: 6})
+    solver.solve()
+    assert solver.statistics["solves"] == 2
+    assert float(b.x) == pytest.approx(4, abs=1e-4)
+
+
+@pytest.mark.parametrize("offset", [0, 1e4, 1e7])
+def test_solve_after_set_values_far_from_origin(solver, offset):
+    a = Point(offset, 0)
+    b = Point(offset + 3, 4)
+    for c in [VariableFixed(a.x, offset), VariableFixed(a.y, 0)]:
+        solver.add_constraint(c)
+    solver.add_constraint(Length(LineSegment(a, b), 5))
+    solver.solve()
+
+    # Breaks the length by about 2 units
+    solver.set_values({b.x: offset + 5, b.y: 5})
+    solver.solve()
+    assert solver.statistics["skipped_solves"] == 0
+    assert numpy.hypot(float(b.x) - offset, float(b.y)) == pytest.approx(5, abs=1e-4)
+
+
+def test_solve_not_skipped_after_failure(solver):
+    a = Point(0, 0)
+    solver.add_constraint(VariableFixed(a.x, 0))
+    solver.add_constraint(VariableFixed(a.x, 1))
+    solver.solve()
+    solver.solve()
+    assert solver.statistics["solves"] == 2
+    assert solver.statistics["skipped_solves"] == 0
+
+
+@pytest.mark.parametrize("layout", ["records", "columns"])
+def test_threaded_evaluation(layout):
+    solver = Solver()
+    solver.auto_solve = False
+    solver.parameter_layout = layout
+    points = chain(solver, 25, True)
+    solver.add_constraint(
+        Perpendicular(
+            LineSegment(points[0], points[1]), LineSegment(points[1], points[2])
+        )
+    )
+    x = numpy.random.RandomState(0).uniform(0, 10, len(solver._variables))
+    stacked = numpy.stack([x, 2 * x])
+
+    expected = solver._evaluate_constraints(x)
+    expected_stacked = solver._evaluate_constraints(stacked)
+    expected_jacobian = solver._evaluate_constraint_jacobians(x)
+
+    solver.evaluation_threads = 4
+    solver.parallel_threshold = 10
+    assert solver._parallel()
+    assert solver._evaluate_constraints(x) == pytest.approx(expected)
+    assert solver._evaluate_constraints(stacked) == pytest.approx(expected_stacked)
+    assert solver._evaluate_constraint_jacobians(x) == pytest.approx(
+        expected_jacobian
+    )
+
+
+def test_threaded_solve():
+    solvers = []
+    for threads in [None, 3]:
+        solver = Solver()
+        solver.auto_solve = False
+        solver.evaluation_threads = threads
+        solver.parallel_threshold = 4
+        points = chain(solver, 10, False)
+        solver.solve()
+        solvers.append([float(v) for p in points for v in p])
+    assert solvers[0] == pytest.approx(solvers[1])
+
+
+def rounded_rectangle(solver, width, height, radius, seed):
+    """ Add a rectangle with filleted corners, starting from perturbed
+    positions. Only two sides have lengths, so that it isn't over constrained.
+    Returns list of (arc, line following it). """
+    rng = numpy.random.RandomState(seed)
+    corners = numpy.array([(0, 0), (width, 0), (width, height), (0, height)])
+    directions = numpy.array([(1, 0), (0, 1), (-1, 0), (0, -1)])
+    arcs = []
+    for corner, incoming, outgoing in zip(
+        corners, numpy.roll(directions, 1, axis=0), directions
+    ):
+        a, b = corner + radius * numpy.array([-incoming, outgoing])
+        a = a + rng.normal(scale=0.1, size=2)
+        b = b + rng.normal(scale=0.1, size=2)
+        arcs.append(Arc(Point(*a), Point(*b), Variable(0.3 * radius)))
+
+    ret = []
+    for i, arc in enumerate(arcs):
+        following = arcs[(i + 1) % len(arcs)]
+        line = LineSegment(arc.b, following.a)
+        ret.append((arc, line))
+
+        solver.add_constraint(ArcRadius(arc, radius))
+        solver.add_constraint(ArcTangent(arc, line))
+        solver.add_constraint(ArcTangent(following, line))
+        if i % 2:
+            solver.add_constraint(Vertical(line.a, line.b))
+        else:
+            solver.add_constraint(Horizontal(line.a, line.b))
+        if i < 2:
+            solver.add_constraint(Length(line, [width, height][i] - 2 * radius))
+
+    solver.add_constraint(VariableFixed(arcs[0].a.x, 0))
+    solver.add_constraint(VariableFixed(arcs[0].a.y, radius))
+    return ret
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_fillets(solver, seed):
+    shape = rounded_rectangle(solver, 10, 6, 1.5, seed)
+    solver.solve()
+
+    x = numpy.array([float(v) for v in solver._variables])
+    assert numpy.max(numpy.abs(solver._evaluate_constraints(x))) < 1e-6
+    expected_h = 1.5 * (1 - math.sqrt(0.5))
+    for arc, line in shape:
+        assert float(arc.h) == pytest.approx(expected_h, abs=1e-6)
+    assert float(shape[2][0].a.x) == pytest.approx(10, abs=1e-6)
+    assert float(shape[2][0].b.y) == pytest.approx(6, abs=1e-6)
+
+
+@pytest.mark.parametrize(
+    "cls, value, expected_h",
+    [(ArcRadius, 2, 2 - math.sqrt(3)), (ArcLength, 2.2, 0.393041508)],
+)
+def test_flat_arc_start(cls, value, expected_h):
+    """ Flat arc can't start bending, a small initial height picks the side """
+    for h, expected in [(0, 0), (1e-3, expected_h), (-1e-3, -expected_h)]:
+        solver = Solver()
+        solver.auto_solve = False
+        arc = Arc(Point(0, 0), Point(2, 0), Variable(h))
+        for variable, fixed in zip([arc.a.x, arc.a.y, arc.b.x, arc.b.y], [0, 0, 2, 0]):
+            solver.add_constraint(VariableFixed(variable, fixed))
+        constraint_id = solver.add_constraint(cls(arc, value))
+        solver.solve()
+
+        assert float(arc.h) == pytest.approx(expected, abs=1e-6)
+        assert list(solver.violated()) == ([constraint_id] if h == 0 else [])
+
+
+def test_analytic_jacobians(solver, monkeypatch):
+    """ Solver uses analytic derivatives where constraints have them and
+    they match autograd """
+    rounded_rectangle(solver, 10, 6, 1.5, 0)
+    solver.add_constraint(
+        PointOnArc(Arc(Point(0, 0), Point(3, 1), Variable(1)), Point(1, 2))
+    )
+    solver.add_constraint(ArcLength(Arc(Point(0, 0), Point(3, 1), Variable(-1)), 4))
+    x = numpy.array([float(v) for v in solver._variables])
+    stacked = numpy.stack([x, x + 0.5])
+
+    jacobian = solver._evaluate_constraint_jacobians(x)
+    batch = solver._evaluate_constraint_jacobians_batch(stacked)
+    for cls in [ArcLength, ArcRadius, ArcTangent, PointOnArc]:
+        monkeypatch.setattr(cls, "jacobian", None)
+
+    assert jacobian == pytest.approx(solver._evaluate_constraint_jacobians(x))
+    assert batch == pytest.approx(solver._evaluate_constraint_jacobians_batch(stacked))
+
+
+def test_autograd_batch_jacobians(solver, square, monkeypatch):
+    """ Batched autograd jacobians match jacobians of the single states, also
+    for variables used by several fields of the same row """
+    points, lines = square
+    for c in square_constraints(points, lines):
+        solver.add_constraint(c)
+    solver.add_constraint(Perpendicular(lines[0], lines[1]))  # Shares points[0]
+    for cls in [VariableFixed, AbsoluteAngle, Length, Perpendicular, VariablesEqual]:
+        monkeypatch.setattr(cls, "jacobian", None)
+
+    x = numpy.random.RandomState(1).normal(size=(4, len(solver._variables)))
+    batch = solver._evaluate_constraint_jacobians_batch(x)
+
+    assert batch.shape == (4, solver._constraint_count, len(solver._variables))
+    for i in range(4):
+        assert batch[i] == pytest.approx(solver._evaluate_constraint_jacobians(x[i]))
+
+
+def test_set_parameter(solver, square):
+    points, lines = square
+    constraints = square_constraints(points, lines)
+    for constraint in constraints:
+        solver.add_constraint(constraint)
+    length = next(c for c in constraints if isinstance(c, Length))
+    structure_version = solver._structure_version
+    solver.auto_solve = True
+    solves = solver.statistics["solves"]
+
+    solver.set_parameter(length, "length", 7)
+
+    assert length.length == 7
+    assert solver.statistics["solves"] == solves + 1
+    assert solver._structure_version > structure_version
+    assert numpy.hypot(
+        float(length.line.b.x) - float(length.line.a.x),
+        float(length.line.b.y) - float(length.line.a.y),
+    ) == pytest.approx(7, abs=1e-5)
+    assert solver._assert_internal_state()
+
+
+def test_set_parameter_angle_in_degrees(solver):
+    a = Point(0, 0)
+    b = Point(5, 0)
+    angle = AbsoluteAngle(LineSegment(a, b), 0)
+    for constraint in [
+        VariableFixed(a.x, 0),
+        VariableFixed(a.y, 0),
+        Length(LineSegment(a, b), 5),
+        angle,
+    ]:
+        solver.add_constraint(constraint)
+    solver.auto_solve = True
+
+    solver.set_parameter(angle, "angle", 90)
+    assert float(b.x) == pytest.approx(0, abs=1e-5)
+    assert float(b.y) == pytest.approx(5, abs=1e-5)
+
+
+def test_set_parameter_invalid(solver, square):
+    points, lines = square
+    length = Length(lines[0], 10)
+    with pytest.raises(ValueError):
+        solver.set_parameter(length, "length", 5)
+    solver.add_constraint(length)
+    with pytest.raises(ValueError):
+        solver.set_parameter(length, "ax", 5)
+    with pytest.raises(ValueError):
+        solver.set_parameter(length, "width", 5)
+    assert length.length == 10
+
+
+@pytest.mark.parametrize("value", ["abc", None, [1, 2]])
+def test_set_parameter_invalid_value(solver, square, value):
+    points, lines = square
+    length = Length(lines[0], 10)
+    angle = AbsoluteAngle(lines[1], 90)
+    solver.add_constraint(length)
+    solver.add_constraint(angle)
+    with pytest.raises((ValueError, TypeError)):
+        solver.set_parameter(length, "length", value)
+    with pytest.raises((ValueError, TypeError)):
+        solver.set_parameter(angle, "angle", value)
+
+    assert length.length == 10
+    assert angle.angle == 90
+    assert solver._assert_internal_state()
+    solver.set_parameter(length, "length", 5)
+    solver.solve()
+    a, b = lines[0].a, lines[0].b
+    assert numpy.hypot(
+        float(b.x) - float(a.x), float(b.y) - float(a.y)
+    ) == pytest.approx(5, abs=1e-4)
+
+
+def test_set_parameters(solver):
+    points = chain(solver, 6, True)
+    ids = numpy.arange(2, 8)  # Lengths of the chain, after the fixed point
+    solver.auto_solve = True
+    solves = solver.statistics["solves"]
+
+    solver.set_parameters(ids[::2], "length", [2, 3, 4])
+    solver.set_parameters(ids[1::2], "length", 1.5)
+
+    assert solver.statistics["solves"] == solves + 2
+    lengths = [
+        numpy.hypot(float(b.x) - float(a.x), float(b.y) - float(a.y))
+        for a, b in zip(points[:-1], points[1:])
+    ]
+    assert lengths == pytest.approx([2, 1.5, 3, 1.5, 4, 1.5], abs=1e-5)
+    assert solver._assert_internal_state()
+
+
+def test_set_parameters_invalid(solver, square):
+    chain(solver, 3, True)
+    constraint_id = solver.add_constraint(Perpendicular(*square[1][:2]))
+    before = solver._constraints[Length].parameter_array["length"].copy()
+
+    for ids, name in [
+        ([2, 2], "length"),  # Duplicate
+        ([2, 100], "length"),  # Unknown id
+        ([2, constraint_id], "length"),  # Has an object
+        ([2, 3], "ax"),  # Not numeric
+        ([0, 2], "length"),  # Not a parameter of VariableFixed
+    ]:
+        with pytest.raises(ValueError):
+            solver.set_parameters(ids, name, 3)
+    assert numpy.array_equal(
+        solver._constraints[Length].parameter_array["length"], before
+    )
+
+
+def distance(a, b):
+    return numpy.hypot(float(b.x) - float(a.x), float(b.y) - float(a.y))
+
+
+@pytest.mark.parametrize("constructive", [False, True])
+@pytest.mark.parametrize("rigid_clusters", [False, True])
+def test_suspend_constraints(solver, square, constructive, rigid_clusters):
+    points, lines = square
+    solver.constructive = constructive
+    solver.rigid_clusters = rigid_clusters
+    ids = [solver.add_constraint(c) for c in square_constraints(points, lines)]
+    solver.solve()
+    assert distance(points[1], points[2]) == pytest.approx(5, abs=1e-5)
+
+    # Length of lines[2]
+    solver.suspend_constraints([ids[5]])
+    assert list(solver.suspended_ids()) == [ids[5]]
+    solver.set_values({points[2].x: 0, points[2].y: 8})
+    solver.solve()
+    assert distance(points[1], points[2]) > 6
+    assert solver._constraint_count == len(ids)
+
+    solver.resume_constraints([ids[5]])
+    assert len(solver.suspended_ids()) == 0
+    solver.solve()
+    assert distance(points[1], points[2]) == pytest.approx(5, abs=1e-5)
+    assert float(points[2].x) == pytest.approx(float(points[1].x), abs=1e-5)
+
+
+def test_suspend_skips_and_resume_solves(solver, square):
+    points, lines = square
+    ids = [solver.add_constraint(c) for c in square_constraints(points, lines)]
+    solver.solve()
+    solves = solver.statistics["solves"]
+
+    solver.suspend_constraints(ids[3:4])
+    solver.solve()
+    assert solver.statistics["solves"] == solves
+
+    # Changing the parameter of a suspended constraint doesn't need a solve
+    solver.set_parameter(solver._constraint_objects[ids[3]], "length", 7)
+    solver.solve()
+    assert solver.statistics["solves"] == solves
+
+    solver.resume_constraints(ids[3:4])
+    solver.solve()
+    assert solver.statistics["solves"] == solves + 1
+    assert distance(points[0], points[1]) == pytest.approx(7, abs=1e-5)
+
+
+def test_suspended_constraints_are_not_clusters(solver):
+    _, constraints = triangulated_polygon(0, 6, 0)
+    ids = [solver.add_constraint(c) for c in constraints]
+    solver.constructive = False
+    solver.solve()
+    assert len(solver._clusters) == 1
+
+    # Without the last diagonal only four of the six points stay rigid
+    x = numpy.array([float(v) for v in solver._variables])
+    solver.suspend_constraints(ids[-1:])
+    assert [len(c) for c in solver._find_rigid_clusters(x)] == [4]
+    solver.resume_constraints(ids[-1:])
+    assert [len(c) for c in solver._find_rigid_clusters(x)] == [6]
+
+
+def test_multi_start_ignores_suspended(solver, square):
+    points, lines = square
+    solver.multi_start = 3
+    solver.multi_start_seed = 0
+    ids = [solver.add_constraint(c) for c in square_constraints(points, lines)]
+    # Contradicts the other length
+    conflict = solver.add_constraint(Length(lines[1], 20))
+    solver.suspend_constraints([conflict])
+    solver.solve()
+
+    x = numpy.array([float(v) for v in solver._variables])
+    errors = solver._evaluate_constraints(x)[solver._active_row_mask()]
+    assert numpy.max(numpy.abs(errors)) < 1e-6
+    assert len(ids) == numpy.count_nonzero(solver._active_row_mask())
+
+
+def test_groups(solver):
+    points = chain(solver, 200, True)
+    lengths = numpy.arange(2, 202)
+    solver.add_to_group("odd", lengths[1::2])
+    solver.add_to_group("all", lengths[::2])
+    solver.add_to_group("all", lengths[1::2])
+    assert list(solver.group("odd")) == list(lengths[1::2])
+    assert len(solver.group("all")) == 200
+
+    solver.suspend_group("all")
+    assert numpy.array_equal(solver.suspended_ids(), lengths)
+    solver.resume_group("odd")
+    assert numpy.array_equal(solver.suspended_ids(), lengths[::2])
+
+    solver.solve()
+    assert distance(points[1], points[2]) == pytest.approx(1, abs=1e-5)
+
+    # Removed constraints leave their groups and aren't suspended anymore
+    solver.remove_constraints(lengths[:4])
+    assert len(solver.group("all")) == 196
+    assert numpy.array_equal(solver.suspended_ids(), lengths[4::2])
+
+    solver.remove_group("odd")
+    with pytest.raises(KeyError):
+        solver.group("odd")
+    assert numpy.array_equal(solver.suspended_ids(), lengths[4::2])
+
+
+@pytest.mark.parametrize("ids", [[100], [-1]])
+def test_suspend_invalid(solver, square, ids):
+    chain(solver, 3, True)
+    with pytest.raises(ValueError):
+        solver.suspend_constraints(ids)
+    with pytest.raises(ValueError):
+        solver.add_to_group("group", ids)
+    assert len(solver.suspended_ids()) == 0
+
+
+def test_sparse_constraint_jacobians(solver, square):
+    points, lines = square
+    for constraint in square_constraints(points, lines):
+        solver.add_constraint(constraint)
+    rounded_rectangle(solver, 10, 6, 1.5, 0)
+    # Same variable in two fields of one row
+    solver.add_constraint(Length(LineSegment(Point(1, 2), points[1]), 3))
+    x = numpy.random.RandomState(0).uniform(0, 10, len(solver._variables))
+
+    sparse_jacobian = solver._sparse_constraint_jacobians(x)
+    assert sparse_jacobian.toarray() == pytest.approx(
+        solver._evaluate_constraint_jacobians(x)
+    )
+
+
+def perpendicular_corner(solver):
+    """ Two perpendicular segments from a fixed point with lengths, return
+    the points and the Length constraint of the first segment. """
+    points = [Point(0, 0), Point(4, 1), Point(-1, 5)]
+    length = Length(LineSegment(points[0], points[1]), 4)
+    for constraint in [
+        VariableFixed(points[0].x, 0),
+        VariableFixed(points[0].y, 0),
+        length,
+        Length(LineSegment(points[0], points[2]), 5),
+        Perpendicular(
+            LineSegment(points[0], points[1]), LineSegment(points[0], points[2])
+        ),
+    ]:
+        solver.add_constraint(constraint)
+    solver.solve()
+    return points, length
+
+
+@pytest.mark.parametrize("change", [0.01, 0.1])
+def test_predict_parameter(solver, change):
+    points, length = perpendicular_corner(solver)
+    before = [float(v) for p in points for v in p]
+
+    predicted = solver.predict_parameter(length, "length", 4 + change)
+    assert [float(v) for p in points for v in p] == before
+    assert length.length == 4
+
+    solver.set_parameter(length, "length", 4 + change)
+    solver.solve()
+    assert set(predicted) <= {v for p in points for v in p}
+    for variable, value in predicted.items():
+        # First order prediction, error is quadratic in the change
+        assert value == pytest.approx(float(variable), abs=2 * change ** 2)
+
+
+def test_predict_reuses_factorization(solver):
+    points, length = perpendicular_corner(solver)
+    for value in numpy.linspace(4, 5, 10):
+        solver.predict_parameter(length, "length", value)
+    assert solver.statistics["sensitivity_factorizations"] == 1
+    assert solver.statistics["predictions"] == 10
+
+    solver.set_values({points[2].x: -2})
+    solver.solve()
+    solver.predict_parameter(length, "length", 4.5)
+    assert solver.statistics["sensitivity_factorizations"] == 2
+
+
+def test_prediction_is_warm_start(solver):
+    points, length = perpendicular_corner(solver)
+    solver.predict_parameter(length, "length", 4.2)
+    solver.set_parameter(length, "length", 4.2)
+    solver.solve()
+    assert solver.statistics["warm_starts"] == 1
+    assert numpy.hypot(float(points[1].x), float(points[1].y)) == pytest.approx(
+        4.2, abs=1e-6
+    )
+
+    # A different change doesn't use the prediction
+    solver.predict_parameter(length, "length", 4.5)
+    solver.set_parameter(length, "length", 4.4)
+    solver.solve()
+    assert solver.statistics["warm_starts"] == 1
+
+
+def test_prediction_after_removal(solver):
+    points, length = perpendicular_corner(solver)
+    other = solver._constraint_objects[3]
+    solver.predict_parameter(length, "length", 6)
+    solver.remove_constraint(length)
+    solver.set_parameter(other, "length", 4)
+    solver.solve()
+    assert solver.statistics["warm_starts"] == 0
+    assert distance(points[0], points[2]) == pytest.approx(4, abs=1e-5)
+
+
+def test_predict_parameters(solver):
+    points = chain(solver, 5, True)
+    solver.add_constraints(
+        AbsoluteAngle,
+        ax=solver.variable_indices([points[0].x]),
+        ay=solver.variable_indices([points[0].y]),
+        bx=solver.variable_indices([points[1].x]),
+        by=solver.variable_indices([points[1].y]),
+        angle=[0.3],
+    )
+    solver.solve()
+
+    # Lengths are ids 2 to 6
+    predicted = solver.predict_parameters(numpy.arange(2, 7), "length", 1.01)
+    assert points[0].x not in predicted
+    assert points[-1].x in predicted
+
+    solver.set_parameters(numpy.arange(2, 7), "length", 1.01)
+    solver.solve()
+    assert solver.statistics["warm_starts"] == 1
+    for variable, value in predicted.items():
+        assert value == pytest.approx(float(variable), abs=5e-3)
+
+    with pytest.raises(ValueError):
+        solver.predict_parameters([0], "length", 1)
+
+
+def test_residuals(solver, square):
+    points, lines = square
+    ids = [solver.add_constraint(c) for c in square_constraints(points, lines)]
+    conflict = solver.add_constraint(Length(LineSegment(points[0], points[2]), 5))
+    residuals = solver.residuals()
+    assert numpy.all(numpy.isnan(residuals[Length][1]))
+    assert len(solver.violated()) == 0
+
+    solver.solve()
+    residuals = solver.residuals()
+    assert set(residuals) == set(solver._constraints)
+    for cls, (block_ids, values) in residuals.items():
+        block = solver._constraints[cls]
+        assert list(block_ids) == list(block.ids.array())
+        x = numpy.array([float(v) for v in solver._variables])
+        expected = cls.evaluate(x, block.parameter_array.array())
+        assert values == pytest.approx(expected)
+    assert conflict in solver.violated()
+    assert set(solver.violated()) <= set(ids + [conflict])
+
+    # Values come from the last solve, not from the current positions
+    before = solver.residuals()[VariableFixed][1]
+    solver.set_values({points[0].x: 3})
+    assert solver.residuals()[VariableFixed][1] == pytest.approx(before)
+
+
+def test_violated_tolerance(solver):
+    a = Point(0, 0)
+    ids = [
+        solver.add_constraint(VariableFixed(a.x, 0)),
+        solver.add_constraint(VariableFixed(a.x, 1e-3)),
+    ]
+    solver.scaling = False
+    solver.solve()
+    assert 0 < len(solver.violated()) <= 2
+    assert set(solver.violated()) <= set(ids)
+    assert len(solver.violated(2e-3)) == 0
+
+
+@pytest.mark.parametrize("offset", [0, 1e4, 1e5])
+def test_violated_far_from_origin(solver, offset):
+    a = Point(offset, 0)
+    b = Point(offset + 1, 0)
+    ids = [
+        solver.add_constraint(VariableFixed(a.x, offset)),
+        solver.add_constraint(VariableFixed(a.y, 0)),
+        solver.add_constraint(VariableFixed(b.x, offset + 1)),
+        solver.add_constraint(VariableFixed(b.y, 0)),
+        solver.add_constraint(Length(LineSegment(a, b), 1.01)),
+    ]
+    solver.solve()
+
+    # The conflict of 0.01 is spread over the constraints, but not hidden
+    x = numpy.array([float(v) for v in solver._variables])
+    assert numpy.max(numpy.abs(solver._evaluate_constraints(x))) > 1e-3
+    assert 0 < len(solver.violated())
+    assert set(solver.violated()) <= set(ids)
+
+
+def test_changed_violations(solver, square):
+    points, lines = square
+    for c in square_constraints(points, lines):
+        solver.add_constraint(c)
+    solver.solve()
+    ids, violated = solver.changed_violations()
+    assert len(ids) == 8
+    assert not numpy.any(violated)
+
+    solver.solve()
+    assert len(solver.changed_violations()[0]) == 0
+
+    conflict = Length(LineSegment(points[0], points[2]), 5)
+    solver.add_constraint(conflict)
+    solver.solve()
+    ids, violated = solver.changed_violations()
+    assert set(ids) == set(solver.violated())
+    assert numpy.all(violated)
+
+    solver.suspend_constraints(ids)
+    solver.solve()
+    suspended, violated = solver.changed_violations()
+    assert list(suspended) == list(ids)
+    assert not numpy.any(violated)
+    assert len(solver.violated()) == 0
+
+
+def test_residuals_after_removal(solver, square):
+    points, lines = square
+    constraints = square_constraints(points, lines)
+    ids = [solver.add_constraint(c) for c in constraints]
+    solver.solve()
+
+    # Removal moves the last row of the block, residuals follow their ids
+    solver.remove_constraint(constraints[3])
+    ids.remove(ids[3])
+    length_ids, values = solver.residuals()[Length]
+    assert list(length_ids) == [ids[4]]
+    assert values == pytest.approx([0], abs=1e-6)
+    solver.solve()
+    assert len(solver.changed_violations()[0]) == 0
+
+
+def rectangle_row(solver, count):
+    """ Row of 4x3 rectangles chained by lengths, returns side length constraints
+    and three corners of each rectangle """
+    sides = []
+    corners = []
+    previous = None
+    for i in range(count):
+        points = [
+            Point(10 * i, 0),
+            Point(10 * i + 4, 0),
+            Point(10 * i + 4, 3),
+            Point(10 * i, 3),
+        ]
+        lines = [LineSegment(points[j], points[(j + 1) % 4]) for j in range(4)]
+        rectangle_sides = [Length(lines[0], 4), Length(lines[1], 3)]
+        for constraint in rectangle_sides + [
+            Perpendicular(lines[0], lines[1]),
+            Horizontal(points[2], points[3]),
+            Vertical(points[3], points[0]),
+        ]:
+            solver.add_constraint(constraint)
+        if previous is None:
+            solver.add_constraint(VariableFixed(points[0].x, 0))
+            solver.add_constraint(VariableFixed(points[0].y, 0))
+        else:
+            solver.add_constraint(Length(LineSegment(previous[1], points[0]), 6))
+            solver.add_constraint(Horizontal(previous[1], points[0]))
+        previous = points
+        sides.append(rectangle_sides)
+        corners.append(points[:3])
+    return sides, corners
+
+
+def turn(a, b, c):
+    return (float(b.x) - float(a.x)) * (float(c.y) - float(b.y)) - (
+        float(b.y) - float(a.y)
+    ) * (float(c.x) - float(b.x))
+
+
+def test_continuation(solver):
+    sides, corners = rectangle_row(solver, 3)
+    solver.solve()
+    solver.continuation = True
+    for side in sides[1]:
+        solver.set_parameter(side, "length", side.length * 100)
+    solver.solve()
+
+    assert solver.statistics["continuation_steps"] > 1
+    assert distance(*corners[1][:2]) == pytest.approx(400, rel=1e-5)
+    assert distance(*corners[1][1:]) == pytest.approx(300, rel=1e-5)
+    for rectangle in corners:
+        assert turn(*rectangle) > 0
+
+    # Parameters end at their new values
+    lengths = solver._constraints[Length].parameter_array["length"]
+    assert sorted(lengths.tolist()) == sorted([4, 3, 6, 400, 300, 6, 4, 3])
+    assert solver._parameter_changes == {}
+
+
+def test_continuation_small_change_is_direct(solver):
+    sides, corners = rectangle_row(solver, 3)
+    solver.solve()
+    solver.continuation = True
+    solver.set_parameter(sides[0][0], "length", 5)
+    solver.solve()
+    assert solver.statistics["continuation_steps"] == 0
+    assert distance(*corners[0][:2]) == pytest.approx(5, abs=1e-5)
+
+
+def test_continuation_set_parameters(solver):
+    chain(solver, 3, True)
+    solver.solve()
+    solver.continuation = True
+    # Ids of the lengths
+    solver.set_parameters([2, 3, 4], "length", 100)
+    solver.set_parameters([2], "length", 50)
+    assert solver._parameter_changes == {
+        2: {"length": 1},
+        3: {"length": 1},
+        4: {"length": 1},
+    }
+    solver.solve()
+    assert solver.statistics["continuation_steps"] > 0
+    x = numpy.array([float(v) for v in solver._variables])
+    assert numpy.max(numpy.abs(solver._evaluate_constraints(x))) < 1e-4
+
+
+def test_parameter_changes_follow_removal(solver):
+    chain(solver, 3, True)
+    solver.solve()
+    solver.set_parameters([2, 3, 4], "length", 100)
+    solver.remove_constraints([3])
+    assert set(solver._parameter_changes) == {2, 4}
@@ -0,0 +1,202 @@
+# pylint: disable=redefined-outer-name
+# pylint: disable=W0212
+
+import math
+
+import numpy
+import pytest
+
+from parametric import *
+
+
+@pytest.fixture
+def index():
+    return SpatialIndex(cell_size=1)
+
+
+def test_nearest_point(index):
+    points = [Point(i, 2 * i) for i in range(10)]
+    for p in points:
+        index.add(p)
+
+    obj, distance = index.nearest(3.1, 6)
+    assert obj is points[3]
+    assert distance == pytest.approx(0.1)
+
+
+def test_nearest_far_away(index):
+    p = Point(0, 0)
+    index.add(p)
+
+    obj, distance = index.nearest(100, 0)
+    assert obj is p
+    assert distance == pytest.approx(100)
+
+
+def test_nearest_max_distance(index):
+    index.add(Point(0, 0))
+    assert index.nearest(100, 0, max_distance=10) is None
+
+
+def test_nearest_empty(index):
+    assert index.nearest(0, 0) is None
+
+
+def test_nearest_segment(index):
+    segment = LineSegment(Point(0, 0), Point(100, 0))
+    p = Point(50, 5)
+    index.add(segment)
+    index.add(p)
+
+    obj, distance = index.nearest(50, 1)
+    assert obj is segment
+    assert distance == pytest.approx(1)
+
+
+@pytest.mark.parametrize(
+    "h, query, expected_distance",
+    [
+        (1, (1, -1), 0),  # Arc midpoint
+        (1, (1, 1), math.hypot(1, 1)),  # Mirrored midpoint is closest to endpoints
+        (-1, (1, 1), 0),
+        (1, (1, -2), 1),
+        (0, (1, 0.5), 0.5),  # Flat arc
+    ],
+)
+def test_nearest_arc(index, h, query, expected_distance):
+    arc = Arc(Point(0, 0), Point(2, 0), Variable(h))
+    index.add(arc)
+
+    obj, distance = index.nearest(*query)
+    assert obj is arc
+    assert distance == pytest.approx(expected_distance)
+
+
+def test_query_box(index):
+    inside = Point(1, 1)
+    outside = Point(5, 5)
+    crossing = LineSegment(Point(-10, 0.5), Point(10, 0.5))
+    missing = LineSegment(Point(-10, 10), Point(10, 30))
+    for obj in [inside, outside, crossing, missing]:
+        index.add(obj)
+
+    assert set(index.query_box(0, 0, 2, 2)) == {inside, crossing}
+    assert index.query_box(0, 0, 2, 2, contained=True) == [inside]
+
+
+def test_query_box_polyline(index):
+    polyline = Polyline([(0, 0), (1, 0), (1, 1), (0, 1)])
+    index.add(polyline)
+
+    assert index.query_box(0.5, 0.5, 2, 2) == [polyline]
+    assert index.query_box(0.2, 0.2, 0.8, 0.8) == []
+    assert index.query_box(-1, -1, 2, 2, contained=True) == [polyline]
+    assert index.query_box(-1, -1, 0.5, 2, contained=True) == []
+
+
+def test_query_box_arc(index):
+    arc = Arc(Point(0, 0), Point(2, 0), Variable(1))
+    index.add(arc)
+
+    assert index.query_box(0.9, -1.1, 1.1, -0.9) == [arc]
+    assert index.query_box(0.9, -0.5, 1.1, -0.1) == []
+    assert index.query_box(-0.1, -1.1, 2.1, 0.1, contained=True) == [arc]
+    assert index.query_box(-0.1, -0.9, 2.1, 0.1, contained=True) == []
+
+
+def test_remove(index):
+    a = Point(0, 0)
+    b = Point(1, 0)
+    index.add(a)
+    index.add(b)
+    index.remove(a)
+
+    assert index.nearest(0, 0)[0] is b
+    assert len(index) == 1
+
+    c = Point(0.1, 0)
+    index.add(c)  # Reuses the freed slot
+    assert index.nearest(0, 0)[0] is c
+
+
+def test_double_add(index):
+    p = Point(0, 0)
+    index.add(p)
+    with pytest.raises(ValueError):
+        index.add(p)
+
+
+def test_remove_missing(index):
+    with pytest.raises(ValueError):
+        index.remove(Point(0, 0))
+
+
+def test_update(index):
+    p = Point(0, 0)
+    q = Point(5, 5)
+    index.add(p)
+    index.add(q)
+
+    p.x._value = 20
+    index.update([p.x])
+
+    assert index.nearest(20, 0)[0] is p
+    assert index.query_box(-1, -1, 1, 1) == []
+
+
+def test_large_primitives(index):
+    segment = LineSegment(Point(0, 0), Point(1000, 1000))
+    index.add(segment)
+    assert segment_is_large(index)
+
+    assert index.query_box(499.5, 499.5, 500.5, 500.5) == [segment]
+    assert index.nearest(500, 501)[0] is segment
+
+
+def segment_is_large(index):
+    return len(index._large) == 1 and len(index._grid) == 0
+
+
+def test_solver_updates():
+    solver = Solver()
+    index = SpatialIndex(solver, cell_size=1)
+
+    a = Point(0, 0)
+    b = Point(3, 0)
+    segment = LineSegment(a, b)
+    index.add(segment)
+
+    solver.add_constraint(VariableFixed(a.x, 0))
+    solver.add_constraint(VariableFixed(a.y, 0))
+    solver.add_constraint(AbsoluteAngle(segment, 0))
+    solver.add_constraint(Length(segment, 10))
+
+    assert float(b.x) == pytest.approx(10, abs=1e-3)
+    assert index.query_box(9.5, -0.5, 10.5, 0.5) == [segment]
+    assert index.query_box(-0.5, -0.5, 10.5, 0.5, contained=True) == [segment]
+
+    index.close()
+    assert solver._listeners == []
+
+
+def test_random_against_brute_force():
+    rng = numpy.random.RandomState(0)
+    index = SpatialIndex(cell_size=3)
+    segments = [
+        LineSegment(Point(*rng.uniform(0, 100, 2)), Point(*rng.uniform(0, 100, 2)))
+        for _ in range(200)
+    ]
+    for s in segments:
+        index.add(s)
+
+    for x, y in rng.uniform(-10, 110, (20, 2)):
+        obj, distance = index.nearest(x, y)
+        expected = min(
+            index._segment_distances(
+                numpy.array([[float(s.a.x), float(s.a.y)]]),
+                numpy.array([[float(s.b.x), float(s.b.y)]]),
+                numpy.array([x, y]),
+            )[0]
+            for s in segments
+        )
+        assert distance == pytest.approx(expected)
@@ -0,0 +1,60 @@
+import numpy
+import pytest
+
+from parametric import testing
+
+
+def test_random_sketch_is_deterministic():
+    a = testing.random_sketch(5)
+    b = testing.random_sketch(5)
+    assert numpy.array_equal(a.points, b.points)
+    assert a.operations == b.operations
+    assert a.operations[-1] == ("solve",)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_modes_match_reference(seed):
+    results = testing.compare(testing.random_sketch(seed))
+    assert list(results) == ["reference"] + list(testing.modes)
+    testing.check(results)
+
+
+@pytest.mark.parametrize("offset", [(2e4, 0), (-1e5, 3e4)])
+def test_translated_sketch(offset):
+    """ Modes behave the same far from the origin """
+    sketch = testing.random_sketch(4)
+    translated = sketch.translated(*offset)
+    assert translated.size() == pytest.approx(sketch.size())
+    testing.check(testing.compare(translated))
+
+
+def test_check_reports_difference():
+    results = testing.compare(
+        testing.random_sketch(0), {"no_scaling": {"scaling": False}}
+    )
+    broken = results["no_scaling"]._replace(difference=1.0)
+    results["no_scaling"] = broken
+    with pytest.raises(AssertionError):
+        testing.check(results)
+
+
+def test_check_path_dependent_modes():
+    results = testing.compare(
+        testing.random_sketch(1), {"continuation": testing.modes["continuation"]}
+    )
+    results["continuation"] = results["continuation"]._replace(difference=1.0)
+    testing.check(results)
+
+    results["continuation"] = results["continuation"]._replace(error=1.0)
+    with pytest.raises(AssertionError):
+        testing.check(results)
+
+
+def test_random_sketch_edits():
+    sketch = testing.random_sketch(3, edits=2)
+    edits = [operation for operation in sketch.operations if operation[0] == "set"]
+    assert len(edits) == 2
+    for _, i, value in edits:
+        kind, _, length = sketch.operations[i][1:]
+        assert kind == "length"
+        assert 0.8 * length <= value <= 1.2 * length
@@ -0,0 +1,79 @@
+# pylint: disable=redefined-outer-name
+# pylint: disable=W0212
+
+import numpy
+import pytest
+
+from parametric.util import ColumnarArray, DynamicArray
+
+dtype = [("a", numpy.uint32), ("b", numpy.float64), ("c", numpy.uint32)]
+
+
+@pytest.fixture
+def arrays():
+    """ The same content in columnar and record layout """
+    columnar = ColumnarArray(dtype)
+    records = DynamicArray(dtype)
+    for i in range(50):
+        columnar.append((i, i / 2, 2 * i))
+        records.append((i, i / 2, 2 * i))
+    return columnar, records
+
+
+def test_requires_structured_dtype():
+    with pytest.raises(ValueError):
+        ColumnarArray(numpy.float64)
+
+
+def test_reservation_is_split():
+    columnar = ColumnarArray(dtype, storage="mmap", reserved_bytes=1600)
+    columns = columnar.column_arrays()
+    assert [len(column._array) for column in columns.values()] == [100] * 3
+    assert sum(column._array.nbytes for column in columns.values()) == 1600
+
+
+def test_columns_are_contiguous(arrays):
+    columnar, records = arrays
+    for name in columnar.dtype.names:
+        assert columnar[name].flags.c_contiguous
+        assert columnar[name].dtype == records[name].dtype
+        assert list(columnar[name]) == list(records[name])
+        assert list(columnar.array()[name]) == list(records.array()[name])
+
+
+def test_rows(arrays):
+    columnar, records = arrays
+    assert len(columnar) == len(records)
+    for i in [0, 10, -1]:
+        assert columnar[i] == records[i]
+        assert columnar[i]["b"] == records[i]["b"]
+    assert list(columnar) == list(records)
+
+    with pytest.raises(IndexError):
+        columnar[len(columnar)]  # noqa
+
+
+def test_setitem(arrays):
+    columnar, records = arrays
+    for array in arrays:
+        array[3] = array[len(array) - 1]
+        array["c"][5] = 7
+
+    assert list(columnar) == list(records)
+
+
+def test_pop(arrays):
+    columnar, records = arrays
+    while len(columnar):
+        assert columnar.pop() == records.pop()
+
+    with pytest.raises(IndexError):
+        columnar.pop()
+
+
+def test_extend(arrays):
+    columnar, records = arrays
+    values = numpy.array([(100 + i, i, i) for i in range(20)], dtype=dtype)
+    columnar.extend(values)
+    records.extend(values)
+    assert list(columnar) == list(records)
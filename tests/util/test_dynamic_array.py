@@ -1,6 +1,9 @@
 # pylint: disable=redefined-outer-name
 # pylint: disable=W0212
 
+import subprocess
+import sys
+
 import numpy
 import pytest
 
@@ -127,3 +130,163 @@ def test_record_dtype():
 
     assert list(array["a"]) == list(range(100))
     assert list(array["b"] - 0.5) == list(range(100))
+
+
+@pytest.mark.parametrize("storage", [None, "mmap", "shared"])
+def test_storage(storage):
+    array = DynamicArray(dtype=int, storage=storage, size_hint=10)
+    array.extend(range(5))
+    view = array.array()
+
+    array.extend(range(5, 100))
+    for i in range(90):
+        array.pop()
+
+    assert list(array) == list(range(10))
+    assert list(view) == list(range(5))  # Views stay valid across reallocations
+    array.close()
+
+
+@pytest.mark.parametrize("storage", ["mmap", "shared"])
+def test_reserved_storage_does_not_copy(storage):
+    array = DynamicArray(dtype=float, storage=storage, size_hint=1000)
+    internal = array._array
+    for i in range(1000):
+        array.append(i)
+    for i in range(990):
+        array.pop()
+    array.shrink()
+    assert array._array is internal
+    array.close()
+
+
+@pytest.mark.parametrize("storage", ["mmap", "shared"])
+def test_reservation_size(storage):
+    array = DynamicArray(dtype=float, storage=storage, reserved_bytes=800)
+    assert len(array._array) == 100
+    array.close()
+
+    array = DynamicArray(dtype=numpy.uint8, storage=storage)
+    assert len(array._array) == DynamicArray.reserved_bytes
+    array.close()
+
+
+@pytest.mark.parametrize("storage", ["mmap", "shared"])
+def test_exceeding_reservation_copies(storage):
+    array = DynamicArray(dtype=float, storage=storage, reserved_bytes=80)
+    array.extend(numpy.arange(10.0))
+    assert array.reallocations == 0
+    array.append(10)
+    assert array.reallocations == 1
+    assert list(array) == list(range(11))
+    array.close()
+
+
+def test_object_dtype_storage():
+    with pytest.raises(ValueError):
+        DynamicArray(dtype=object, storage="mmap")
+
+
+def test_unknown_storage():
+    with pytest.raises(ValueError):
+        DynamicArray(dtype=int, storage="disk")
+
+
+def test_shared_attach():
+    array = DynamicArray(dtype=[("a", numpy.int32), ("b", float)], storage="shared")
+    for i in range(10):
+        array.append((i, i / 2))
+
+    code = "\n".join(
+        [
+            "import sys, numpy",
+            "from parametric.util import DynamicArray",
+            "array = DynamicArray.attach(",
+            "    sys.argv[1], [('a', numpy.int32), ('b', float)], int(sys.argv[2])",
+            ")",
+            "print(array['a'].sum(), array['b'].sum())",
+            "array[0] = (-1, 0)",
+            "array.close()",
+        ]
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code, array.name, str(len(array))],
+        stdout=subprocess.PIPE,
+        check=True,
+        universal_newlines=True,
+        timeout=60,
+    )
+
+    assert result.stdout.split() == ["45", "22.5"]
+    assert tuple(array[0]) == (-1, 0)
+    array.close()
+
+
+def test_extend_length_mismatch():
+    class Liar:
+        def __len__(self):
+            return 10
+
+        def __iter__(self):
+            return iter(range(3))
+
+    da = DynamicArray(dtype=int)
+    da.extend(Liar())
+    assert list(da) == [0, 1, 2]
+
+
+@pytest.mark.parametrize("size_hint", [None, 1000])
+def test_extend_iterator_preallocates(size_hint):
+    da = DynamicArray(dtype=int, size_hint=0)
+    values = (i for i in range(1000))
+    da.extend(values, size_hint=size_hint)
+
+    assert list(da) == list(range(1000))
+    if size_hint is None:
+        assert da.reallocations > 1  # Generators don't have a length hint
+    else:
+        assert da.reallocations == 1
+
+
+def test_extend_length_hint():
+    da = DynamicArray(dtype=int, size_hint=0)
+    da.extend(iter(range(1000)))
+    assert da.reallocations == 1
+
+
+def test_statistics():
+    da = DynamicArray(dtype=numpy.int32, size_hint=10)
+    da.extend(range(10))
+    assert da.reallocations == 0
+    da.append(10)
+    assert da.reallocations == 1
+    assert da.bytes_copied == 10 * 4
+
+
+@pytest.mark.parametrize(
+    "growth_factor, shrink_threshold", [(1.5, 0.4), (2, 0.25), (1.25, 0.5)]
+)
+def test_hysteresis(growth_factor, shrink_threshold):
+    da = DynamicArray(
+        dtype=int, growth_factor=growth_factor, shrink_threshold=shrink_threshold
+    )
+    for size in range(1, 500):
+        # Alternating append and pop at every size
+        da.extend(range(size - len(da)))
+        reallocations = da.reallocations
+        for _ in range(5):
+            da.append(0)
+            da.pop()
+            da.pop()
+            da.append(0)
+        assert da.reallocations - reallocations <= 2
+
+
+@pytest.mark.parametrize(
+    "growth_factor, shrink_threshold", [(1, 0.1), (0.5, 0.1), (2, 0.5), (1.5, 0.9)]
+)
+def test_invalid_policy(growth_factor, shrink_threshold):
+    with pytest.raises(ValueError):
+        DynamicArray(
+            dtype=int, growth_factor=growth_factor, shrink_threshold=shrink_threshold
+        )
@@ -0,0 +1,182 @@
+# pylint: disable=redefined-outer-name
+# pylint: disable=W0212
+
+import collections
+
+import numpy
+import pytest
+
+from parametric.util import Incidence
+
+
+@pytest.fixture
+def incidence():
+    ret = Incidence()
+    for i in range(5):
+        ret.add_row()
+        for j in range(i):
+            ret.append(i, 10 * i + j)
+    yield ret
+    assert ret._assert_internal_state()
+
+
+def test_add_row(incidence):
+    assert incidence.add_row() == 5
+    assert len(incidence) == 6
+    assert list(incidence.row(5)) == []
+
+
+def test_append_grows(incidence):
+    for j in range(100):
+        incidence.append(2, j)
+    assert incidence.row_size(2) == 102
+    assert sorted(incidence.row(2)) == sorted([20, 21] + list(range(100)))
+    assert sorted(incidence.row(3)) == [30, 31, 32]
+
+
+def test_append_duplicate(incidence):
+    incidence.append(1, 10)
+    assert list(incidence.row(1)) == [10, 10]
+
+
+def test_remove(incidence):
+    incidence.remove(4, 41)
+    assert sorted(incidence.row(4)) == [40, 42, 43]
+
+
+def test_remove_one_occurence(incidence):
+    incidence.append(1, 10)
+    incidence.remove(1, 10)
+    assert list(incidence.row(1)) == [10]
+
+
+def test_remove_missing(incidence):
+    with pytest.raises(ValueError):
+        incidence.remove(4, 1000)
+
+
+def test_pop_row(incidence):
+    assert incidence.pop_row(1) == 1
+    assert len(incidence) == 4
+    assert sorted(incidence.row(1)) == [40, 41, 42, 43]
+
+
+def test_pop_last_row(incidence):
+    assert incidence.pop_row() == 4
+    assert len(incidence) == 4
+    assert sorted(incidence.row(3)) == [30, 31, 32]
+
+
+def test_pop_row_out_of_range(incidence):
+    with pytest.raises(IndexError):
+        incidence.pop_row(5)
+
+
+def test_to_csr(incidence):
+    indptr, indices = incidence.to_csr()
+    assert list(indptr) == [0, 0, 1, 3, 6, 10]
+    for i in range(5):
+        assert sorted(indices[indptr[i] : indptr[i + 1]]) == [10 * i + j for j in range(i)]
+
+
+def test_compact(incidence):
+    for j in range(20):
+        incidence.append(0, j)
+    before = [sorted(incidence.row(i)) for i in range(len(incidence))]
+    incidence.compact()
+    assert incidence._waste == 0
+    assert [sorted(incidence.row(i)) for i in range(len(incidence))] == before
+
+
+def test_random_operations():
+    rng = numpy.random.RandomState(0)
+    incidence = Incidence()
+    reference = []
+
+    for _ in range(2000):
+        op = rng.randint(4)
+        if op == 0 or not reference:
+            incidence.add_row()
+            reference.append(collections.Counter())
+        elif op == 1:
+            row = rng.randint(len(reference))
+            item = rng.randint(10)
+            incidence.append(row, item)
+            reference[row][item] += 1
+        elif op == 2:
+            row = rng.randint(len(reference))
+            if reference[row]:
+                item = rng.choice(list(reference[row].elements()))
+                incidence.remove(row, item)
+                reference[row][item] -= 1
+                reference[row] += collections.Counter()
+        else:
+            row = rng.randint(len(reference))
+            assert incidence.pop_row(row) == row
+            reference[row] = reference[-1]
+            reference.pop()
+
+        assert incidence._assert_internal_state()
+
+    assert len(incidence) == len(reference)
+    for i, expected in enumerate(reference):
+        assert collections.Counter(incidence.row(i).tolist()) == expected
+
+
+def test_payloads():
+    incidence = Incidence(payload_dtype=numpy.uint8)
+    incidence.add_row()
+    for i in range(10):
+        incidence.append(0, 7, i)  # Same item with different payloads
+    incidence.remove(0, 7, 3)
+
+    assert list(incidence.row(0)) == [7] * 9
+    assert sorted(incidence.payloads(0)) == [0, 1, 2, 4, 5, 6, 7, 8, 9]
+    assert incidence._assert_internal_state()
+
+
+def test_payloads_survive_compaction():
+    incidence = Incidence(payload_dtype=numpy.int64)
+    for i in range(50):
+        incidence.add_row()
+        for j in range(i % 7):
+            incidence.append(i, j, 100 * i + j)
+    for i in range(0, 20, 2):
+        incidence.pop_row(i)
+    incidence.compact()
+
+    for i in range(len(incidence)):
+        row = incidence.row(i)
+        payloads = incidence.payloads(i)
+        assert len(set(payloads // 100)) <= 1
+        assert list(payloads % 100) == list(row)
+    assert incidence._assert_internal_state()
+
+
+def test_extend_matches_append():
+    rng = numpy.random.RandomState(0)
+    rows = rng.randint(10, size=200)
+    items = rng.randint(1000, size=200)
+    payloads = rng.randint(4, size=200)
+
+    extended = Incidence(payload_dtype=numpy.uint8)
+    appended = Incidence(payload_dtype=numpy.uint8)
+    for incidence in [extended, appended]:
+        for i in range(10):
+            incidence.add_row()
+        incidence.append(3, 5, 1)
+
+    extended.extend(rows, items, payloads)
+    for row, item, payload in zip(rows, items, payloads):
+        appended.append(row, item, payload)
+
+    for row in range(10):
+        assert sorted(zip(extended.row(row), extended.payloads(row))) == sorted(
+            zip(appended.row(row), appended.payloads(row))
+        )
+    assert extended._assert_internal_state()
+
+
+def test_extend_empty(incidence):
+    incidence.extend([], [])
+    assert incidence.row_size(4) == 4
@@ -38,9 +38,11 @@ def test_clear():
     d._assert_internal_state()
 
 
-@pytest.fixture()
-def d():
-    ret = IndexedDict([(chr(ord("a") + i), 10 + i) for i in range(5)])
+@pytest.fixture(params=[False, True], ids=["dense", "tombstones"])
+def d(request):
+    ret = IndexedDict(
+        [(chr(ord("a") + i), 10 + i) for i in range(5)], tombstones=request.param
+    )
     yield ret
     ret._assert_internal_state()
 
@@ -298,3 +300,98 @@ def test_none_key(d):
     d[None] = None
     assert d[None] is None
     assert list(d) == list("abcde") + [None]
+
+
+def test_tombstone_indices_stable():
+    d = IndexedDict([(i, i) for i in range(10)], tombstones=True, compaction_threshold=0.9)
+    del d[3]
+    d.pop(index=5)
+    assert d.index(9) == 9
+    assert d.get(index=3) is None
+    with pytest.raises(IndexError):
+        d.key(3)
+    assert len(d) == 8
+    assert list(d) == [0, 1, 2, 4, 6, 7, 8, 9]
+    d._assert_internal_state()
+
+
+def test_tombstone_compaction():
+    mappings = []
+    d = IndexedDict(
+        [(i, i) for i in range(10)],
+        tombstones=True,
+        compaction_threshold=0.25,
+        on_compact=mappings.append,
+    )
+    del d[1]
+    del d[2]
+    assert not mappings
+    del d[5]
+    assert len(mappings) == 1
+    assert list(mappings[0]) == [0, -1, -1, 3 - 2, 4 - 2, -1, 6 - 3, 7 - 3, 8 - 3, 9 - 3]
+    assert [d.index(k) for k in d] == list(range(7))
+    d._assert_internal_state()
+
+
+def test_tombstone_popitem_first():
+    d = IndexedDict([(i, i) for i in range(100)], tombstones=True)
+    for i in range(100):
+        assert d.popitem(last=False) == (i, i)
+        d._assert_internal_state()
+    assert len(d) == 0
+
+
+def test_tombstone_move_to_end():
+    d = IndexedDict([(i, i) for i in range(5)], tombstones=True)
+    d.move_to_end(1)
+    assert list(d) == [0, 2, 3, 4, 1]
+    assert d.index(1) == 5
+    assert d.key(-1) == 1
+    d._assert_internal_state()
+
+
+@pytest.mark.parametrize("tombstones", [False, True])
+def test_delete_many(tombstones):
+    d = IndexedDict([(i, str(i)) for i in range(10)], tombstones=tombstones)
+    old_indices = {k: d.index(k) for k in d}
+    mapping = d.delete_many(keys=[2, 7], indices=[0, -1])
+
+    assert list(d) == [1, 3, 4, 5, 6, 8]
+    for k, old_index in old_indices.items():
+        if k in d:
+            assert d.index(k) == mapping[old_index]
+        else:
+            assert mapping[old_index] == -1
+    d._assert_internal_state()
+
+
+def test_delete_many_missing():
+    d = IndexedDict([(i, str(i)) for i in range(10)])
+    with pytest.raises(KeyError):
+        d.delete_many(keys=[2, 20])
+    assert len(d) == 10
+
+
+@pytest.mark.parametrize("tombstones", [False, True])
+@pytest.mark.parametrize("seed", range(5))
+def test_fast_pop_many(tombstones, seed):
+    import random
+
+    rng = random.Random(seed)
+    d = IndexedDict([(i, str(i)) for i in range(30)], tombstones=tombstones)
+    keys = rng.sample(range(30), 12)
+    old_indices = {k: d.index(k) for k in d}
+
+    values, moved_from, moved_to = d.fast_pop_many(keys=keys)
+
+    assert sorted(values) == sorted(str(k) for k in keys)
+    assert set(d) == set(range(30)) - set(keys)
+    moves = dict(zip(moved_from, moved_to))
+    for k in d:
+        assert d.index(k) == moves.get(old_indices[k], old_indices[k])
+    d._assert_internal_state()
+
+
+def test_invalid_compaction_threshold():
+    with pytest.raises(ValueError):
+        IndexedDict(tombstones=True, compaction_threshold=0)